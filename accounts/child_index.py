@@ -0,0 +1,211 @@
+"""Columnar, in-memory index of active children for fast audience-size estimates.
+
+Evaluating `get_child_eligibility_for_study` means expanding and testing every child
+one at a time in Python. For a live estimate while a researcher is editing a study,
+we instead keep one compact numpy array per child attribute, and evaluate criteria
+expressions as vectorized masks compiled from the same QUERY_GRAMMAR.
+
+The index is rebuilt periodically by `studies.tasks.build_child_index` and shared
+between processes through the Django cache. Each process keeps the last index it
+loaded, and only fetches the (multi-MB) arrays again once a newer build is stored.
+"""
+import io
+import time
+from datetime import date
+
+import numpy
+from django.core.cache import cache
+
+from accounts.models import Child
+from accounts.queries import (
+    GENDER_CODES,
+    _gestational_age_enum_value_to_weeks,
+    compile_expression_to_mask,
+)
+from studies.fields import popcount_array
+
+CHILD_INDEX_CACHE_KEY = "accounts.child_index"
+CHILD_INDEX_BUILT_AT_CACHE_KEY = "accounts.child_index.built_at"
+# Twice the beat interval, so a single failed rebuild doesn't empty the cache.
+CHILD_INDEX_CACHE_TIMEOUT = 2 * 60 * 60
+CHILD_INDEX_BUILD_QUEUED_CACHE_KEY = "accounts.child_index.build_queued"
+# How long a queued build has to store the index before another is queued.
+CHILD_INDEX_BUILD_QUEUED_TIMEOUT = 10 * 60
+
+# Stored in place of a null gestational age enum.
+NO_GESTATIONAL_AGE = -1
+
+# Lookup table from gestational age enum (offset by one, so that the null sentinel
+# lands on index 0) to weeks, with NaN wherever the expanded child would have None.
+_WEEKS_BY_ENUM = numpy.array(
+    [numpy.nan]
+    + [
+        _gestational_age_enum_value_to_weeks(enum_value) or numpy.nan
+        for enum_value in range(18)
+    ]
+)
+
+# The index this process last loaded from the cache.
+_loaded_child_index = None
+
+
+class ChildIndex:
+    """Array-backed snapshot of the children we could recruit.
+
+    Only active children (not deleted, belonging to an active account) with a known
+    birthday are included - a child without a birthday is never in the age range of
+    a study, so could never count towards an estimate.
+    """
+
+    COLUMNS = ("birthdays", "genders", "gestational_ages", "languages", "conditions")
+
+    def __init__(
+        self, birthdays, genders, gestational_ages, languages, conditions, built_at
+    ):
+        self.birthdays = numpy.asarray(birthdays, dtype=numpy.int32)
+        self.genders = numpy.asarray(genders, dtype=numpy.int8)
+        self.gestational_ages = numpy.asarray(gestational_ages, dtype=numpy.int8)
+        self.languages = numpy.asarray(languages, dtype=numpy.int64).view(numpy.uint64)
+        self.conditions = numpy.asarray(conditions, dtype=numpy.int64).view(
+            numpy.uint64
+        )
+        self.built_at = built_at
+
+    def __len__(self):
+        return len(self.birthdays)
+
+    @classmethod
+    def build(cls, children_queryset=None):
+        """Build the index with a single pass over the children table.
+
+        Args:
+            children_queryset: Optional Child queryset to index, defaulting to all
+                active children.
+
+        Returns:
+            A ChildIndex.
+        """
+        if children_queryset is None:
+            children_queryset = Child.objects.filter(
+                deleted=False, user__is_active=True
+            )
+
+        rows = children_queryset.filter(birthday__isnull=False).values_list(
+            "birthday",
+            "gender",
+            "gestational_age_at_birth",
+            "languages_spoken",
+            "existing_conditions",
+        )
+
+        birthdays, genders, gestational_ages, languages, conditions = (
+            [] for _ in cls.COLUMNS
+        )
+        for birthday, gender, gestational_age, spoken, existing in rows.iterator():
+            birthdays.append(birthday.toordinal())
+            genders.append(GENDER_CODES.get(gender, 0))
+            gestational_ages.append(
+                NO_GESTATIONAL_AGE if gestational_age is None else gestational_age
+            )
+            languages.append(int(spoken))
+            conditions.append(int(existing))
+
+        return cls(
+            birthdays, genders, gestational_ages, languages, conditions, time.time()
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        with numpy.load(io.BytesIO(data)) as arrays:
+            return cls(
+                *(arrays[column] for column in cls.COLUMNS),
+                built_at=float(arrays["built_at"]),
+            )
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        numpy.savez(
+            buffer,
+            birthdays=self.birthdays,
+            genders=self.genders,
+            gestational_ages=self.gestational_ages,
+            languages=self.languages.view(numpy.int64),
+            conditions=self.conditions.view(numpy.int64),
+            built_at=numpy.float64(self.built_at),
+        )
+        return buffer.getvalue()
+
+    def store(self):
+        cache.set_many(
+            {
+                CHILD_INDEX_CACHE_KEY: self.to_bytes(),
+                CHILD_INDEX_BUILT_AT_CACHE_KEY: self.built_at,
+            },
+            CHILD_INDEX_CACHE_TIMEOUT,
+        )
+
+    @classmethod
+    def load(cls):
+        """Get the most recently built index, or None if there isn't one.
+
+        Building the index means reading every child, which is no job for a web
+        request, so if there's none a build is queued instead (unless one has been
+        already, in the last CHILD_INDEX_BUILD_QUEUED_TIMEOUT).
+        """
+        global _loaded_child_index
+
+        built_at = cache.get(CHILD_INDEX_BUILT_AT_CACHE_KEY)
+        if built_at is not None:
+            if (
+                _loaded_child_index is not None
+                and _loaded_child_index.built_at == built_at
+            ):
+                return _loaded_child_index
+            data = cache.get(CHILD_INDEX_CACHE_KEY)
+            if data is not None:
+                _loaded_child_index = cls.from_bytes(data)
+                return _loaded_child_index
+        if cache.add(
+            CHILD_INDEX_BUILD_QUEUED_CACHE_KEY, True, CHILD_INDEX_BUILD_QUEUED_TIMEOUT
+        ):
+            from studies.tasks import build_child_index
+
+            build_child_index.delay()
+        return None
+
+    @property
+    def age_in_days(self):
+        return date.today().toordinal() - self.birthdays
+
+    @property
+    def gestational_age_in_weeks(self):
+        return _WEEKS_BY_ENUM[self.gestational_ages.astype(numpy.intp) + 1]
+
+    @property
+    def language_counts(self):
+        return popcount_array(self.languages.view(numpy.int64))
+
+    def eligibility_mask(
+        self, criteria_expression: str, min_age_in_days: int, max_age_in_days: int
+    ):
+        """Vectorized equivalent of get_child_eligibility_for_study.
+
+        Raises:
+            lark.exceptions.LarkError: if the criteria expression can't be parsed.
+        """
+        age_in_days = self.age_in_days
+        in_age_range = (min_age_in_days <= age_in_days) & (
+            age_in_days <= max_age_in_days
+        )
+        return in_age_range & compile_expression_to_mask(criteria_expression)(self)
+
+    def count_eligible(
+        self, criteria_expression: str, min_age_in_days: int, max_age_in_days: int
+    ) -> int:
+        return int(
+            numpy.count_nonzero(
+                self.eligibility_mask(
+                    criteria_expression, min_age_in_days, max_age_in_days
+                )
+            )
+        )
@@ -7,6 +7,7 @@ from functools import reduce
 from itertools import chain
 from operator import attrgetter
 
+import numpy
 from django.db import models
 from django.db.models import F, Q
 from lark import Lark, Transformer, v_args
@@ -17,6 +18,20 @@ CONST_MAPPING = {"true": True, "false": False, "null": None}
 
 GENDER_MAPPING = {"male": "m", "female": "f", "other": "o"}
 
+# Integer codes for Child.gender in the columnar child index. 0 is reserved for
+# stored values we don't recognize, -1 for query targets we don't recognize.
+GENDER_CODES = {"m": 1, "f": 2, "o": 3, "na": 4}
+
+LANGUAGE_BITS = {
+    f"speaks_{language_tuple[0]}": 1 << bit_index
+    for bit_index, language_tuple in enumerate(LANGUAGES)
+}
+
+CONDITION_BITS = {
+    condition_tuple[0]: 1 << bit_index
+    for bit_index, condition_tuple in enumerate(CONDITIONS)
+}
+
 CONDITION_FIELDS = {condition_tuple[0] for condition_tuple in CONDITIONS}
 
 LANGUAGE_FIELDS = {f"speaks_{language_tuple[0]}" for language_tuple in LANGUAGES}
@@ -161,6 +176,42 @@ def compile_expression(boolean_algebra_expression: str):
     return temp_namespace["property_tester"]
 
 
+def compile_expression_to_mask(boolean_algebra_expression: str):
+    """Compiles a boolean algebra expression into a vectorized predicate.
+
+    This is the columnar counterpart of compile_expression: rather than testing
+    one expanded child at a time, the compiled function takes an
+    accounts.child_index.ChildIndex and returns a boolean numpy array with one
+    entry per indexed child.
+
+    Args:
+        boolean_algebra_expression: a string boolean algebra expression.
+
+    Returns:
+        A function.
+
+    Raises:
+        lark.exceptions.ParseError: in case we cannot parse the boolean algebra.
+    """
+    if boolean_algebra_expression:
+        parse_tree = QUERY_DSL_PARSER.parse(boolean_algebra_expression)
+        func_body = MaskTransformer().transform(parse_tree)
+    else:
+        func_body = "numpy.ones(len(index), dtype=bool)"
+
+    func_text = " ".join(["def mask_builder(index):  return", func_body])
+
+    code_object = ast.parse(func_text, mode="exec")
+
+    new_func = compile(code_object, filename="temp.py", mode="exec")
+
+    temp_namespace = {"numpy": numpy}
+
+    exec(new_func, temp_namespace)
+
+    return temp_namespace["mask_builder"]
+
+
 def _get_expanded_child(child_object):
     """Expands a child object such that it can be evaluated easily.
 
@@ -245,9 +296,11 @@ class FunctionTransformer(Transformer):
             #     error message.
             return f"child_obj.get('gestational_age_in_weeks') {comparator} None"
         else:
+            # Parenthesized so that the conditional expression doesn't swallow any
+            # clauses that follow it in an AND/OR.
             return (
-                f"child_obj.get('gestational_age_in_weeks') {comparator} {num_weeks} "
-                "if child_obj.get('gestational_age_in_weeks') else False"
+                f"(child_obj.get('gestational_age_in_weeks') {comparator} {num_weeks} "
+                "if child_obj.get('gestational_age_in_weeks') else False)"
             )
 
     def age_in_days_comparison(self, comparator, num_days):
@@ -276,6 +329,57 @@ class FunctionTransformer(Transformer):
         return f"not {bool_factor}"
 
 
+@v_args(inline=True)
+class MaskTransformer(Transformer):
+    """Same grammar as FunctionTransformer, but emits numpy array expressions."""
+
+    def bool_expr(self, bool_term, *others):
+        return f"({' | '.join((bool_term, *others))})"
+
+    def bool_term(self, bool_factor, *others):
+        return f"({' & '.join((bool_factor, *others))})"
+
+    def gender_comparison(self, comparator, target_gender):
+        return f"(index.genders {'==' if comparator == '=' else comparator} {target_gender})"
+
+    def gestational_age_comparison(self, comparator, num_weeks):
+        """False if no_answer is provided, mirroring FunctionTransformer."""
+        if num_weeks.lower() in ("na", "n/a"):
+            if comparator == "==":
+                return "numpy.isnan(index.gestational_age_in_weeks)"
+            elif comparator == "!=":
+                return "(~numpy.isnan(index.gestational_age_in_weeks))"
+            else:
+                return "numpy.zeros(len(index), dtype=bool)"
+        else:
+            return (
+                f"(~numpy.isnan(index.gestational_age_in_weeks) & "
+                f"(index.gestational_age_in_weeks {comparator} {num_weeks}))"
+            )
+
+    def age_in_days_comparison(self, comparator, num_days):
+        return f"(index.age_in_days {comparator} {num_days})"
+
+    def language_comparison(self, lang_target):
+        return f"((index.languages & numpy.uint64({LANGUAGE_BITS[lang_target]})) != 0)"
+
+    def condition_comparison(self, condition_target):
+        return f"((index.conditions & numpy.uint64({CONDITION_BITS[condition_target]})) != 0)"
+
+    def language_count_comparison(self, comparator, num_langs):
+        return f"(index.language_counts {comparator} {num_langs})"
+
+    def gender_target(self, gender):
+        gender = gender.lower()
+        return str(GENDER_CODES.get(GENDER_MAPPING.get(gender, gender), -1))
+
+    def comparator(self, relation):
+        return "==" if relation == "=" else relation
+
+    def not_bool_factor(self, bool_factor):
+        return f"(~{bool_factor})"
+
+
 class BitfieldQuerySet(models.QuerySet):
     """A QuerySet that can handle bitwise queries intelligently.
 
@@ -5,6 +5,7 @@ from django.contrib.auth.models import AnonymousUser
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sessions.backends.db import SessionStore
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.http import HttpRequest
 from django.test import TestCase
@@ -14,6 +15,12 @@ from django_dynamic_fixture import G
 from lark.exceptions import UnexpectedCharacters
 
 from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
+from accounts.child_index import (
+    CHILD_INDEX_BUILD_QUEUED_CACHE_KEY,
+    CHILD_INDEX_BUILT_AT_CACHE_KEY,
+    CHILD_INDEX_CACHE_KEY,
+    ChildIndex,
+)
 from accounts.models import Child, DemographicData, GoogleAuthenticatorTOTP, User
 from accounts.queries import get_child_eligibility, get_child_eligibility_for_study
 from studies.fields import GESTATIONAL_AGE_CHOICES
@@ -653,6 +660,108 @@ class CriteriaExpressionTestCase(TestCase):
         )
 
 
+class ChildIndexTestCase(TestCase):
+    def setUp(self):
+        today = datetime.date.today()
+        self.children = [
+            G(
+                Child,
+                existing_conditions=Child.existing_conditions.deaf,
+                gender="m",
+                languages_spoken=Child.languages_spoken.en,
+                birthday=today - datetime.timedelta(days=3 * 365),
+            ),
+            G(
+                Child,
+                existing_conditions=Child.existing_conditions.multiple_birth,
+                gender="f",
+                languages_spoken=Child.languages_spoken.fr | Child.languages_spoken.ja,
+                gestational_age_at_birth=GESTATIONAL_AGE_CHOICES.twenty_five_weeks,
+                birthday=today - datetime.timedelta(days=400),
+            ),
+            G(
+                Child,
+                existing_conditions=Child.existing_conditions.deaf
+                | Child.existing_conditions.dyslexia,
+                gender="o",
+                languages_spoken=Child.languages_spoken.en
+                | Child.languages_spoken.nl
+                | Child.languages_spoken.ko,
+                gestational_age_at_birth=GESTATIONAL_AGE_CHOICES.thirty_five_weeks,
+                birthday=today - datetime.timedelta(days=10 * 365),
+            ),
+            G(
+                Child,
+                gender="na",
+                gestational_age_at_birth=GESTATIONAL_AGE_CHOICES.no_answer,
+                birthday=today - datetime.timedelta(days=30),
+            ),
+        ]
+        self.child_index = ChildIndex.build(
+            Child.objects.filter(id__in=[child.id for child in self.children]).order_by(
+                "id"
+            )
+        )
+        self.expressions = [
+            "",
+            "deaf",
+            "((deaf OR hearing_impairment) OR NOT speaks_en) AND (age_in_days >= 365 AND age_in_days <= 1095)",
+            "gestational_age_in_weeks <= 28 AND gestational_age_in_weeks > 24",
+            "gestational_age_in_weeks = na",
+            "gender = male OR gender = OTHER",
+            "gender != na",
+            "num_languages < 6 AND n_languages > 1",
+            "deaf AND dyslexia AND age_in_days >= 1000",
+        ]
+
+    def test_masks_match_child_eligibility(self):
+        for expression in self.expressions:
+            mask = self.child_index.eligibility_mask(expression, 0, 100 * 365)
+            self.assertEqual(
+                list(mask),
+                [get_child_eligibility(child, expression) for child in self.children],
+                f"Mismatch for criteria expression {expression!r}",
+            )
+
+    def test_age_range_used(self):
+        self.assertEqual(self.child_index.count_eligible("", 365, 3 * 365), 2)
+        self.assertEqual(self.child_index.count_eligible("deaf", 365, 3 * 365), 1)
+
+    def test_load_queues_build_when_missing(self):
+        cache.delete_many(
+            [
+                CHILD_INDEX_CACHE_KEY,
+                CHILD_INDEX_BUILT_AT_CACHE_KEY,
+                CHILD_INDEX_BUILD_QUEUED_CACHE_KEY,
+            ]
+        )
+        with patch("studies.tasks.build_child_index") as build_child_index:
+            self.assertIsNone(ChildIndex.load())
+            self.assertIsNone(ChildIndex.load())
+        build_child_index.delay.assert_called_once_with()
+        self.child_index.store()
+        self.assertEqual(len(ChildIndex.load()), len(self.children))
+
+    def test_load_reuses_index_until_rebuilt(self):
+        self.child_index.store()
+        first = ChildIndex.load()
+        with patch.object(ChildIndex, "from_bytes") as from_bytes:
+            self.assertIs(ChildIndex.load(), first)
+        from_bytes.assert_not_called()
+
+        rebuilt = ChildIndex.build(Child.objects.filter(pk=self.children[0].pk))
+        rebuilt.store()
+        self.assertEqual(len(ChildIndex.load()), 1)
+
+    def test_round_trip_through_bytes(self):
+        restored = ChildIndex.from_bytes(self.child_index.to_bytes())
+        for expression in self.expressions:
+            self.assertEqual(
+                restored.count_eligible(expression, 0, 100 * 365),
+                self.child_index.count_eligible(expression, 0, 100 * 365),
+            )
+
+
 class EligibilityTestCase(TestCase):
     def setUp(self):
         self.study_type = G(StudyType, name="default", id=1)
@@ -1,6 +1,10 @@
+import base64
 from collections import OrderedDict
 
-from rest_framework.pagination import PageNumberPagination
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination, _positive_int
 from rest_framework.utils.urls import replace_query_param
 from rest_framework.views import Response
 
@@ -51,3 +55,93 @@ class PageNumberPagination(PageNumberPagination):
                 ),
             }
         )
+
+
+class DateModifiedCursorPagination(PageNumberPagination):
+    """
+    Keyset pagination over (date_modified, id), newest first, for clients that pass
+    a `cursor` query parameter (empty for the first page). Unlike page numbers, it
+    never counts the whole queryset, and (with Response's indexes on these columns)
+    every page costs the same however deep into the results it is. Without a cursor,
+    falls back to page numbers.
+    """
+
+    cursor_query_param = "cursor"
+    cursor_max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            self.cursor_page = None
+            return super().paginate_queryset(queryset, request, view=view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = request.query_params[self.cursor_query_param]
+        queryset = queryset.order_by("-date_modified", "-id")
+        if cursor:
+            date_modified, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(date_modified__lt=date_modified)
+                | Q(date_modified=date_modified, id__lt=pk)
+            )
+
+        # Fetch one extra to find out whether there's a next page.
+        self.cursor_page = list(queryset[: page_size + 1])
+        self.next_cursor = None
+        if len(self.cursor_page) > page_size:
+            del self.cursor_page[page_size:]
+            last = self.cursor_page[-1]
+            self.next_cursor = self.encode_cursor(last.date_modified, last.id)
+        return self.cursor_page
+
+    def get_page_size(self, request):
+        if self.cursor_query_param not in request.query_params:
+            return super().get_page_size(request)
+        # Cursor pages may be bigger, as they're cheap to fetch.
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+                cutoff=self.cursor_max_page_size,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    @staticmethod
+    def encode_cursor(date_modified, pk):
+        position = f"{date_modified.isoformat()}|{pk}"
+        return base64.urlsafe_b64encode(position.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            position = base64.urlsafe_b64decode(cursor.encode()).decode()
+            date_modified, pk = position.split("|")
+            date_modified = parse_datetime(date_modified)
+            if date_modified is None:
+                raise ValueError(position)
+            return date_modified, int(pk)
+        except (TypeError, ValueError):
+            raise NotFound("Invalid cursor")
+
+    def build_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request and self.request.build_absolute_uri() or ""
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        if self.cursor_page is None:
+            return super().get_paginated_response(data)
+
+        return Response(
+            {
+                "results": data,
+                "links": OrderedDict(
+                    [
+                        ("first", self.build_cursor_link("")),
+                        ("next", self.build_cursor_link(self.next_cursor)),
+                    ]
+                ),
+            }
+        )
@@ -1,7 +1,151 @@
+import io
+import zlib
+
+import brotli
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError, UnsupportedMediaType
 from rest_framework_json_api import parsers
 
 from api import utils as api_utils
 
+# How much of a compressed request body is read from the client at a time.
+COMPRESSED_CHUNK_SIZE = 64 * 1024
+
+
+class RequestBodyTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Decompressed request body is too large."
+    default_code = "request_body_too_large"
+
+
+class GzipDecompressor:
+    def __init__(self):
+        # Adding 16 to wbits makes zlib expect a gzip header and trailer.
+        self._decompressobj = zlib.decompressobj(zlib.MAX_WBITS | 16)
+
+    @property
+    def eof(self):
+        return self._decompressobj.eof
+
+    @property
+    def needs_input(self):
+        # Whatever zlib hasn't decompressed yet is handed back as unconsumed input.
+        return True
+
+    def decompress(self, data, max_length):
+        """Decompress up to `max_length` bytes of `data`, returning them and whatever
+        input is left over."""
+        output = self._decompressobj.decompress(data, max_length)
+        if self._decompressobj.eof:
+            return output, self._decompressobj.unused_data
+        return output, self._decompressobj.unconsumed_tail
+
+
+class BrotliDecompressor:
+    def __init__(self):
+        self._decompressor = brotli.Decompressor()
+        self._output_pending = False
+
+    @property
+    def eof(self):
+        return self._decompressor.is_finished()
+
+    @property
+    def needs_input(self):
+        # Brotli holds back what it decompresses past the output buffer, so only
+        # take more input once a call with none gives nothing more.
+        return not self._output_pending and self._decompressor.can_accept_more_data()
+
+    def decompress(self, data, max_length):
+        """Decompress about `max_length` bytes, returning them and whatever input is
+        left over.
+
+        Brotli takes all the input it's given, and its output may go up to a block
+        past `max_length`.
+        """
+        if self.needs_input:
+            data, input_data = b"", data
+        else:
+            input_data = b""
+        output = self._decompressor.process(input_data, output_buffer_limit=max_length)
+        self._output_pending = bool(output)
+        return output, data
+
+
+DECOMPRESSORS = {
+    "gzip": GzipDecompressor,
+    "x-gzip": GzipDecompressor,
+    "br": BrotliDecompressor,
+}
+
+
+class DecompressingStream(io.RawIOBase):
+    """Readable stream of the decompressed content of a compressed stream.
+
+    The compressed stream is read and decompressed a chunk at a time as this one is
+    read, so neither the whole of the compressed nor the decompressed content has to
+    be held at once by the reader. Raises RequestBodyTooLarge as soon as more than
+    `max_size` bytes come out, however small the compressed input.
+    """
+
+    def __init__(self, stream, decompressor, max_size):
+        self.stream = stream
+        self.decompressor = decompressor
+        self.max_size = max_size
+        self.size = 0
+        self._input = b""
+        self._output = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._output:
+            if self.decompressor.eof:
+                if self._input or self.stream.read(1):
+                    raise ParseError("Unexpected data after compressed request body.")
+                return 0
+            if not self._input and self.decompressor.needs_input:
+                self._input = self.stream.read(COMPRESSED_CHUNK_SIZE)
+                if not self._input:
+                    raise ParseError("Compressed request body is truncated.")
+            try:
+                self._output, self._input = self.decompressor.decompress(
+                    self._input, max(1, min(len(buffer), self.max_size - self.size + 1))
+                )
+            except Exception as exc:
+                raise ParseError(f"Could not decompress request body - {exc}")
+            self.size += len(self._output)
+            if self.size > self.max_size:
+                raise RequestBodyTooLarge
+
+        size = min(len(buffer), len(self._output))
+        buffer[:size] = self._output[:size]
+        self._output = self._output[size:]
+        return size
+
+
+def get_decompressing_stream(stream, content_encoding):
+    """Wrap a request body stream to undo its Content-Encoding, if it has one.
+
+    Only a single coding is accepted; requests with any other raise
+    UnsupportedMediaType (415).
+    """
+    content_coding = content_encoding.strip().lower()
+    if content_coding in ("", "identity"):
+        return stream
+    try:
+        decompressor_class = DECOMPRESSORS[content_coding]
+    except KeyError:
+        raise UnsupportedMediaType(
+            content_encoding,
+            detail=f'Unsupported content encoding "{content_encoding}" in request.',
+        )
+    return DecompressingStream(
+        stream, decompressor_class(), settings.MAX_DECOMPRESSED_REQUEST_BODY_SIZE
+    )
+
 
 class JSONAPIParser(parsers.JSONParser):
     @staticmethod
@@ -14,3 +158,14 @@ class JSONAPIParser(parsers.JSONParser):
             if data.get("attributes")
             else dict()
         )
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """
+        Decompresses gzip and br encoded request bodies as they're parsed.
+        """
+        request = (parser_context or {}).get("request")
+        if stream is not None and request is not None:
+            stream = get_decompressing_stream(
+                stream, request.META.get("HTTP_CONTENT_ENCODING", "")
+            )
+        return super().parse(stream, media_type, parser_context)
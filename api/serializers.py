@@ -13,6 +13,11 @@ from rest_framework_json_api.serializers import (
     ModelSerializer,
 )
 
+from project.fields.datetime_aware_jsonfield import (
+    LazyDecodedJSON,
+    get_value_for_output,
+)
+
 
 # Related fields only.
 class UuidRelatedField(PrimaryKeyRelatedField):
@@ -104,6 +109,27 @@ class PatchedHyperlinkedRelatedField(
     """"Shoo-in for rest_framework_json_api.relations.HyperlinkedRelatedField, with better get_links behavior."""
 
 
+# JSON fields.
+class PassthroughJSONField(serializers.JSONField):
+    """JSONField for a DateTimeAwareJSONField whose value may be output undecoded.
+
+    Where the context has "raw_json" set, i.e. the view knows its renderer splices
+    raw JSON, a value that's not been decoded yet is left as the LazyDecodedJSON the
+    model instance was loaded with, so the JSON text from the database goes into the
+    response without being decoded and encoded again.
+    """
+
+    def get_attribute(self, instance):
+        if self.context.get("raw_json") and len(self.source_attrs) == 1:
+            return get_value_for_output(instance, self.source)
+        return super().get_attribute(instance)
+
+    def to_representation(self, value):
+        if isinstance(value, LazyDecodedJSON):
+            return value
+        return super().to_representation(value)
+
+
 # Serializers.
 class UuidHyperlinkedModelSerializer(HyperlinkedModelSerializer):
     """Ensuring that pk is never shown, but UUID is used instead.
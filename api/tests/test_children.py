@@ -194,6 +194,40 @@ class ChildrenTestCase(APITestCase):
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
         self.assertEqual(api_response.data["given_name"], "Jane")
 
+    def testGetOwnChildDetailConditional(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(self.child_with_consent_detail_url)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        etag = api_response["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+
+        api_response = self.client.get(
+            self.child_with_consent_detail_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(api_response["ETag"], etag)
+
+        # No timestamp on children, so any change to its data changes the ETag.
+        self.child_with_consented_response.given_name = "Sal"
+        self.child_with_consented_response.save()
+        api_response = self.client.get(
+            self.child_with_consent_detail_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(api_response["ETag"], etag)
+
+    def testGetChildrenListConditional(self):
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.url)["ETag"]
+
+        api_response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Someone else asking with the same ETag doesn't get a 304.
+        self.client.force_authenticate(user=self.researcher)
+        api_response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
     def testGetChildDetailResearcher(self):
         # A researcher can see their child, regardless of consent coding status
         self.participant.is_researcher = True
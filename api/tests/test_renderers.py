@@ -0,0 +1,185 @@
+import os
+import timeit
+from unittest import skipUnless
+
+from django.urls import reverse
+from django.utils import timezone
+from django_dynamic_fixture import G
+from guardian.shortcuts import assign_perm
+from rest_framework import status
+from rest_framework.test import APIClient, APITestCase
+
+from accounts.models import Child, DemographicData, User
+from api.renderers import FastJsonApiWithUuidRenderer, JsonApiWithUuidRenderer
+from studies.models import ConsentRuling, Feedback, Lab, Response, Study, StudyType
+from studies.permissions import StudyPermission
+
+
+def _exp_data(frames):
+    return {
+        f"{n}-video-frame": {
+            "frameType": "DEFAULT",
+            "eventTimings": [
+                {
+                    "eventType": "exp-video:videoStarted",
+                    "timestamp": "2020-10-09T15:31:05.123Z",
+                    "streamTime": 12.5 + n,
+                    "tiny": 1.5e-07,
+                }
+                for _ in range(10)
+            ],
+            "comment": '¿Qué tal?   "quoted" \\ ✓',
+            "selection": [1, 2, 3, None, True],
+        }
+        for n in range(frames)
+    }
+
+
+class RendererTestCase(APITestCase):
+    def setUp(self):
+        self.researcher = G(User, is_active=True, is_researcher=True)
+        self.participant = G(User, is_active=True)
+        self.demographics = G(DemographicData, user=self.participant)
+        self.child = G(Child, user=self.participant)
+        self.study_type = G(StudyType, name="default", id=1)
+        self.lab = G(Lab, name="MIT")
+        self.study = G(
+            Study,
+            creator=self.researcher,
+            study_type=self.study_type,
+            lab=self.lab,
+            name="Ünïcode study",
+            state="active",
+            public=True,
+        )
+        self.responses = [
+            G(
+                Response,
+                child=self.child,
+                study=self.study,
+                completed_consent_frame=True,
+                demographic_snapshot=self.demographics if n % 2 else None,
+                exp_data=_exp_data(5),
+                sequence=[f"{frame}-video-frame" for frame in range(5)],
+                global_event_timings=[
+                    {"eventType": "nextFrame", "timestamp": timezone.now()}
+                ],
+            )
+            for n in range(12)
+        ]
+        for response in self.responses:
+            G(ConsentRuling, response=response, action="accepted")
+        self.feedback = G(
+            Feedback, response=self.responses[0], researcher=self.researcher
+        )
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        assign_perm(
+            StudyPermission.READ_STUDY_DETAILS.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.researcher)
+
+    def assertRendersSameAsJsonApiWithUuidRenderer(self, api_response):
+        self.assertIsInstance(
+            api_response.accepted_renderer, FastJsonApiWithUuidRenderer
+        )
+        self.assertEqual(
+            api_response.content,
+            JsonApiWithUuidRenderer().render(
+                api_response.data,
+                api_response.accepted_media_type,
+                api_response.renderer_context,
+            ),
+        )
+
+    def testResponseListRendersIdentically(self):
+        api_response = self.client.get(
+            reverse("api:response-list", kwargs={"version": "v1"}), {"page_size": 20},
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(api_response.json()["data"]), 12)
+        self.assertRendersSameAsJsonApiWithUuidRenderer(api_response)
+
+    def testResponseDetailRendersIdentically(self):
+        api_response = self.client.get(
+            reverse(
+                "api:response-detail",
+                kwargs={"version": "v2", "uuid": self.responses[1].uuid},
+            )
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertRendersSameAsJsonApiWithUuidRenderer(api_response)
+
+    def testSparseFieldsetRendersIdentically(self):
+        api_response = self.client.get(
+            reverse("api:response-list", kwargs={"version": "v1"}),
+            {"fields[responses]": "sequence,child,completed"},
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertRendersSameAsJsonApiWithUuidRenderer(api_response)
+
+    def testOtherResourcesRenderIdentically(self):
+        for url in (
+            reverse("api:study-list", kwargs={"version": "v1"}),
+            reverse("api:feedback-list", kwargs={"version": "v1"}),
+            reverse("api:user-list", kwargs={"version": "v1"}),
+            reverse("api:child-list", kwargs={"version": "v1"}),
+            reverse("api:lab-list", kwargs={"version": "v1"}),
+            reverse("api:demographicdata-list", kwargs={"version": "v1"}),
+        ):
+            with self.subTest(url=url):
+                api_response = self.client.get(url)
+                self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+                self.assertRendersSameAsJsonApiWithUuidRenderer(api_response)
+
+    def testErrorsRenderIdentically(self):
+        api_response = self.client.get(
+            reverse(
+                "api:response-detail",
+                kwargs={
+                    "version": "v1",
+                    "uuid": "00000000-0000-0000-0000-000000000000",
+                },
+            )
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertRendersSameAsJsonApiWithUuidRenderer(api_response)
+
+    @skipUnless(os.environ.get("BENCHMARK_RENDERERS"), "set BENCHMARK_RENDERERS to run")
+    def testBenchmarkResponseListRendering(self):
+        for n in range(88):
+            response = G(
+                Response,
+                child=self.child,
+                study=self.study,
+                completed_consent_frame=True,
+                exp_data=_exp_data(40),
+            )
+            G(ConsentRuling, response=response, action="accepted")
+        api_response = self.client.get(
+            reverse("api:response-list", kwargs={"version": "v1"}), {"page_size": 100},
+        )
+        self.assertEqual(len(api_response.json()["data"]), 100)
+
+        seconds = {}
+        for renderer in (JsonApiWithUuidRenderer(), FastJsonApiWithUuidRenderer()):
+            seconds[type(renderer)] = min(
+                timeit.repeat(
+                    lambda: renderer.render(
+                        api_response.data,
+                        api_response.accepted_media_type,
+                        api_response.renderer_context,
+                    ),
+                    number=10,
+                    repeat=5,
+                )
+            )
+        self.assertLess(
+            seconds[FastJsonApiWithUuidRenderer], seconds[JsonApiWithUuidRenderer]
+        )
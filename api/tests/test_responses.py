@@ -1,16 +1,34 @@
+import gzip
 import json
+import threading
 import uuid
+from unittest.mock import patch
 
-from django.test import TestCase
+import brotli
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django_dynamic_fixture import G
 from guardian.shortcuts import assign_perm
 from rest_framework import status
-from rest_framework.test import APIClient, APITestCase
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
 
 from accounts.models import Child, DemographicData, User
-from studies.models import ConsentRuling, Feedback, Lab, Response, Study, StudyType
+from project.fields.datetime_aware_jsonfield import LazyDecodedJSON
+from studies.models import (
+    ConsentRuling,
+    Feedback,
+    Lab,
+    PendingResponseUpdate,
+    Response,
+    Study,
+    StudyType,
+    Video,
+)
 from studies.permissions import LabPermission, StudyPermission
+from studies.response_buffer import flush_response_updates, get_changes
 
 
 class ResponseTestCase(APITestCase):
@@ -127,6 +145,206 @@ class ResponseTestCase(APITestCase):
             str(self.consented_response.uuid), api_response.data["results"][2]["url"]
         )
 
+    def testGetResponsesListCursorPagination(self):
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        self.client.force_authenticate(user=self.researcher)
+        newer_responses = [
+            G(
+                Response,
+                child=self.child,
+                study=self.study,
+                completed_consent_frame=True,
+            )
+            for _ in range(2)
+        ]
+        for response in newer_responses:
+            G(ConsentRuling, response=response, action="accepted")
+
+        url = f"{self.url}?cursor=&page_size=2"
+        urls = []
+        while url:
+            api_response = self.client.get(url)
+            self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("meta", api_response.data["links"])
+            urls.extend(result["url"] for result in api_response.data["results"])
+            url = api_response.data["links"]["next"]
+
+        self.assertEqual(len(urls), 3)
+        self.assertIn(str(newer_responses[1].uuid), urls[0])
+        self.assertIn(str(newer_responses[0].uuid), urls[1])
+        self.assertIn(str(self.consented_response.uuid), urls[2])
+
+    def testGetResponsesListInvalidCursor(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(f"{self.url}?cursor=nonsense")
+        self.assertEqual(api_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def testStreamStudyResponses(self):
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        self.client.force_authenticate(user=self.researcher)
+        stream_url = reverse(
+            "api:study-responses-stream",
+            kwargs={"version": "v2", "study_uuid": self.study.uuid},
+        )
+
+        api_response = self.client.get(stream_url)
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response["Content-Type"], "application/x-ndjson")
+        lines = b"".join(api_response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 1)
+        resource = json.loads(lines[0])
+        self.assertEqual(resource["type"], "responses")
+        self.assertEqual(resource["id"], str(self.consented_response.uuid))
+        self.assertIn("sequence", resource["attributes"])
+        self.assertEqual(
+            resource["attributes"]["exp_data"], self.consented_response.exp_data
+        )
+
+    def testStreamResponsesNeedsStudy(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(f"{self.url}stream/")
+        self.assertEqual(api_response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def testGetResponsesListSparseFieldset(self):
+        self.client.force_authenticate(user=self.participant)
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                f"{self.url}?fields[responses]=completed,sequence"
+            )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        for resource in api_response.json()["data"]:
+            self.assertIn("sequence", resource["attributes"])
+            self.assertNotIn("exp_data", resource["attributes"])
+        for query in queries:
+            self.assertNotIn('"studies_response"."exp_data"', query["sql"])
+            self.assertNotIn('"studies_response"."conditions"', query["sql"])
+
+    def testGetResponsesListSparseFieldsetNeedingExpData(self):
+        self.client.force_authenticate(user=self.participant)
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(f"{self.url}?fields[responses]=withdrawn")
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        response_queries = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('SELECT "studies_response"."id"')
+        ]
+        # One query for the page, rather than another per response for its exp_data.
+        self.assertEqual(len(response_queries), 1)
+        self.assertIn('"studies_response"."exp_data"', response_queries[0])
+
+    def testGetResponsesListIncludeRelated(self):
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        self.consented_response.demographic_snapshot = self.demographics
+        self.consented_response.save()
+        self.client.force_authenticate(user=self.researcher)
+
+        api_response = self.client.get(
+            self.url, {"include": "child,user,demographic_snapshot"}
+        )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        document = api_response.json()
+        [resource] = document["data"]
+        relationships = resource["relationships"]
+        self.assertEqual(
+            relationships["child"]["data"],
+            {"type": "children", "id": str(self.child.uuid)},
+        )
+        self.assertEqual(
+            relationships["user"]["data"],
+            {"type": "users", "id": str(self.participant.uuid)},
+        )
+        self.assertEqual(
+            relationships["demographic_snapshot"]["data"],
+            {"type": "demographics", "id": str(self.demographics.uuid)},
+        )
+        self.assertIn("links", relationships["child"])
+        self.assertNotIn("data", relationships["study"])
+        included = {
+            (included["type"], included["id"]): included
+            for included in document["included"]
+        }
+        self.assertEqual(
+            set(included),
+            {
+                ("children", str(self.child.uuid)),
+                ("users", str(self.participant.uuid)),
+                ("demographics", str(self.demographics.uuid)),
+            },
+        )
+        self.assertEqual(
+            included[("children", str(self.child.uuid))]["attributes"]["given_name"],
+            "Sally",
+        )
+        self.assertEqual(
+            included[("demographics", str(self.demographics.uuid))]["attributes"][
+                "languages_spoken_at_home"
+            ],
+            "French",
+        )
+        self.assertNotIn(
+            "username", included[("users", str(self.participant.uuid))]["attributes"],
+        )
+
+    def testGetResponsesListIncludeScopedLikeRelatedViewSets(self):
+        # ChildViewSet leaves out the children of inactive users.
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+        self.participant.is_active = False
+        self.participant.save()
+        self.client.force_authenticate(user=self.researcher)
+
+        api_response = self.client.get(self.url, {"include": "child,user"})
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        document = api_response.json()
+        [resource] = document["data"]
+        self.assertNotIn("data", resource["relationships"]["child"])
+        self.assertEqual(
+            [(included["type"], included["id"]) for included in document["included"]],
+            [("users", str(self.participant.uuid))],
+        )
+
+    def testGetResponseDetailIncludeChild(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(self.response_detail_url, {"include": "child"})
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        document = api_response.json()
+        self.assertEqual(
+            document["data"]["relationships"]["child"]["data"]["id"],
+            str(self.child.uuid),
+        )
+        self.assertEqual(
+            [(included["type"], included["id"]) for included in document["included"]],
+            [("children", str(self.child.uuid))],
+        )
+
+    def testGetResponsesListIncludeUnsupported(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(self.url, {"include": "study"})
+        self.assertEqual(api_response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def testGetResponsesListByOwnChildren(self):
         # Participant can view their own responses
         self.client.force_authenticate(user=self.participant)
@@ -202,6 +420,45 @@ class ResponseTestCase(APITestCase):
         )
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
 
+    def testGetResponseDetailPassesSessionDataThrough(self):
+        self.response.exp_data = {"0-frame": {"answer": "¿Sí?", "rt": 1.25}}
+        self.response.global_event_timings = [
+            {"eventType": "nextFrame", "timestamp": timezone.now()}
+        ]
+        self.response.save()
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.get(self.response_detail_url)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
+        # Spliced in as the JSON text Postgres gave, rather than decoded and encoded
+        # again...
+        self.assertIsInstance(api_response.data["exp_data"], LazyDecodedJSON)
+        self.assertIn(
+            '"exp_data":{"0-frame": {"rt": 1.25, "answer": "¿Sí?"}}'.encode(),
+            api_response.content,
+        )
+        # ...unless it holds encoded datetimes, which are output as usual.
+        attributes = api_response.json()["data"]["attributes"]
+        self.assertEqual(
+            attributes["global_event_timings"][0]["timestamp"],
+            self.response.global_event_timings[0]["timestamp"]
+            .isoformat()
+            .replace("+00:00", "Z"),
+        )
+
+    def testPatchResponseDoesNotPassSessionDataThrough(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            json.dumps(self.patch_data),
+            content_type="application/vnd.api+json",
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            api_response.data["exp_data"], {"first_frame": {}, "second_frame": {}}
+        )
+        self.assertNotIsInstance(api_response.data["exp_data"], LazyDecodedJSON)
+
     def testGetResponseDetailViewStudyPermissions(self):
         # Can view study permissions insufficient to view responses
         assign_perm(
@@ -353,6 +610,87 @@ class ResponseTestCase(APITestCase):
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
         self.assertEqual(api_response.data["sequence"], ["first_frame", "second_frame"])
 
+    def testPatchResponseAttributesGzipEncoded(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            gzip.compress(json.dumps(self.patch_data).encode()),
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.data["sequence"], ["first_frame", "second_frame"])
+
+    @override_settings(MAX_DECOMPRESSED_REQUEST_BODY_SIZE=64 * 1024)
+    def testPatchResponseGzipEncodedTooLarge(self):
+        self.client.force_authenticate(user=self.participant)
+        self.patch_data["data"]["attributes"]["exp_data"] = {"padding": "0" * 1000000}
+        body = gzip.compress(json.dumps(self.patch_data).encode())
+        self.assertLess(len(body), 64 * 1024)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            body,
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(
+            api_response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        self.response.refresh_from_db()
+        self.assertNotEqual(self.response.sequence, ["first_frame", "second_frame"])
+
+    def testPatchResponseAttributesBrotliEncoded(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            brotli.compress(json.dumps(self.patch_data).encode()),
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="br",
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.data["sequence"], ["first_frame", "second_frame"])
+
+    @override_settings(MAX_DECOMPRESSED_REQUEST_BODY_SIZE=64 * 1024)
+    def testPatchResponseBrotliEncodedTooLarge(self):
+        self.client.force_authenticate(user=self.participant)
+        self.patch_data["data"]["attributes"]["exp_data"] = {"padding": "0" * 10000000}
+        body = brotli.compress(json.dumps(self.patch_data).encode())
+        self.assertLess(len(body), 1024)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            body,
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="br",
+        )
+        self.assertEqual(
+            api_response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        self.response.refresh_from_db()
+        self.assertNotEqual(self.response.sequence, ["first_frame", "second_frame"])
+
+    def testPatchResponseGzipEncodedTruncated(self):
+        self.client.force_authenticate(user=self.participant)
+        body = gzip.compress(json.dumps(self.patch_data).encode())
+        api_response = self.client.patch(
+            self.response_detail_url,
+            body[: len(body) // 2],
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="gzip",
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def testPatchResponseUnsupportedContentEncoding(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            json.dumps(self.patch_data),
+            content_type="application/vnd.api+json",
+            HTTP_CONTENT_ENCODING="compress",
+        )
+        self.assertEqual(
+            api_response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
+
     def testPatchResponseAttributesTopLevelKeysUnderscoredOnly(self):
         self.client.force_authenticate(user=self.participant)
 
@@ -493,6 +831,319 @@ class ResponseTestCase(APITestCase):
             },
         )
 
+    def testPatchResponseBumpsVersion(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self.client.patch(
+            self.response_detail_url,
+            json.dumps(self.patch_data),
+            content_type="application/vnd.api+json",
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.data["version"], 1)
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.version, 1)
+
+    def _merge_patch(self, attributes, **meta):
+        data = {
+            "data": {
+                "attributes": attributes,
+                "type": "responses",
+                "id": str(self.response.uuid),
+            },
+            "meta": {"merge": True, **meta},
+        }
+        return self.client.patch(
+            self.response_detail_url,
+            json.dumps(data),
+            content_type="application/vnd.api+json",
+        )
+
+    def testMergePatchResponseAppendsFrames(self):
+        self.response.exp_data = {"0-video-config": {"frameType": "DEFAULT"}}
+        self.response.sequence = ["0-video-config"]
+        self.response.global_event_timings = [{"eventType": "start"}]
+        self.response.save()
+        self.client.force_authenticate(user=self.participant)
+
+        api_response = self._merge_patch(
+            {
+                "exp_data": {"1-instructions": {"frameType": "DEFAULT", "a": 1}},
+                "sequence": ["1-instructions"],
+                "global_event_timings": [{"eventType": "pause"}],
+                "completed": "true",
+            },
+            version=0,
+        )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.json(), {"meta": {"version": 1}})
+        self.response.refresh_from_db()
+        self.assertEqual(
+            self.response.exp_data,
+            {
+                "0-video-config": {"frameType": "DEFAULT"},
+                "1-instructions": {"frameType": "DEFAULT", "a": 1},
+            },
+        )
+        self.assertEqual(self.response.sequence, ["0-video-config", "1-instructions"])
+        self.assertEqual(
+            self.response.global_event_timings,
+            [{"eventType": "start"}, {"eventType": "pause"}],
+        )
+        self.assertTrue(self.response.completed)
+        self.assertFalse(self.response.completed_consent_frame)
+        self.assertEqual(self.response.version, 1)
+
+    def testMergePatchResponseRejectsStaleVersion(self):
+        self.client.force_authenticate(user=self.participant)
+        self.assertEqual(
+            self._merge_patch({"sequence": ["0-a"]}, version=0).status_code,
+            status.HTTP_200_OK,
+        )
+
+        api_response = self._merge_patch({"sequence": ["1-b"]}, version=0)
+
+        self.assertEqual(api_response.status_code, status.HTTP_409_CONFLICT)
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.sequence, ["0-a"])
+        self.assertEqual(self.response.version, 1)
+
+    def testMergePatchResponseWithoutVersionAlwaysApplies(self):
+        self.response.version = 7
+        self.response.save()
+        self.client.force_authenticate(user=self.participant)
+
+        api_response = self._merge_patch({"sequence": ["0-a"]})
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.json(), {"meta": {"version": 8}})
+
+    def testMergePatchResponseRejectsOtherAttributes(self):
+        self.client.force_authenticate(user=self.participant)
+        api_response = self._merge_patch({"is_preview": True})
+        self.assertEqual(api_response.status_code, status.HTTP_400_BAD_REQUEST)
+        api_response = self._merge_patch({"sequence": "0-a"})
+        self.assertEqual(api_response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def testMergePatchResponseNotYourResponse(self):
+        self.client.force_authenticate(user=self.researcher)
+        api_response = self._merge_patch({"sequence": ["0-a"]})
+        self.assertEqual(api_response.status_code, status.HTTP_404_NOT_FOUND)
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.version, 0)
+
+    def testMergePatchResponseDispatchesFrameAction(self):
+        consent_video = G(
+            Video,
+            study=self.study,
+            response=self.response,
+            is_consent_footage=False,
+            frame_id="1-my-consent-frame",
+        )
+        self.client.force_authenticate(user=self.participant)
+
+        api_response = self._merge_patch(
+            {
+                "exp_data": {"1-my-consent-frame": {"frameType": "CONSENT"}},
+                "sequence": ["1-my-consent-frame"],
+            }
+        )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        consent_video.refresh_from_db()
+        self.assertTrue(consent_video.is_consent_footage)
+
+    @override_settings(RESPONSE_WRITE_BEHIND=True)
+    def testPatchResponseWriteBehind(self):
+        self.client.force_authenticate(user=self.participant)
+        for sequence in (["first_frame"], ["first_frame", "second_frame"]):
+            self.patch_data["data"]["attributes"]["sequence"] = sequence
+            api_response = self.client.patch(
+                self.response_detail_url,
+                json.dumps(self.patch_data),
+                content_type="application/vnd.api+json",
+            )
+            self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+            self.assertEqual(api_response.data["sequence"], sequence)
+            self.assertEqual(api_response.data["version"], 1)
+
+        # Logged, the second time as just the frame it adds to the sequence, but not
+        # yet written to the response...
+        self.assertEqual(
+            PendingResponseUpdate.objects.order_by("id").last().changes,
+            {"append": {"sequence": ["second_frame"]}},
+        )
+        self.assertEqual(PendingResponseUpdate.objects.count(), 2)
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.sequence, [])
+        self.assertEqual(self.response.version, 0)
+
+        # ...although reads see the buffered state.
+        api_response = self.client.get(self.response_detail_url)
+        self.assertEqual(api_response.data["sequence"], ["first_frame", "second_frame"])
+        api_response = self.client.get(self.url)
+        buffered = next(
+            resource
+            for resource in api_response.json()["data"]
+            if resource["id"] == str(self.response.uuid)
+        )
+        self.assertEqual(
+            buffered["attributes"]["sequence"], ["first_frame", "second_frame"]
+        )
+
+        self.assertEqual(flush_response_updates(), 1)
+        self.assertFalse(PendingResponseUpdate.objects.exists())
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.sequence, ["first_frame", "second_frame"])
+        self.assertEqual(
+            self.response.exp_data, {"first_frame": {}, "second_frame": {}}
+        )
+        self.assertTrue(self.response.completed)
+        self.assertEqual(self.response.version, 1)
+
+    def testWriteBehindLogsOnlyChanges(self):
+        response = Response(
+            exp_data={"first_frame": {"a": 1}},
+            sequence=["first_frame"],
+            completed=False,
+        )
+        self.assertEqual(
+            get_changes(
+                response,
+                {
+                    "exp_data": {"first_frame": {"a": 1}, "second_frame": {}},
+                    "sequence": ["first_frame", "second_frame"],
+                    "completed": False,
+                },
+            ),
+            {
+                "merge": {"exp_data": {"second_frame": {}}},
+                "append": {"sequence": ["second_frame"]},
+            },
+        )
+        # Anything that takes away from what's there replaces it.
+        self.assertEqual(
+            get_changes(response, {"exp_data": {}, "sequence": ["second_frame"]}),
+            {"set": {"exp_data": {}, "sequence": ["second_frame"]}},
+        )
+
+    @override_settings(RESPONSE_WRITE_BEHIND=True)
+    def testGetResponseDetailConditionalWithWriteBehind(self):
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.response_detail_url)["ETag"]
+        self.assertEqual(
+            self.client.get(
+                self.response_detail_url, HTTP_IF_NONE_MATCH=etag
+            ).status_code,
+            status.HTTP_304_NOT_MODIFIED,
+        )
+        list_etag = self.client.get(self.url)["ETag"]
+
+        # Buffered updates leave date_modified alone, but still change the ETags.
+        for sequence in (["first_frame"], ["first_frame", "second_frame"]):
+            self.patch_data["data"]["attributes"]["sequence"] = sequence
+            self.client.patch(
+                self.response_detail_url,
+                json.dumps(self.patch_data),
+                content_type="application/vnd.api+json",
+            )
+            api_response = self.client.get(
+                self.response_detail_url, HTTP_IF_NONE_MATCH=etag
+            )
+            self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(api_response["ETag"], etag)
+            etag = api_response["ETag"]
+            api_response = self.client.get(self.url, HTTP_IF_NONE_MATCH=list_etag)
+            self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+            list_etag = api_response["ETag"]
+
+    def testGetResponseDetailConditionalWithIncludedChild(self):
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.response_detail_url, {"include": "child"})["ETag"]
+
+        # The included child changes without touching the response.
+        self.child.given_name = "Renamed"
+        self.child.save()
+        api_response = self.client.get(
+            self.response_detail_url, {"include": "child"}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(api_response["ETag"], etag)
+
+        # The same resource asked for differently has a different ETag.
+        api_response = self.client.get(
+            self.response_detail_url, HTTP_IF_NONE_MATCH=api_response["ETag"]
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
+    def testGetResponsesCursorPageConditional(self):
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.url, {"cursor": ""})["ETag"]
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                self.url, {"cursor": ""}, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # The ETag comes from the rows on the page, not from counting the rest.
+        self.assertFalse(
+            any("COUNT(" in query["sql"] for query in queries.captured_queries)
+        )
+
+        self.response.save()
+        api_response = self.client.get(
+            self.url, {"cursor": ""}, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
+    @override_settings(RESPONSE_WRITE_BEHIND=True)
+    def testPatchResponseWriteBehindFlushesConsentFrame(self):
+        consent_video = G(
+            Video,
+            study=self.study,
+            response=self.response,
+            is_consent_footage=False,
+            frame_id="second_frame",
+        )
+        self.patch_data["data"]["attributes"]["exp_data"]["second_frame"] = {
+            "frameType": "CONSENT"
+        }
+        self.client.force_authenticate(user=self.participant)
+
+        api_response = self.client.patch(
+            self.response_detail_url,
+            json.dumps(self.patch_data),
+            content_type="application/vnd.api+json",
+        )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertFalse(PendingResponseUpdate.objects.exists())
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.sequence, ["first_frame", "second_frame"])
+        consent_video.refresh_from_db()
+        self.assertTrue(consent_video.is_consent_footage)
+
+    @override_settings(RESPONSE_WRITE_BEHIND=True)
+    def testMergePatchResponseAfterWriteBehind(self):
+        self.client.force_authenticate(user=self.participant)
+        self.client.patch(
+            self.response_detail_url,
+            json.dumps(self.patch_data),
+            content_type="application/vnd.api+json",
+        )
+
+        api_response = self._merge_patch(
+            {"exp_data": {"third_frame": {}}, "sequence": ["third_frame"]}, version=1
+        )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.json(), {"meta": {"version": 2}})
+        self.response.refresh_from_db()
+        self.assertEqual(
+            self.response.sequence, ["first_frame", "second_frame", "third_frame"]
+        )
+        self.assertEqual(len(self.response.exp_data), 3)
+
     # Delete responses
     def testDeleteResponse(self):
         self.client.force_authenticate(user=self.superuser)
@@ -500,3 +1151,100 @@ class ResponseTestCase(APITestCase):
             self.response_detail_url, content_type="application/vnd.api+json"
         )
         self.assertEqual(api_response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+
+class ResponseWriteBehindConcurrencyTestCase(APITransactionTestCase):
+    """Each request thread gets its own connection here, so they really interleave."""
+
+    def setUp(self):
+        self.participant = G(User, is_active=True, given_name="Participant 1")
+        self.child = G(Child, user=self.participant, given_name="Sally")
+        self.study = G(
+            Study,
+            creator=G(User, is_active=True, is_researcher=True),
+            study_type=G(StudyType, name="default", id=1),
+            lab=G(Lab, name="MIT"),
+        )
+        self.response = G(Response, child=self.child, study=self.study, completed=False)
+        self.response_detail_url = (
+            reverse("api:response-list", kwargs={"version": "v1"})
+            + f"{self.response.uuid}/"
+        )
+
+    def patch_sequence(self, sequence, status_codes):
+        client = APIClient()
+        client.force_authenticate(user=self.participant)
+        try:
+            api_response = client.patch(
+                self.response_detail_url,
+                json.dumps(
+                    {
+                        "data": {
+                            "attributes": {"sequence": sequence},
+                            "type": "responses",
+                            "id": str(self.response.uuid),
+                        }
+                    }
+                ),
+                content_type="application/vnd.api+json",
+            )
+            status_codes.append(api_response.status_code)
+        finally:
+            connection.close()
+
+    @override_settings(RESPONSE_WRITE_BEHIND=True)
+    def testInterleavedPatchesAppendEachFrameOnce(self):
+        first_diffing = threading.Event()
+        carry_on = threading.Event()
+        diffed = []
+
+        def get_changes_pausing_first(response, validated_data):
+            diffed.append(threading.current_thread().name)
+            if threading.current_thread().name == "first":
+                first_diffing.set()
+                carry_on.wait(5)
+            return get_changes(response, validated_data)
+
+        status_codes = []
+        first = threading.Thread(
+            name="first",
+            target=self.patch_sequence,
+            args=(["first_frame"], status_codes),
+        )
+        second = threading.Thread(
+            name="second",
+            target=self.patch_sequence,
+            args=(["first_frame", "second_frame"], status_codes),
+        )
+        with patch(
+            "studies.response_buffer.get_changes",
+            side_effect=get_changes_pausing_first,
+        ):
+            first.start()
+            self.assertTrue(first_diffing.wait(5))
+            # Both PATCHes were sent against an empty sequence; the second waits on
+            # the first's lock rather than diffing against that same base.
+            second.start()
+            second.join(1)
+            self.assertTrue(second.is_alive())
+            self.assertEqual(diffed, ["first"])
+            carry_on.set()
+            first.join(5)
+            second.join(5)
+
+        self.assertEqual(diffed, ["first", "second"])
+        self.assertEqual(status_codes, [status.HTTP_200_OK, status.HTTP_200_OK])
+        self.assertEqual(
+            list(
+                PendingResponseUpdate.objects.order_by("id").values_list(
+                    "changes", flat=True
+                )
+            ),
+            [
+                {"append": {"sequence": ["first_frame"]}},
+                {"append": {"sequence": ["second_frame"]}},
+            ],
+        )
+        self.assertEqual(flush_response_updates(), 1)
+        self.response.refresh_from_db()
+        self.assertEqual(self.response.sequence, ["first_frame", "second_frame"])
@@ -1,7 +1,9 @@
 import json
 import uuid
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_dynamic_fixture import G
 from guardian.shortcuts import assign_perm
@@ -171,6 +173,153 @@ class StudiesTestCase(APITestCase):
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
         self.assertEqual(api_response.data["links"]["meta"]["count"], 1)
 
+    def testGetStudyListSparseFieldset(self):
+        self.study.state = "active"
+        self.study.public = True
+        self.study.save()
+        self.client.force_authenticate(user=self.participant)
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                f"{self.study_list_url}?fields[studies]=name,state",
+                content_type="application/vnd.api+json",
+            )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        study = api_response.json()["data"][0]
+        self.assertEqual(study["attributes"]["name"], "Test Name")
+        self.assertNotIn("structure", study["attributes"])
+        self.assertNotIn("generator", study["attributes"])
+        study_queries = [
+            query["sql"] for query in queries if '"studies_study"' in query["sql"]
+        ]
+        self.assertTrue(study_queries)
+        for sql in study_queries:
+            self.assertNotIn('"studies_study"."structure"', sql)
+            self.assertNotIn('"studies_study"."generator"', sql)
+
+    def testGetStudyListAsParticipantWithDetailFields(self):
+        self.study.state = "active"
+        self.study.public = True
+        self.study.save()
+        self.client.force_authenticate(user=self.participant)
+        self.client.get(self.study_list_url, content_type="application/vnd.api+json")
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                self.study_list_url, content_type="application/vnd.api+json"
+            )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        # Structure, generator and the responses link all come from the cache.
+        self.assertFalse([query for query in queries if "studies_" in query["sql"]])
+        study = api_response.json()["data"][0]
+        self.assertEqual(study["attributes"]["structure"], self.study.structure)
+        self.assertEqual(study["attributes"]["generator"], self.study.generator)
+        self.assertIn("related", study["relationships"]["responses"]["links"])
+
+        # Saving the study replaces what was cached.
+        self.study.generator = "function() { return []; }"
+        self.study.save()
+        api_response = self.client.get(
+            self.study_list_url, content_type="application/vnd.api+json"
+        )
+        self.assertEqual(
+            api_response.json()["data"][0]["attributes"]["generator"],
+            "function() { return []; }",
+        )
+
+    def testGetStudyListSparseFieldsetAsResearcher(self):
+        self.study.state = "active"
+        self.study.public = True
+        self.study.save()
+        # Researchers' lists come from the database; participants' from the catalog.
+        self.client.force_authenticate(user=self.researcher)
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                f"{self.study_list_url}?fields[studies]=name,state",
+                content_type="application/vnd.api+json",
+            )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        study = api_response.json()["data"][0]
+        self.assertEqual(study["attributes"]["name"], "Test Name")
+        self.assertNotIn("structure", study["attributes"])
+        self.assertNotIn("generator", study["attributes"])
+        study_queries = [
+            query["sql"] for query in queries if '"studies_study"' in query["sql"]
+        ]
+        self.assertTrue(study_queries)
+        for sql in study_queries:
+            self.assertNotIn('"studies_study"."structure"', sql)
+            self.assertNotIn('"studies_study"."generator"', sql)
+
+    def testGetStudyListAsParticipantFromCatalog(self):
+        self.study.state = "active"
+        self.study.public = True
+        self.study.save()
+        self.client.force_authenticate(user=self.participant)
+        self.client.get(self.study_list_url, content_type="application/vnd.api+json")
+
+        with CaptureQueriesContext(connection) as queries:
+            api_response = self.client.get(
+                f"{self.study_list_url}?fields[studies]=name,state",
+                content_type="application/vnd.api+json",
+            )
+
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        # Nothing but the savepoint around the request.
+        self.assertFalse(
+            [query for query in queries if "SAVEPOINT" not in query["sql"]]
+        )
+        study = api_response.json()["data"][0]
+        self.assertEqual(study["id"], str(self.study.uuid))
+        self.assertEqual(study["attributes"]["name"], "Test Name")
+        self.assertNotIn("structure", study["attributes"])
+
+        self.study.public = False
+        self.study.save()
+        api_response = self.client.get(
+            self.study_list_url,
+            content_type="application/vnd.api+json",
+            HTTP_IF_NONE_MATCH=api_response["ETag"],
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.json()["data"], [])
+
+    def testGetStudyDetailConditional(self):
+        self.study.state = "active"
+        self.study.save()
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.study_detail_url)["ETag"]
+
+        api_response = self.client.get(
+            self.study_detail_url, HTTP_IF_NONE_MATCH=f'"other", {etag}'
+        )
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.study.save()
+        api_response = self.client.get(self.study_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.data["name"], self.study.name)
+
+    def testGetStudyListConditional(self):
+        self.study.state = "active"
+        self.study.public = True
+        self.study.save()
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.study_list_url)["ETag"]
+
+        api_response = self.client.get(self.study_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.study.public = False
+        self.study.save()
+        api_response = self.client.get(self.study_list_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(api_response.data["links"]["meta"]["count"], 0)
+
     def testGetSpecificPrivateActiveStudyAsParticipant(self):
         # Any active studies can be viewed by participant
         self.study.state = "active"
@@ -177,6 +177,22 @@ class UserTestCase(APITestCase):
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
         self.assertEqual(api_response.data["given_name"], "Participant 1")
 
+    def testParticipantDetailConditionalIgnoresPassword(self):
+        self.client.force_authenticate(user=self.participant)
+        etag = self.client.get(self.user_detail_url)["ETag"]
+
+        # Not in what's served, so doesn't change the ETag...
+        self.participant.set_password("a new password")
+        self.participant.save()
+        api_response = self.client.get(self.user_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # ...unlike what is.
+        self.participant.given_name = "Participant One"
+        self.participant.save()
+        api_response = self.client.get(self.user_detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(api_response.status_code, status.HTTP_200_OK)
+
     def testGetParticipantDetailIncorrectPermissions(self):
         # none of these permissions sufficient for viewing participants
         assign_perm(
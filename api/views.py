@@ -1,10 +1,24 @@
+import hashlib
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter
+
 from django.db.models import Q
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import parse_etags
 from django_filters import rest_framework as filters
 from guardian.shortcuts import get_objects_for_user
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.filters import OrderingFilter
+from rest_framework.generics import get_object_or_404 as get_lookup_or_404
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response as APIResponse
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework_json_api import utils as json_api_utils
 from rest_framework_json_api import views
+from rest_framework_json_api.exceptions import Conflict
 
 from accounts.models import Child, DemographicData, User
 from accounts.serializers import (
@@ -14,16 +28,27 @@ from accounts.serializers import (
     FullUserSerializer,
     LabSerializer,
 )
+from api.pagination import DateModifiedCursorPagination
 from api.permissions import FeedbackPermissions, ResponsePermissions
+from api.renderers import FastJsonApiWithUuidRenderer
+from project.fields.datetime_aware_jsonfield import dumps_with_raw_json
+from studies import response_buffer
 from studies.models import Feedback, Lab, Response, Study
 from studies.permissions import StudyPermission
-from studies.queries import get_consented_responses_qs, studies_for_which_user_has_perm
+from studies.queries import (
+    RESPONSE_MERGE_PATCH_FIELDS,
+    get_consented_responses_qs,
+    merge_patch_response,
+    studies_for_which_user_has_perm,
+)
 from studies.serializers import (
     FeedbackSerializer,
+    ResponseMergePatchSerializer,
     ResponseSerializer,
     ResponseWriteableSerializer,
     StudySerializer,
 )
+from studies.study_catalog import PublicStudyCatalog
 
 CONVERSION_TYPES = {
     "child": Child,
@@ -74,7 +99,143 @@ class ConvertUuidToIdMixin(views.ModelViewSet):
         super().initial(request, *args, **kwargs)
 
 
-class LabViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
+class DeferUnrequestedFieldsMixin(views.ModelViewSet):
+    """Carry JSON:API sparse fieldsets (e.g. `fields[responses]=completed,sequence`)
+    through to the queryset.
+
+    The serializers already drop fields that weren't asked for; this also defers the
+    heavy columns behind them, so they're never fetched or decoded. `deferrable_fields`
+    maps each such column to the serializer fields that need it.
+    """
+
+    deferrable_fields = {}
+
+    def get_unrequested_columns(self):
+        """The deferrable columns that no field in the request's fieldset needs."""
+        if self.request.method not in ("GET", "HEAD"):
+            return []
+        fieldset = self.request.query_params.get(f"fields[{self.resource_name}]")
+        if fieldset is None:
+            return []
+        fieldset = set(fieldset.split(","))
+        return [
+            column
+            for column, field_names in self.deferrable_fields.items()
+            if fieldset.isdisjoint(field_names)
+        ]
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        unrequested = self.get_unrequested_columns()
+        return queryset.defer(*unrequested) if unrequested else queryset
+
+
+@lru_cache(maxsize=None)
+def serialized_attnames(serializer_class):
+    """Attnames of the model fields a (model) serializer outputs from its instances."""
+    sources = {
+        field.source.split(".")[0] for field in serializer_class().fields.values()
+    }
+    return tuple(
+        field.attname
+        for field in serializer_class.Meta.model._meta.concrete_fields
+        if field.name in sources or field.attname in sources
+    )
+
+
+def serialized_values(instance, serializer_class):
+    """The values of the fields of `instance` that `serializer_class` outputs."""
+    deferred = instance.get_deferred_fields()
+    return tuple(
+        getattr(instance, attname)
+        for attname in serialized_attnames(serializer_class)
+        if attname not in deferred
+    )
+
+
+class ConditionalGetMixin(views.ModelViewSet):
+    """Answer GETs whose If-None-Match still matches with a 304, before serializing.
+
+    ETags are weak, and come from `etag_timestamp_field` where the model has one:
+    for each resource, its value. Otherwise they come from the values of the fields
+    the serializer outputs. A list's ETag covers the resources on the page (already
+    fetched to answer the request, so no more queries are made) and, when paging by
+    number, the total count the paginator takes anyway.
+    """
+
+    etag_timestamp_field = None
+
+    def get_etag_values(self, instance):
+        if self.etag_timestamp_field:
+            return (instance.pk, getattr(instance, self.etag_timestamp_field))
+        return serialized_values(instance, self.get_serializer_class())
+
+    def make_etag(self, values):
+        # Content varies with who's asking, what they asked for (includes, sparse
+        # fieldsets, filters, page) and how it's rendered, as well as the data.
+        key = repr(
+            (
+                self.request.user.pk,
+                self.request.accepted_media_type,
+                sorted(self.request.query_params.lists()),
+                values,
+            )
+        )
+        return f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+
+    def not_modified(self, etag):
+        """A 304 if the request's If-None-Match matches `etag` (weakly), else None."""
+        if_none_match = self.request.META.get("HTTP_IF_NONE_MATCH")
+        if not if_none_match:
+            return None
+        opaque_tag = etag[2:]
+        for tag in parse_etags(if_none_match):
+            if tag == "*" or (tag[2:] if tag.startswith("W/") else tag) == opaque_tag:
+                response = HttpResponseNotModified()
+                response["ETag"] = etag
+                return response
+        return None
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = self.make_etag(self.get_etag_values(instance))
+        not_modified = self.not_modified(etag)
+        if not_modified:
+            return not_modified
+        serializer = self.get_serializer(instance)
+        return APIResponse(serializer.data, headers={"ETag": etag})
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        # When paging by number, the links depend on the total count too.
+        django_paginator = getattr(
+            getattr(self.paginator, "page", None), "paginator", None
+        )
+        etag = self.make_etag(
+            (
+                django_paginator.count if django_paginator else None,
+                [
+                    self.get_etag_values(instance)
+                    for instance in (queryset if page is None else page)
+                ],
+            )
+        )
+        not_modified = self.not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(queryset, many=True)
+            response = APIResponse(serializer.data)
+        response["ETag"] = etag
+        return response
+
+
+class LabViewSet(ConditionalGetMixin, FilterByUrlKwargsMixin, views.ModelViewSet):
     """
     Allows viewing a list of all approved labs or retrieving a single lab
     """
@@ -88,7 +249,7 @@ class LabViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
     permission_classes = [IsAuthenticated]
 
 
-class ChildViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
+class ChildViewSet(ConditionalGetMixin, FilterByUrlKwargsMixin, views.ModelViewSet):
     """
     Allows viewing a list of all children you have permission to view or retrieving a single child.
 
@@ -135,7 +296,9 @@ class ChildViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
         )
 
 
-class DemographicDataViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
+class DemographicDataViewSet(
+    ConditionalGetMixin, FilterByUrlKwargsMixin, views.ModelViewSet
+):
     """
     Allows viewing a list of all demographic data you have permission to view as well as your own demographic data.
     """
@@ -145,6 +308,8 @@ class DemographicDataViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
     serializer_class = DemographicDataSerializer
     lookup_field = "uuid"
     filter_fields = [("user", "user")]
+    # Demographic data is never edited - a new snapshot is saved instead.
+    etag_timestamp_field = "created_at"
     http_method_names = ["get", "head", "options"]
     permission_classes = [IsAuthenticated]
     filter_backends = (OrderingFilter,)
@@ -182,7 +347,7 @@ class DemographicDataViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
         )
 
 
-class UserViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
+class UserViewSet(ConditionalGetMixin, FilterByUrlKwargsMixin, views.ModelViewSet):
     """
     Allows viewing a list of all users you have permission to view or retrieving a single user.
 
@@ -232,7 +397,12 @@ class UserViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
         ).distinct()
 
 
-class StudyViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
+class StudyViewSet(
+    ConditionalGetMixin,
+    DeferUnrequestedFieldsMixin,
+    FilterByUrlKwargsMixin,
+    views.ModelViewSet,
+):
     """
     Allows viewing a list of studies or retrieving a single study
     """
@@ -242,6 +412,8 @@ class StudyViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
     serializer_class = StudySerializer
     lookup_field = "uuid"
     filter_fields = [("response", "responses")]
+    deferrable_fields = {"structure": ("structure",), "generator": ("generator",)}
+    etag_timestamp_field = "date_modified"
     http_method_names = ["get", "head", "options"]
     permission_classes = [IsAuthenticated]
 
@@ -267,6 +439,43 @@ class StudyViewSet(FilterByUrlKwargsMixin, views.ModelViewSet):
 
         return qs.distinct().order_by("-date_modified")
 
+    def is_filtered(self):
+        """Whether anything narrows the list beyond all active public studies."""
+        return bool(self.filter_backends) or any(
+            f"{singular}_uuid" in self.kwargs for singular, _ in self.filter_fields
+        )
+
+    def list(self, request, *args, **kwargs):
+        """Participants' list of studies comes straight from the cached catalog."""
+        # Researchers also see studies they can preview.
+        if request.user.is_researcher:
+            return super().list(request, *args, **kwargs)
+
+        catalog = PublicStudyCatalog.load()
+        studies = catalog.studies
+        if self.is_filtered():
+            # Filter and order by ID alone, and take the studies from the catalog.
+            studies_by_id = {study.id: study for study in studies}
+            studies = [
+                studies_by_id[study_id]
+                for study_id in self.filter_queryset(self.get_queryset()).values_list(
+                    "id", flat=True
+                )
+                if study_id in studies_by_id
+            ]
+        etag = self.make_etag((catalog.built_at, [study.id for study in studies]))
+        not_modified = self.not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        page = self.paginate_queryset(studies)
+        if set(self.deferrable_fields) - set(self.get_unrequested_columns()):
+            catalog.load_detail_fields(page)
+        serializer = self.get_serializer(page, many=True)
+        response = self.get_paginated_response(serializer.data)
+        response["ETag"] = etag
+        return response
+
 
 class ResponsesFilter(filters.FilterSet):
     """A Response filter that actually works."""
@@ -279,7 +488,12 @@ class ResponsesFilter(filters.FilterSet):
         fields = []
 
 
-class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
+class ResponseViewSet(
+    ConditionalGetMixin,
+    DeferUnrequestedFieldsMixin,
+    ConvertUuidToIdMixin,
+    views.ModelViewSet,
+):
     """
     Allows viewing a list of responses, retrieving a response, creating a response, or updating a response.
 
@@ -292,8 +506,24 @@ class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
     lookup_field = "uuid"
     filterset_class = ResponsesFilter
     filter_backends = (filters.DjangoFilterBackend,)
+    pagination_class = DateModifiedCursorPagination
+    etag_timestamp_field = "date_modified"
+    deferrable_fields = {
+        "exp_data": ("exp_data", "withdrawn"),
+        "conditions": ("conditions",),
+        "global_event_timings": ("global_event_timings",),
+    }
     http_method_names = ["get", "post", "put", "patch", "head", "options"]
     permission_classes = [IsAuthenticated, ResponsePermissions]
+    stream_chunk_size = 100
+    # Relationships that may be included in a compound document, each with the
+    # viewset whose scoping decides which of the related resources the user may see,
+    # and its path from a response through the rows select_related already joins.
+    includable_relationships = {
+        "child": (ChildViewSet, "child"),
+        "user": (UserViewSet, "child.user"),
+        "demographic_snapshot": (DemographicDataViewSet, "demographic_snapshot"),
+    }
 
     def get_serializer_class(self):
         """Return a different serializer for create views"""
@@ -301,6 +531,202 @@ class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
             return ResponseWriteableSerializer
         return super().get_serializer_class()
 
+    def get_etag_values(self, instance):
+        # Buffered updates change the response without touching date_modified, and
+        # included resources change without touching the response.
+        return super().get_etag_values(instance) + (
+            instance.version,
+            getattr(instance, "latest_pending_update_id", None),
+            [
+                serialized_values(related[instance], serializer_class)
+                for serializer_class, _, related in getattr(
+                    self, "included", {}
+                ).values()
+                if instance in related
+            ],
+        )
+
+    def get_object(self):
+        if response_buffer.is_enabled() and self.request.method in ("PUT", "PATCH"):
+            # Hold the response's row lock (until the request's transaction ends)
+            # before reading it and its pending updates, so that concurrent updates
+            # of it queue up and each diffs against what the one before it logged.
+            list(
+                Response.objects.select_for_update()
+                .filter(uuid=self.kwargs[self.lookup_field])
+                .values_list("id", flat=True)
+            )
+        response = super().get_object()
+        if response_buffer.is_enabled():
+            response_buffer.apply_pending_updates([response])
+        self.included = self.get_included([response])
+        return response
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        if page is not None:
+            if response_buffer.is_enabled():
+                response_buffer.apply_pending_updates(page)
+            self.included = self.get_included(page)
+        return page
+
+    def get_included(self, responses):
+        """Find the related resources to include with these responses, per `include`.
+
+        Only those the user could retrieve through the related resource's own viewset
+        are included, which takes one query per type of resource.
+
+        Returns:
+            Dict from relationship name to a tuple of the serializer class and
+            resource type to render the related resources with, and a dict from
+            response to related instance.
+        """
+        if self.request.method not in ("GET", "HEAD"):
+            return {}
+
+        included = {}
+        for name in json_api_utils.get_included_resources(self.request):
+            if name not in self.includable_relationships:
+                continue
+            viewset_class, path = self.includable_relationships[name]
+            related = {}
+            for response in responses:
+                try:
+                    instance = attrgetter(path)(response)
+                except AttributeError:
+                    continue
+                if instance is not None:
+                    related[response] = instance
+
+            viewset = viewset_class(
+                request=self.request, args=(), kwargs={}, format_kwarg=None
+            )
+            visible = set(
+                viewset.get_queryset()
+                .filter(pk__in={instance.pk for instance in related.values()})
+                .values_list("pk", flat=True)
+            )
+            included[name] = (
+                viewset.get_serializer_class(),
+                viewset.resource_name,
+                {
+                    response: instance
+                    for response, instance in related.items()
+                    if instance.pk in visible
+                },
+            )
+        return included
+
+    def get_serializer_context(self):
+        # Session data is passed through as JSON text from the database where what
+        # encodes the response splices it in, as _ndjson_lines does.
+        splices_raw_json = self.action == "stream" or getattr(
+            getattr(self.request, "accepted_renderer", None), "splices_raw_json", False
+        )
+        return {
+            **super().get_serializer_context(),
+            "included": getattr(self, "included", {}),
+            "raw_json": self.request.method in ("GET", "HEAD") and splices_raw_json,
+        }
+
+    def perform_update(self, serializer):
+        if response_buffer.is_enabled():
+            if response_buffer.can_buffer(serializer.validated_data):
+                response_buffer.buffer_update(
+                    serializer.instance, serializer.validated_data
+                )
+                return
+            # Write out what's pending first, so it can't later clobber this update.
+            response_buffer.flush_response_updates(
+                response_ids=[serializer.instance.id]
+            )
+        serializer.save()
+
+    @action(detail=False, methods=["get"])
+    def stream(self, request, *args, **kwargs):
+        """Stream all of a study's responses as newline-delimited JSON.
+
+        GET /api/v2/studies/{STUDY_ID}/responses/stream/ returns the same responses as
+        the list view (and takes the same filters), newest first and unpaginated. Each
+        line is one JSON:API resource object, as found in the list view's `data`.
+        """
+        if "study_uuid" not in self.kwargs:
+            raise NotFound("Responses can only be streamed for a single study.")
+        queryset = self.filter_queryset(self.get_queryset()).order_by(
+            "-date_modified", "-id"
+        )
+        return StreamingHttpResponse(
+            self._ndjson_lines(queryset), content_type="application/x-ndjson"
+        )
+
+    def _ndjson_lines(self, queryset):
+        responses = queryset.iterator(chunk_size=self.stream_chunk_size)
+        while True:
+            chunk = list(islice(responses, self.stream_chunk_size))
+            if not chunk:
+                return
+            if response_buffer.is_enabled():
+                response_buffer.apply_pending_updates(chunk)
+            serializer = self.get_serializer(chunk, many=True)
+            fields = json_api_utils.get_serializer_fields(serializer.child)
+            for resource, instance in zip(serializer.data, chunk):
+                resource_object = FastJsonApiWithUuidRenderer.build_json_resource_obj(
+                    fields, resource, instance, self.resource_name
+                )
+                yield dumps_with_raw_json(resource_object, cls=JSONEncoder) + "\n"
+
+    def partial_update(self, request, *args, **kwargs):
+        """Optionally merge the update into the stored session data.
+
+        A PATCH whose top-level meta has `"merge": true` is treated as a merge-patch:
+        frames in `expData` are added to the stored exp_data, `sequence` entries are
+        appended, and so on (see merge_patch_response), instead of overwriting each
+        attribute. If meta also has a `version`, the patch is rejected with a 409
+        unless the response is still at that version. Responds with just the new
+        version in the top-level meta, e.g. {"meta": {"version": 4}}.
+        """
+        meta = request.data.get("_meta") or {}
+        if not meta.get("merge"):
+            return super().partial_update(request, *args, **kwargs)
+
+        version = meta.get("version")
+        if version is not None and (
+            isinstance(version, bool) or not isinstance(version, int)
+        ):
+            raise ValidationError({"version": "Must be an integer."})
+        unknown = set(request.data) - set(RESPONSE_MERGE_PATCH_FIELDS) - {"id", "_meta"}
+        if unknown:
+            raise ValidationError(
+                {field: "Can't be merge-patched." for field in sorted(unknown)}
+            )
+
+        # Look up the response without loading the session data we're about to
+        # merge into.
+        queryset = self.filter_queryset(self.get_queryset()).defer(
+            "exp_data", "conditions", "global_event_timings"
+        )
+        instance = get_lookup_or_404(queryset, uuid=kwargs[self.lookup_field])
+        self.check_object_permissions(request, instance)
+        if response_buffer.is_enabled():
+            response_buffer.flush_response_updates(response_ids=[instance.id])
+
+        serializer = ResponseMergePatchSerializer(
+            data=request.data, context=self.get_serializer_context()
+        )
+        serializer.is_valid(raise_exception=True)
+
+        new_version = merge_patch_response(
+            instance, serializer.validated_data, version=version
+        )
+        if new_version is None:
+            raise Conflict(
+                f"Response is no longer at version {version}; fetch it and try again."
+            )
+
+        # Meta-only document, rendered as-is rather than as a resource object.
+        self.resource_name = False
+        return APIResponse({"meta": {"version": new_version}})
+
     def get_queryset(self):
         """Overrides queryset.
 
@@ -397,7 +823,12 @@ class ResponseViewSet(ConvertUuidToIdMixin, views.ModelViewSet):
             return response_queryset.order_by("-date_modified")
 
 
-class FeedbackViewSet(FilterByUrlKwargsMixin, ConvertUuidToIdMixin, views.ModelViewSet):
+class FeedbackViewSet(
+    ConditionalGetMixin,
+    FilterByUrlKwargsMixin,
+    ConvertUuidToIdMixin,
+    views.ModelViewSet,
+):
     """
     Allows viewing a list of feedback, retrieving a single piece of feedback, or creating feedback.
 
@@ -5,7 +5,10 @@ import botocore
 from botocore.exceptions import ClientError
 from django.conf import settings
 
+# Shared by all threads, so connections to S3 are pooled and reused between requests.
 S3_CLIENT = boto3.client("s3")
+# How much of a video is read from S3 at a time as it's streamed to a client.
+VIDEO_STREAM_CHUNK_SIZE = 64 * 1024
 
 
 def get_all_study_attachments(study_uuid):
@@ -29,6 +32,29 @@ def get_download_url(video_key):
     )
 
 
+def get_video_object(video_key, byte_range=None):
+    """
+    Fetch a stored video from S3 to stream it, or just the bytes in `byte_range` (the
+    value of an HTTP Range header). Returns the get_object response; its "Body" is
+    read as the video is sent on, with iter_video_chunks.
+    """
+    params = {"Bucket": settings.BUCKET_NAME, "Key": video_key}
+    if byte_range:
+        params["Range"] = byte_range
+    return S3_CLIENT.get_object(**params)
+
+
+def iter_video_chunks(body):
+    """
+    Read a video's streaming body in chunks, releasing its connection when done or
+    when the client goes away before the end.
+    """
+    try:
+        yield from body.iter_chunks(VIDEO_STREAM_CHUNK_SIZE)
+    finally:
+        body.close()
+
+
 def get_study_attachments(study, orderby="key", match=None):
     """
     Fetches study attachments from s3
@@ -1,5 +1,349 @@
 # TODO: StudyParticipantAnalyticsView
 # - check can get iff self.request.user.has_perm("accounts.can_view_analytics")
 #             and self.request.user.is_researcher
-# - check context has appropriate number of responses in response_timeseries_data
-#   for researcher without can_view_all... perms
+
+from datetime import date, datetime, timedelta, timezone
+from unittest.mock import patch
+
+from django.test import Client, TestCase
+from django.urls import reverse
+from django_dynamic_fixture import G
+from guardian.shortcuts import assign_perm
+
+from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
+from accounts.models import Child, User
+from exp.views.analytics import get_flattened_responses, unstack_children
+from studies.fields import CONDITIONS, GESTATIONAL_AGE_ENUM_MAP, LANGUAGES
+from studies.models import ConsentRuling, Lab, Response, Study, StudyType
+from studies.permissions import StudyPermission
+from studies.queries import get_annotated_responses_qs, refresh_response_summaries
+
+
+class Force2FAClient(Client):
+    """For convenience, let's just pretend everyone is two-factor auth'd."""
+
+    @property
+    def session(self):
+        _session = super().session
+        _session[TWO_FACTOR_AUTH_SESSION_KEY] = True
+        return _session
+
+
+class StudyParticipantAnalyticsViewTestCase(TestCase):
+    def setUp(self):
+        self.client = Force2FAClient()
+        self.recruitment_manager = G(User, is_active=True, is_researcher=True)
+        assign_perm("accounts.can_view_analytics", self.recruitment_manager)
+        assign_perm(
+            "studies.view_all_response_data_in_analytics", self.recruitment_manager
+        )
+
+        self.study = G(Study, study_type=G(StudyType, name="default", id=1), lab=G(Lab))
+        self.participant = G(User, is_active=True, is_researcher=False)
+        self.child = G(
+            Child, user=self.participant, gender="m", birthday=date(2019, 1, 1)
+        )
+        for _ in range(2):
+            G(
+                Response,
+                child=self.child,
+                study=self.study,
+                completed_consent_frame=True,
+                demographic_snapshot=None,
+            )
+        self.url = reverse("exp:study-participant-analytics")
+        self.responses_url = reverse("exp:study-participant-analytics-responses")
+
+    def test_recruitment_manager_sees_summarized_responses(self):
+        refresh_response_summaries(rebuild=True)
+        self.client.force_login(self.recruitment_manager)
+        page = self.client.get(self.url)
+        self.assertEqual(page.status_code, 200)
+        self.assertTrue(page.context["summarized_responses"])
+        # Plots fetch their binned counts, and the pivot table its records, rather
+        # than being embedded in the page.
+        self.assertNotIn("registration_data", page.context)
+        self.assertNotIn("response_timeseries_data", page.context)
+        self.assertContains(page, reverse("exp:study-participant-analytics-data"))
+        self.assertContains(page, self.responses_url)
+
+        data = self.client.get(self.responses_url).json()
+        self.assertTrue(data["summarized"])
+        records = data["responses"]
+        self.assertEqual(sum(record["Number of Responses"] for record in records), 2)
+        self.assertEqual({record["Study ID"] for record in records}, {self.study.id})
+
+    def test_researcher_sees_individual_responses(self):
+        researcher = G(User, is_active=True, is_researcher=True)
+        assign_perm("accounts.can_view_analytics", researcher)
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            researcher,
+            self.study,
+        )
+        self.client.force_login(researcher)
+        with patch(
+            "exp.views.analytics.get_flattened_responses",
+            side_effect=get_flattened_responses,
+        ) as flatten:
+            page = self.client.get(self.url)
+            self.assertEqual(page.status_code, 200)
+            self.assertNotIn("summarized_responses", page.context)
+            self.assertEqual(page.context["studies"], {self.study.name: 1})
+            flatten.assert_not_called()
+
+            data = self.client.get(self.responses_url).json()
+            flatten.assert_called_once()
+        self.assertFalse(data["summarized"])
+        records = data["responses"]
+        self.assertEqual([record["Number of Responses"] for record in records], [1, 1])
+        self.assertEqual(
+            {record["Child (unique identifier)"] for record in records},
+            {str(self.child.uuid)},
+        )
+
+    def test_responses_require_analytics_permission(self):
+        self.client.force_login(G(User, is_active=True, is_researcher=True))
+        self.assertEqual(self.client.get(self.responses_url).status_code, 403)
+
+
+class FlattenedResponsesTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study, name="Flattened study")
+        self.other_study = G(Study, name="Other study")
+        self.child = G(
+            Child,
+            birthday=date(2019, 1, 1),
+            gestational_age_at_birth=5,
+            languages_spoken=0b1011,
+        )
+        self.unknown_child = G(
+            Child, birthday=None, gestational_age_at_birth=None, languages_spoken=0
+        )
+        self.response = G(
+            Response,
+            child=self.child,
+            study=self.study,
+            completed_consent_frame=True,
+            demographic_snapshot=None,
+        )
+        G(
+            Response,
+            child=self.unknown_child,
+            study=self.study,
+            completed_consent_frame=True,
+            demographic_snapshot=None,
+        )
+        Response.objects.filter(id=self.response.id).update(
+            date_created=datetime(2020, 3, 1, 23, 30, tzinfo=timezone.utc)
+        )
+        self.responses = get_annotated_responses_qs().values()
+
+    def test_derived_attributes(self):
+        records = {
+            record["Child (unique identifier)"]: record
+            for record in get_flattened_responses(
+                self.responses,
+                {self.child.id: {self.study.name, self.other_study.name}},
+            )
+        }
+        self.assertEqual(len(records), 2)
+
+        record = records[self.child.uuid]
+        self.assertEqual(record["Response (unique identifier)"], self.response.uuid)
+        self.assertEqual(record["Child Age in Days"], 425)
+        self.assertEqual(record["Child Age in Months"], 14)
+        self.assertEqual(record["Child Age in Years"], 1)
+        self.assertEqual(
+            record["Child Gestational Age at Birth"], GESTATIONAL_AGE_ENUM_MAP[5]
+        )
+        self.assertEqual(record["Child # Languages Spoken"], 3)
+        self.assertEqual(record["Child # Studies Participated"], 2)
+        self.assertEqual(record["Study"], self.study.name)
+        self.assertEqual(record["Time of Response"], "2020-03-01T23:30:00+00:00")
+        self.assertEqual(record["Consent Ruling"], "pending")
+        self.assertEqual(record["Number of Responses"], 1)
+
+        record = records[self.unknown_child.uuid]
+        self.assertIsNone(record["Child Age in Days"])
+        self.assertEqual(
+            record["Child Gestational Age at Birth"], GESTATIONAL_AGE_ENUM_MAP[None]
+        )
+        self.assertEqual(record["Child # Languages Spoken"], 0)
+        self.assertEqual(record["Child # Studies Participated"], 0)
+
+    def test_no_responses(self):
+        self.assertEqual(get_flattened_responses(self.responses.none(), {}), [])
+
+
+class UnstackChildrenTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study, name="Study one")
+        self.other_study = G(Study, name="Study two")
+        today = date.today()
+        self.infant = G(
+            Child,
+            birthday=today - timedelta(days=45),
+            languages_spoken=0b11,
+            existing_conditions=0b100,
+        )
+        self.toddler = G(
+            Child,
+            birthday=today - timedelta(days=400),
+            languages_spoken=0b1,
+            existing_conditions=0,
+        )
+        self.preschooler = G(
+            Child,
+            birthday=today - timedelta(days=800),
+            languages_spoken=0,
+            existing_conditions=0,
+        )
+        self.unknown_age = G(
+            Child, birthday=None, languages_spoken=0, existing_conditions=0
+        )
+        for child, study in [
+            (self.infant, self.study),
+            (self.infant, self.study),
+            (self.infant, self.other_study),
+            (self.toddler, self.study),
+            (self.preschooler, self.other_study),
+        ]:
+            G(
+                Response,
+                child=child,
+                study=study,
+                completed_consent_frame=True,
+                demographic_snapshot=None,
+            )
+        self.responses = get_annotated_responses_qs().values("uuid")
+
+    def test_counts(self):
+        studies, languages, characteristics, ages = unstack_children(
+            Child.objects.all(), self.responses
+        )
+        self.assertEqual(studies, {"Study one": 2, "Study two": 2})
+        self.assertEqual(languages, {LANGUAGES[0][1]: 2, LANGUAGES[1][1]: 1})
+        self.assertEqual(characteristics, {CONDITIONS[2][1]: 1})
+        self.assertEqual(ages, {"1 month": 1, "13 months": 1, "2 years": 1, None: 1})
+
+    def test_counts_only_given_children(self):
+        studies, languages, characteristics, ages = unstack_children(
+            Child.objects.filter(id=self.toddler.id), self.responses
+        )
+        self.assertEqual(studies, {"Study one": 1})
+        self.assertEqual(languages, {LANGUAGES[0][1]: 1})
+        self.assertEqual(characteristics, {})
+        self.assertEqual(ages, {"13 months": 1})
+
+
+class StudyParticipantAnalyticsDataViewTestCase(TestCase):
+    def setUp(self):
+        self.client = Force2FAClient()
+        self.recruitment_manager = G(User, is_active=True, is_researcher=True)
+        assign_perm("accounts.can_view_analytics", self.recruitment_manager)
+        assign_perm(
+            "studies.view_all_response_data_in_analytics", self.recruitment_manager
+        )
+        self.researcher = G(User, is_active=True, is_researcher=True)
+        assign_perm("accounts.can_view_analytics", self.researcher)
+
+        self.study = G(Study, name="Visible study")
+        self.other_study = G(Study, name="Other study")
+        assign_perm(
+            StudyPermission.READ_STUDY_RESPONSE_DATA.prefixed_codename,
+            self.researcher,
+            self.study,
+        )
+
+        self.girl = G(Child, gender="f", birthday=date.today() - timedelta(days=400))
+        self.boy = G(Child, gender="m", birthday=date.today() - timedelta(days=100))
+        for child, study in [
+            (self.girl, self.study),
+            (self.girl, self.other_study),
+            (self.boy, self.study),
+        ]:
+            response = G(
+                Response,
+                child=child,
+                study=study,
+                completed_consent_frame=True,
+                demographic_snapshot=None,
+            )
+        G(ConsentRuling, response=response, action="accepted")
+        self.url = reverse("exp:study-participant-analytics-data")
+
+    def get_counts(self, user, **params):
+        self.client.force_login(user)
+        page = self.client.get(self.url, params)
+        self.assertEqual(page.status_code, 200)
+        data = page.json()
+        return {
+            (series["study_id"], series["current_ruling"]): series["num_responses"]
+            for series in data["responses"]
+        }
+
+    def test_recruitment_manager_gets_all_studies(self):
+        self.assertEqual(
+            self.get_counts(self.recruitment_manager),
+            {
+                (self.study.id, "pending"): 1,
+                (self.study.id, "accepted"): 1,
+                (self.other_study.id, "pending"): 1,
+            },
+        )
+
+    def test_researcher_only_gets_own_studies(self):
+        self.assertEqual(
+            self.get_counts(
+                self.researcher, study=[self.study.id, self.other_study.id]
+            ),
+            {(self.study.id, "pending"): 1, (self.study.id, "accepted"): 1},
+        )
+
+    def test_filters(self):
+        self.assertEqual(
+            self.get_counts(
+                self.recruitment_manager, ruling="pending", child_gender="f"
+            ),
+            {(self.study.id, "pending"): 1, (self.other_study.id, "pending"): 1},
+        )
+        self.assertEqual(
+            self.get_counts(self.recruitment_manager, max_age_months=6),
+            {(self.study.id, "accepted"): 1},
+        )
+        self.assertEqual(
+            self.get_counts(
+                self.recruitment_manager,
+                end=(date.today() - timedelta(days=1)).isoformat(),
+            ),
+            {},
+        )
+
+    def test_bins_and_registrations(self):
+        self.client.force_login(self.recruitment_manager)
+        data = self.client.get(self.url, {"interval": "month"}).json()
+        first_of_month = date.today().replace(day=1).isoformat()
+        self.assertEqual(
+            {series["date"] for series in data["responses"]}, {first_of_month}
+        )
+        self.assertEqual(
+            sum(day["num_registrations"] for day in data["registrations"]),
+            User.objects.filter(is_researcher=False).count(),
+        )
+
+    def test_invalid_filters(self):
+        self.client.force_login(self.recruitment_manager)
+        for params in [
+            {"interval": "fortnight"},
+            {"ruling": "maybe"},
+            {"start": "yesterday"},
+            {"study": "first"},
+        ]:
+            page = self.client.get(self.url, params)
+            self.assertEqual(page.status_code, 400)
+            self.assertIn("error", page.json())
+
+    def test_requires_analytics_permission(self):
+        self.client.force_login(G(User, is_active=True, is_researcher=True))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
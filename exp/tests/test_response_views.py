@@ -3,16 +3,26 @@ import datetime
 import io
 import json
 import re
+import zipfile
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
 
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.http import urlencode
 from django_dynamic_fixture import G
 
 from accounts.backends import TWO_FACTOR_AUTH_SESSION_KEY
 from accounts.models import Child, DemographicData, User
 from accounts.utils import hash_id
+from exp.views.responses import (
+    build_framedata_dict_csv,
+    get_frame_data,
+    iter_frame_data,
+)
 from studies.models import ConsentRuling, Lab, Response, Study, StudyType, Video
+from studies.video_archive import VideoArchiveProgress
 
 
 class Force2FAClient(Client):
@@ -256,6 +266,52 @@ class ResponseViewsTestCase(TestCase):
             "Unexpected status code for video attachments page",
         )
 
+    def test_video_attachments_show_archive_progress(self):
+        self.client.force_login(self.study_reader)
+        progress = VideoArchiveProgress(f"{self.study.uuid}_consent_videos", 40)
+        progress.done = 10
+        progress.started_at -= 60
+        progress.store()
+        self.addCleanup(progress.clear)
+        page = self.client.get(
+            reverse("exp:study-attachments", kwargs={"pk": self.study.pk})
+        )
+        self.assertContains(page, "Building the archive of consent videos: 10 of 40")
+        self.assertContains(page, "about 3")
+        self.assertNotContains(page, "archive of all videos")
+
+    def test_video_download_streams_requested_range(self):
+        self.client.force_login(self.study_reader)
+        response = self.responses[0]
+        G(ConsentRuling, response=response, action="accepted")
+        video = G(
+            Video,
+            full_name=f"videoStream_{self.study.uuid}_1-video-setup_{response.uuid}_1594823856933_1.mp4",
+            study=self.study,
+            response=response,
+        )
+        body = MagicMock()
+        body.iter_chunks.return_value = iter([b"0123", b"4"])
+        url = reverse(
+            "exp:study-response-video-download",
+            kwargs={"pk": self.study.pk, "video": video.pk},
+        )
+        with patch("exp.views.responses.get_video_object") as get_video_object:
+            get_video_object.return_value = {
+                "Body": body,
+                "ContentLength": 5,
+                "ContentRange": "bytes 10-14/100",
+                "ContentType": "video/mp4",
+            }
+            page = self.client.get(url, {"mode": "download"}, HTTP_RANGE="bytes=10-14")
+        get_video_object.assert_called_once_with(video.full_name, "bytes=10-14")
+        self.assertEqual(page.status_code, 206)
+        self.assertEqual(page["Content-Range"], "bytes 10-14/100")
+        self.assertEqual(page["Content-Length"], "5")
+        self.assertEqual(b"".join(page.streaming_content), b"01234")
+        page.close()
+        body.close.assert_called_once()
+
     def test_can_see_response_views_as_study_admin(self):
         self.client.force_login(self.study_admin)
         for url in self.all_response_urls:
@@ -291,6 +347,39 @@ class ResponseViewsTestCase(TestCase):
         response = self.client.post(url, {})
         self.assertEqual(self.study.responses.filter(is_preview=True).count(), 0)
 
+    def test_delete_preview_data_deletes_videos_in_batches(self):
+        self.client.force_login(self.study_admin)
+        for n, resp in enumerate(self.preview_responses + self.responses[:1]):
+            G(Video, study=self.study, response=resp, full_name=f"videoStream_{n}.mp4")
+            G(ConsentRuling, response=resp, action="accepted")
+        url = reverse(
+            "exp:study-delete-preview-responses", kwargs={"pk": self.study.pk}
+        )
+        with patch("studies.queries.transaction.on_commit") as on_commit, patch(
+            "studies.queries.delete_videos_from_cloud"
+        ) as delete_videos, patch("studies.queries.S3_DELETE_OBJECTS_MAX_KEYS", 2):
+            on_commit.side_effect = lambda callback: callback()
+            self.client.post(url, {})
+        self.assertFalse(self.study.responses.filter(is_preview=True).exists())
+        self.assertEqual(
+            list(Video.objects.values_list("full_name", flat=True)),
+            [f"videoStream_{self.n_previews}.mp4"],
+        )
+        self.assertFalse(
+            ConsentRuling.objects.filter(
+                response__study=self.study, response__is_preview=True
+            ).exists()
+        )
+        self.assertTrue(self.responses[0].consent_rulings.exists())
+        deleted = [
+            call.kwargs["args"][0] for call in delete_videos.apply_async.call_args_list
+        ]
+        self.assertTrue(all(len(batch) <= 2 for batch in deleted))
+        self.assertCountEqual(
+            [name for batch in deleted for name in batch],
+            [f"videoStream_{n}.mp4" for n in range(self.n_previews)],
+        )
+
 
 class ResponseDataDownloadTestCase(TestCase):
     def setUp(self):
@@ -672,6 +761,99 @@ class ResponseDataDownloadTestCase(TestCase):
             "JSON file not named with -identifiable suffix as expected based on fields included",
         )
 
+    def test_json_download_has_exp_data(self):
+        exp_data = {"0-frame": {"answer": "¿Sí?", "rt": 1.25}}
+        Response.objects.filter(study=self.study).update(exp_data=exp_data)
+        self.client.force_login(self.study_reader)
+        download = self.client.get(self.response_summary_json_url)
+        data = json.loads(b"".join(download.streaming_content).decode("utf-8"))
+        self.assertEqual(len(data), self.n_responses + self.n_previews)
+        for row in data:
+            self.assertEqual(row["exp_data"], exp_data)
+
+    def test_iter_frame_data_matches_get_frame_data(self):
+        now = timezone.now()
+        Response.objects.filter(study=self.study).update(
+            exp_data={
+                "0-video-config": {
+                    "frameType": "DEFAULT",
+                    "eventTimings": [
+                        {"eventType": "started", "timestamp": now, "pos": 1.5},
+                        {"eventType": "ended", "data": {"a": [1, None, True]}},
+                    ],
+                    "generatedProperties": {},
+                    "selections": [now, {"b": now}, [], {}],
+                    "time": {"type": "other", "value": now},
+                    "amount": Decimal("1.10"),
+                    "a": {"b": 1},
+                    "a.b": 2,
+                },
+                "1-exit-survey": {
+                    "frameType": "EXIT",
+                    "birthDate": now,
+                    "generatedProperties": None,
+                    "comment": "¿Sí?",
+                },
+            },
+            global_event_timings=[
+                {"eventType": "nextFrame", "timestamp": now},
+                {"eventType": "exitEarly", "data": {"at": now}},
+            ],
+        )
+        responses = Response.objects.filter(study=self.study)
+
+        rows = list(iter_frame_data(responses))
+        expected_rows = [
+            row for resp in responses.order_by("id") for row in get_frame_data(resp)
+        ]
+        self.assertEqual(rows, expected_rows)
+        self.assertIn(
+            ("1-exit-survey", "", "comment", "¿Sí?"),
+            [(row.frame_id, row.event_number, row.key, row.value) for row in rows],
+        )
+
+    def test_build_framedata_dict_csv(self):
+        output = io.StringIO()
+        writer = csv.DictWriter(
+            output,
+            fieldnames=["column", "description", "possible_frame_id", "possible_key"],
+            restval="",
+            extrasaction="ignore",
+        )
+        build_framedata_dict_csv(writer, Response.objects.filter(study=self.study))
+        rows = list(csv.DictReader(io.StringIO(output.getvalue()), writer.fieldnames))
+        self.assertIn(
+            {
+                "column": "",
+                "description": "",
+                "possible_frame_id": "*-my-consent-frame",
+                "possible_key": "someField",
+            },
+            rows,
+        )
+        self.assertNotIn("*-video-config", [row["possible_frame_id"] for row in rows])
+
+    def test_frame_data_zip_download(self):
+        self.client.force_login(self.study_reader)
+        download = self.client.get(
+            reverse(
+                "exp:study-responses-download-frame-data-zip-csv",
+                kwargs={"pk": self.study.pk},
+            )
+        )
+        zipped = zipfile.ZipFile(io.BytesIO(b"".join(download.streaming_content)))
+        self.assertEqual(len(zipped.namelist()), self.n_responses + self.n_previews)
+        filename = next(
+            name
+            for name in zipped.namelist()
+            if str(self.non_preview_resp.uuid) in name
+        )
+        frame_data = list(csv.DictReader(io.StringIO(zipped.read(filename).decode())))
+        self.assertEqual(
+            [(row["frame_id"], row["key"], row["value"]) for row in frame_data],
+            [("2-my-consent-frame", "someField", "non-preview-data")],
+        )
+
     def test_get_appropriate_fields_in_csv_downloads_set2(self):
         self.client.force_login(self.study_reader)
         query_string = urlencode({"data_options": self.optionset_2}, doseq=True)
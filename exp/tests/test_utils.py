@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from exp.utils import DictFlattener, flatten_dict
+
+
+class FlattenDictTestCase(TestCase):
+    def test_flatten_dict(self):
+        self.assertEqual(
+            flatten_dict({"a": {"x": 3, "y": 4}, "b": {"z": 5}, "c": {}}),
+            {"a.x": 3, "a.y": 4, "b.z": 5},
+        )
+
+    def test_flatten_dict_lists(self):
+        flat = flatten_dict(
+            {"sequence": ["0-intro", "1-video"], "empty": [], "nested": [[{"a": 1}]]}
+        )
+        self.assertEqual(
+            list(flat.items()),
+            [("sequence.0", "0-intro"), ("sequence.1", "1-video"), ("nested.0.0.a", 1)],
+        )
+
+    def test_flatten_dict_conflicting_keys(self):
+        self.assertEqual(flatten_dict({"a": {"x": 3}, "a.x": 4}), {"a.x": 4})
+        self.assertEqual(flatten_dict({"a.x": 4, "a": {"x": 3}}), {"a.x": 3})
+
+    def test_flatten_dict_keeps_top_level_keys(self):
+        self.assertEqual(flatten_dict({1: "a", 2: {3: "b"}}), {1: "a", "2.3": "b"})
+
+    def test_flattener_shares_key_paths(self):
+        flattener = DictFlattener()
+        first = flatten_dict({"frame": {"eventTimings": [{"type": 1}]}}, flattener)
+        second = flatten_dict({"frame": {"eventTimings": [{"type": 2}]}}, flattener)
+        self.assertEqual(second, {"frame.eventTimings.0.type": 2})
+        self.assertIs(next(iter(first)), next(iter(second)))
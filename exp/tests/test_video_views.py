@@ -1,17 +1,39 @@
+import base64
+import hashlib
+import hmac
 import json
 import urllib.parse
 import uuid
+from datetime import timedelta
 from unittest import skip
+from unittest.mock import patch
 
+from botocore.exceptions import ClientError
+from django.conf import settings
 from django.test import TestCase
 from django.urls import reverse
+from django.utils import timezone
 from django_dynamic_fixture import G
 from guardian.shortcuts import assign_perm
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
 
 from accounts.models import Child, User
-from studies.models import Feedback, Lab, Response, Study, StudyType, Video
+from studies.models import (
+    BucketObject,
+    Feedback,
+    Lab,
+    PipeWebhook,
+    Response,
+    Study,
+    StudyType,
+    Video,
+)
+from studies.tasks import (
+    PIPE_WEBHOOK_MAX_ATTEMPTS,
+    ingest_pipe_video,
+    requeue_unprocessed_pipe_webhooks,
+)
 
 
 class RenameVideoTestCase(APITestCase):
@@ -59,6 +81,177 @@ class RenameVideoTestCase(APITestCase):
         self.assertEqual(api_response.status_code, status.HTTP_200_OK)
 
 
+class PipeWebhookIngestionTestCase(TestCase):
+    def setUp(self):
+        self.study = G(Study)
+        self.response = G(
+            Response,
+            study=self.study,
+            exp_data={"3-test-trial": {"frameType": "DEFAULT"}},
+        )
+        self.new_name = f"videoStream_{self.study.uuid}_3-test-trial_{self.response.uuid}_10349395959_359"
+        self.payload = {
+            "version": "1.0",
+            "event": "video_copied_s3",
+            "data": {
+                "s3UploadStatus": "upload success",
+                "videoName": "oldfilename",
+                "type": "MP4",
+                "size": 493534,
+                "id": "123",
+                "payload": self.new_name,
+            },
+        }
+
+    def post_webhook(self):
+        url = reverse("exp:rename-video")
+        payload = str(self.payload)
+        message = f"http://testserver{url}{payload}".encode()
+        signature = base64.b64encode(
+            hmac.new(settings.PIPE_WEBHOOK_KEY.encode(), message, hashlib.sha1).digest()
+        )
+        return self.client.post(
+            url,
+            urllib.parse.urlencode({"payload": payload}),
+            content_type="application/x-www-form-urlencoded",
+            HTTP_X_PIPE_SIGNATURE=signature.decode(),
+            HTTP_HOST="testserver",
+        )
+
+    def test_webhook_saved_once_and_queued_until_processed(self):
+        with patch("exp.views.video.transaction.on_commit") as on_commit, patch(
+            "exp.views.video.ingest_pipe_video"
+        ) as ingest:
+            on_commit.side_effect = lambda callback: callback()
+            first = self.post_webhook()
+            # Not processed yet, so perhaps the task was lost.
+            second = self.post_webhook()
+            PipeWebhook.objects.update(processed_at=timezone.now())
+            third = self.post_webhook()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(third.status_code, 200)
+        self.assertEqual(ingest.delay.call_count, 2)
+        ingest.delay.assert_called_with(123)
+        self.assertEqual(PipeWebhook.objects.get().payload, self.payload)
+        self.assertFalse(Video.objects.exists())
+
+    def test_requeue_unprocessed_webhooks(self):
+        G(PipeWebhook, pipe_numeric_id=1, payload=self.payload, processed_at=None)
+        G(PipeWebhook, pipe_numeric_id=2, payload=self.payload, processed_at=None)
+        G(
+            PipeWebhook,
+            pipe_numeric_id=3,
+            payload=self.payload,
+            processed_at=timezone.now(),
+        )
+        G(
+            PipeWebhook,
+            pipe_numeric_id=4,
+            payload=self.payload,
+            failed_at=timezone.now(),
+        )
+        G(PipeWebhook, pipe_numeric_id=5, payload=self.payload, processed_at=None)
+        # received_at is set on creation, so age the ones that should be requeued.
+        PipeWebhook.objects.filter(pipe_numeric_id__in=[1, 3, 4]).update(
+            received_at=timezone.now() - timedelta(hours=1)
+        )
+        # Too long ago to be worth trying again.
+        PipeWebhook.objects.filter(pipe_numeric_id=5).update(
+            received_at=timezone.now() - timedelta(days=2)
+        )
+        with patch("studies.tasks.ingest_pipe_video") as ingest:
+            requeue_unprocessed_pipe_webhooks()
+        ingest.delay.assert_called_once_with(1)
+
+    def test_webhook_with_bad_signature_forbidden(self):
+        self.payload["data"]["size"] = 1
+        with patch("exp.views.video.ingest_pipe_video") as ingest:
+            response = self.client.post(
+                reverse("exp:rename-video"),
+                urllib.parse.urlencode({"payload": str(self.payload)}),
+                content_type="application/x-www-form-urlencoded",
+                HTTP_X_PIPE_SIGNATURE="bm9wZQ==",
+                HTTP_HOST="testserver",
+            )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(PipeWebhook.objects.exists())
+        ingest.delay.assert_not_called()
+
+    @patch("studies.models.S3_RESOURCE")
+    def test_ingest_renames_video_once(self, s3_resource):
+        G(PipeWebhook, pipe_numeric_id=123, payload=self.payload)
+        G(BucketObject, key="oldfilename.mp4")
+        s3_resource.Object.return_value.copy_from.return_value = {
+            "CopyObjectResult": {"ETag": '"abc"', "LastModified": timezone.now()}
+        }
+        ingest_pipe_video(123)
+        ingest_pipe_video(123)
+        video = Video.objects.get()
+        self.assertEqual(video.full_name, f"{self.new_name}.mp4")
+        self.assertEqual(video.response, self.response)
+        self.assertEqual(s3_resource.Object.return_value.copy_from.call_count, 1)
+        self.assertIsNotNone(PipeWebhook.objects.get().processed_at)
+        stored_object = BucketObject.objects.get()
+        self.assertEqual(stored_object.key, f"{self.new_name}.mp4")
+        self.assertEqual(stored_object.size, 493534)
+        self.assertEqual(stored_object.etag, '"abc"')
+
+    @patch("studies.models.S3_RESOURCE")
+    def test_ingest_fails_unparseable_payload(self, s3_resource):
+        self.payload["data"]["payload"] = "not_a_video_name"
+        G(PipeWebhook, pipe_numeric_id=123, payload=self.payload)
+        # Not retried, as it can never succeed.
+        ingest_pipe_video(123)
+        webhook = PipeWebhook.objects.get()
+        self.assertIsNotNone(webhook.failed_at)
+        self.assertIsNone(webhook.processed_at)
+        self.assertIn("ValueError", webhook.last_error)
+        s3_resource.Object.assert_not_called()
+        self.assertFalse(Video.objects.exists())
+
+        PipeWebhook.objects.update(received_at=timezone.now() - timedelta(hours=1))
+        with patch("studies.tasks.ingest_pipe_video") as ingest:
+            requeue_unprocessed_pipe_webhooks()
+        ingest.delay.assert_not_called()
+
+    @patch("studies.models.S3_RESOURCE")
+    def test_ingest_resumes_after_copying(self, s3_resource):
+        G(PipeWebhook, pipe_numeric_id=123, payload=self.payload)
+        s3_object = s3_resource.Object.return_value
+        s3_object.copy_from.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "CopyObject"
+        )
+        s3_object.e_tag = '"abc"'
+        s3_object.last_modified = timezone.now()
+        ingest_pipe_video(123)
+        s3_object.load.assert_called_once()
+        self.assertEqual(Video.objects.get().full_name, f"{self.new_name}.mp4")
+
+    @patch("studies.models.S3_RESOURCE")
+    def test_ingest_fails_until_upload_found(self, s3_resource):
+        G(PipeWebhook, pipe_numeric_id=123, payload=self.payload)
+        s3_object = s3_resource.Object.return_value
+        s3_object.copy_from.side_effect = ClientError(
+            {"Error": {"Code": "NoSuchKey"}}, "CopyObject"
+        )
+        s3_object.load.side_effect = ClientError(
+            {"Error": {"Code": "404"}}, "HeadObject"
+        )
+        with self.assertRaises(ClientError):
+            ingest_pipe_video(123)
+        self.assertFalse(Video.objects.exists())
+        webhook = PipeWebhook.objects.get()
+        self.assertIsNone(webhook.processed_at)
+        self.assertIsNone(webhook.failed_at)
+        self.assertEqual(webhook.attempts, 1)
+
+        # Until it's been tried too many times.
+        PipeWebhook.objects.update(attempts=PIPE_WEBHOOK_MAX_ATTEMPTS - 1)
+        ingest_pipe_video(123)
+        self.assertIsNotNone(PipeWebhook.objects.get().failed_at)
+
+
 class CheckPipeProcessingTestCase(TestCase):
     def setUp(self):
         self.lab = G(Lab, name="MIT", approved_to_test=True)
@@ -41,7 +41,10 @@ from exp.views import (
     StudyDemographicsDictCSV,
     StudyDemographicsJSON,
     StudyDetailView,
+    StudyEligibleChildrenEstimate,
     StudyListView,
+    StudyParticipantAnalyticsDataView,
+    StudyParticipantAnalyticsResponsesView,
     StudyParticipantAnalyticsView,
     StudyParticipantContactView,
     StudyPreviewDetailView,
@@ -83,6 +86,16 @@ urlpatterns = [
         StudyParticipantAnalyticsView.as_view(),
         name="study-participant-analytics",
     ),
+    path(
+        "studies/analytics/data/",
+        StudyParticipantAnalyticsDataView.as_view(),
+        name="study-participant-analytics-data",
+    ),
+    path(
+        "studies/analytics/responses/",
+        StudyParticipantAnalyticsResponsesView.as_view(),
+        name="study-participant-analytics-responses",
+    ),
     path("studies/create/", StudyCreateView.as_view(), name="study-create"),
     path("studies/<int:pk>/", StudyDetailView.as_view(), name="study-detail"),
     path(
@@ -91,6 +104,11 @@ urlpatterns = [
         name="study-participant-contact",
     ),
     path("studies/<int:pk>/edit/", StudyUpdateView.as_view(), name="study-edit"),
+    path(
+        "studies/<int:pk>/edit/eligible-children/",
+        StudyEligibleChildrenEstimate.as_view(),
+        name="study-eligible-children-estimate",
+    ),
     path(
         "studies/<int:pk>/responses/",
         StudyResponsesList.as_view(),
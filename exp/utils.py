@@ -5,7 +5,55 @@ import io
 RESPONSE_PAGE_SIZE = 500  # for pagination of responses when processing for download
 
 
-def flatten_dict(d):
+class DictFlattener:
+    """Flattens dictionaries as flatten_dict does, sharing key paths between calls.
+
+    Rows of a download mostly have the same nested keys, so each dotted key path is
+    only built once per flattener, and every row's flattened dict shares the same
+    key strings instead of holding its own copies. Use one flattener per download.
+    """
+
+    def __init__(self):
+        self._key_paths = {}
+
+    def key_path(self, prefix, key):
+        """The dotted path to `key` within the container at path `prefix`."""
+        try:
+            return self._key_paths[prefix, key]
+        except KeyError:
+            path = self._key_paths[prefix, key] = prefix + "." + str(key)
+            return path
+        except TypeError:  # Unhashable key, which a dict can't have anyway.
+            return prefix + "." + str(key)
+
+    def flatten(self, d):
+        """Flatten a dictionary where values may be other dictionaries or lists.
+
+        See flatten_dict. Walks the dictionary with an explicit stack rather than
+        rebuilding a dictionary for each level of nesting.
+        """
+        flat = {}
+        # (dotted path to a container, iterator over its remaining items), with the
+        # path None for the top-level dictionary.
+        stack = [(None, iter(d.items()))]
+        while stack:
+            prefix, items = stack[-1]
+            for key, value in items:
+                if prefix is not None:
+                    key = self.key_path(prefix, key)
+                if isinstance(value, dict):
+                    stack.append((str(key), iter(value.items())))
+                    break
+                if isinstance(value, list):
+                    stack.append((str(key), enumerate(value)))
+                    break
+                flat[key] = value
+            else:
+                stack.pop()
+        return flat
+
+
+def flatten_dict(d, flattener=None):
     """Flatten a dictionary where values may be other dictionaries
 
 	The dictionary returned will have keys created by joining higher- to lower-level keys with dots. e.g. if the original dict d is
@@ -16,22 +64,10 @@ def flatten_dict(d):
 	Note that if a key is mapped to an empty dict or list, NO key in the returned dict is created for this key.
 
 	Also note that values may be overwritten if there is conflicting dot notation in the input dictionary, e.g. {'a': {'x': 3}, 'a.x': 4}.
-	"""
-    # http://codereview.stackexchange.com/a/21035
-
-    def expand(key, value):
-        if isinstance(value, list):
-            value = {i: v for (i, v) in enumerate(value)}
-        if isinstance(value, dict):
-            return [
-                (str(key) + "." + str(k), v) for k, v in flatten_dict(value).items()
-            ]
-        else:
-            return [(key, value)]
 
-    items = [item for k, v in d.items() for item in expand(k, v)]
-
-    return dict(items)
+	Pass the same DictFlattener when flattening many similar dictionaries, e.g. the rows of a download.
+	"""
+    return (flattener or DictFlattener()).flatten(d)
 
 
 def csv_namedtuple_writer(named_tuple_class):
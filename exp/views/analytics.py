@@ -1,34 +1,38 @@
 import datetime
-import json
 from collections import Counter, defaultdict
 
+import numpy
+import pandas
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.core.paginator import Paginator
-from django.core.serializers.json import DjangoJSONEncoder
-from django.views import generic
+from django.db import connection
+from django.db.models import Count
+from django.http import JsonResponse
+from django.views import View, generic
 
-from accounts.models import Child, User
-from exp.utils import RESPONSE_PAGE_SIZE
+from accounts.models import Child
 from exp.views.mixins import ExperimenterLoginRequiredMixin
 from studies.fields import (
     CONDITIONS,
     GESTATIONAL_AGE_ENUM_MAP,
     LANGUAGES,
-    popcnt_bitfield,
+    popcount_array,
 )
-from studies.models import Study
+from studies.graphs import (
+    BIN_PERIODS,
+    get_binned_registration_series,
+    get_binned_response_series,
+)
+from studies.models import ACCEPTED, PENDING, REJECTED, Study
 from studies.permissions import StudyPermission
-from studies.queries import get_annotated_responses_qs, studies_for_which_user_has_perm
-
-LANGUAGES_MAP = {code: lang for code, lang in LANGUAGES}
-CONDITIONS_MAP = {snake_cased: title_cased for snake_cased, title_cased in CONDITIONS}
+from studies.queries import (
+    get_annotated_responses_qs,
+    get_registration_summaries,
+    get_response_summaries,
+    studies_for_which_user_has_perm,
+)
 
 
-class StudyParticipantAnalyticsView(
-    ExperimenterLoginRequiredMixin, UserPassesTestMixin, generic.TemplateView
-):
-    template_name = "studies/study_participant_analytics.html"
-    model = Study
+class ParticipantAnalyticsMixin(ExperimenterLoginRequiredMixin, UserPassesTestMixin):
     raise_exception = True
 
     def can_see_analytics(self):
@@ -39,91 +43,56 @@ class StudyParticipantAnalyticsView(
 
     test_func = can_see_analytics
 
+    def can_view_all_responses(self):
+        return self.request.user.has_perm("studies.view_all_response_data_in_analytics")
+
+    def get_studies_for_user(self):
+        if self.can_view_all_responses():
+            # Recruitment manager
+            return Study.objects.all()
+        # Researcher or other
+        return studies_for_which_user_has_perm(
+            self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
+        )
+
+    def get_responses_for_user(self, studies_for_user):
+        # Only include real (non-preview) responses here
+        return get_annotated_responses_qs().filter(
+            study__in=studies_for_user, is_preview=False
+        )
+
+
+class StudyParticipantAnalyticsView(ParticipantAnalyticsMixin, generic.TemplateView):
+    template_name = "studies/study_participant_analytics.html"
+    model = Study
+
     def get_context_data(self, **kwargs):
-        """Context getter override."""
+        """Context getter override.
+
+        Response records for the pivot table are fetched separately, from
+        StudyParticipantAnalyticsResponsesView, so only counts are taken here.
+        """
         ctx = super().get_context_data(**kwargs)
 
-        if self.request.user.has_perm("studies.view_all_response_data_in_analytics"):
-            # Recruitment manager
-            studies_for_user = Study.objects.all()
+        studies_for_user = self.get_studies_for_user()
+        if self.can_view_all_responses():
             # Template tag needs a single object to check, so we need to flag based on queryset.
             ctx["can_view_all_responses"] = True
-        else:
-            # Researcher or other
-            studies_for_user = studies_for_which_user_has_perm(
-                self.request.user, StudyPermission.READ_STUDY_RESPONSE_DATA
-            )
+            ctx["summarized_responses"] = True
 
-        # Responses for studies - only include real (non-preview) responses here
-        annotated_responses = (
-            get_annotated_responses_qs()
-            .filter(study__in=studies_for_user, is_preview=False)
-            .select_related("child", "child__user", "study", "demographic_snapshot")
-        ).values(
-            "uuid",
-            "date_created",
-            "current_ruling",
-            "child_id",
-            "child__uuid",
-            "child__birthday",
-            "child__gender",
-            "child__gestational_age_at_birth",
-            "child__languages_spoken",
-            "study__name",
-            "study_id",
-            "child__user__uuid",
-            "demographic_snapshot__number_of_children",
-            "demographic_snapshot__race_identification",
-            "demographic_snapshot__number_of_guardians",
-            "demographic_snapshot__annual_income",
-            "demographic_snapshot__age",
-            "demographic_snapshot__education_level",
-            "demographic_snapshot__gender",
-            "demographic_snapshot__spouse_education_level",
-            "demographic_snapshot__density",
-            "demographic_snapshot__number_of_books",
-            "demographic_snapshot__country",
-            "demographic_snapshot__state",
-            "demographic_snapshot__lookit_referrer",
-            "demographic_snapshot__additional_comments",
-        )
-
-        # now, map studies for each child, and gather demographic data as well.
-        studies_for_child = defaultdict(set)
-        paginator = Paginator(annotated_responses, RESPONSE_PAGE_SIZE)
-        for page_num in paginator.page_range:
-            page_of_responses = paginator.page(page_num)
-            for resp in page_of_responses:
-                studies_for_child[resp["child_id"]].add(resp["study__name"])
-
-            # Include _all_ non-researcher users on Lookit
-        registrations = User.objects.filter(is_researcher=False).values_list(
-            "date_created", flat=True
-        )
+        responses = self.get_responses_for_user(studies_for_user)
 
         ctx["all_studies"] = studies_for_user
 
-        ctx["registration_data"] = json.dumps(
-            list(registrations), cls=DjangoJSONEncoder
-        )
-
         if self.request.user.has_perm("accounts.can_view_all_children_in_analytics"):
             children_queryset = Child.objects.filter(user__is_researcher=False)
             ctx["can_view_all_children"] = True
         else:
             children_queryset = Child.objects.filter(
                 user__is_researcher=False,
-                id__in=annotated_responses.values_list(
-                    "child_id", flat=True
-                ).distinct(),
+                id__in=responses.values_list("child_id", flat=True).distinct(),
             )
-        children_pivot_data = unstack_children(children_queryset, studies_for_child)
-
-        flattened_responses = get_flattened_responses(
-            annotated_responses, studies_for_child
-        )
-
-        ctx["response_timeseries_data"] = json.dumps(flattened_responses, default=str)
+        children_pivot_data = unstack_children(children_queryset, responses)
 
         ctx["studies"], ctx["languages"], ctx["characteristics"], ctx["ages"] = [
             dict(counter) for counter in children_pivot_data
@@ -131,108 +100,398 @@ class StudyParticipantAnalyticsView(
         return ctx
 
 
-def get_flattened_responses(response_qs, studies_for_child):
-    """Get derived attributes for children.
+class StudyParticipantAnalyticsResponsesView(ParticipantAnalyticsMixin, View):
+    """Response records for the participant analytics pivot table, as JSON.
 
-    TODO: consider whether or not this work should be extracted out into a dataframe.
+    Recruitment managers get records of daily counts from the materialized
+    summaries, as per-response data across every study is too much to build.
+    Other researchers get a record per response to the studies they can see.
     """
-    response_data = []
-    paginator = Paginator(response_qs, RESPONSE_PAGE_SIZE)
-    for page_num in paginator.page_range:
-        page_of_responses = paginator.page(page_num)
-        for resp in page_of_responses:
-            participation_date = resp["date_created"]
-            child_age_in_days = (
-                resp["date_created"].date() - resp["child__birthday"]
-            ).days
-            languages_spoken = popcnt_bitfield(
-                int(resp["child__languages_spoken"]), "languages"
-            )
-            response_data.append(
+
+    def get(self, request, *args, **kwargs):
+        studies_for_user = self.get_studies_for_user()
+        if self.can_view_all_responses():
+            return JsonResponse(
                 {
-                    "Response (unique identifier)": resp["uuid"],
-                    "Child (unique identifier)": resp["child__uuid"],
-                    "Child Age in Days": child_age_in_days,
-                    "Child Age in Months": int(child_age_in_days // 30),
-                    "Child Age in Years": int(child_age_in_days // 365),
-                    "Child Gender": resp["child__gender"],
-                    "Child Gestational Age at Birth": GESTATIONAL_AGE_ENUM_MAP.get(
-                        resp["child__gestational_age_at_birth"], "Unknown"
-                    ),
-                    "Child # Languages Spoken": len(languages_spoken),
-                    "Child # Studies Participated": len(
-                        studies_for_child[resp["child_id"]]
+                    "summarized": True,
+                    "responses": get_summarized_responses(
+                        get_response_summaries(),
+                        dict(studies_for_user.values_list("id", "name")),
                     ),
-                    "Study": resp["study__name"],
-                    "Study ID": resp["study_id"],  # TODO: change this to use UUID
-                    "Family (unique identifier)": resp["child__user__uuid"],
-                    "Family # of Children": resp[
-                        "demographic_snapshot__number_of_children"
-                    ],
-                    "Family Race/Ethnicity": resp[
-                        "demographic_snapshot__race_identification"
-                    ],
-                    "Family # of Guardians": resp[
-                        "demographic_snapshot__number_of_guardians"
-                    ],
-                    "Family Annual Income": resp["demographic_snapshot__annual_income"],
-                    "Parent/Guardian Age": resp["demographic_snapshot__age"],
-                    "Parent/Guardian Education Level": resp[
-                        "demographic_snapshot__education_level"
-                    ],
-                    "Parent/Guardian Gender": resp["demographic_snapshot__gender"],
-                    "Parent/Guardian Spouse Educational Level": resp[
-                        "demographic_snapshot__spouse_education_level"
-                    ],
-                    "Living Density": resp["demographic_snapshot__density"],
-                    "Number of Books": resp["demographic_snapshot__number_of_books"],
-                    "Country": resp["demographic_snapshot__country"],
-                    "State": resp["demographic_snapshot__state"],
-                    "Time of Response": resp["date_created"].isoformat(),
-                    "Consent Ruling": resp["current_ruling"],
-                    "Lookit Referrer": resp["demographic_snapshot__lookit_referrer"],
-                    "Additional Comments": resp[
-                        "demographic_snapshot__additional_comments"
-                    ],
                 }
             )
 
+        responses = self.get_responses_for_user(studies_for_user)
+        # now, map studies for each child, and gather demographic data as well.
+        studies_for_child = defaultdict(set)
+        for child_id, study_name in (
+            responses.order_by().values_list("child_id", "study__name").distinct()
+        ):
+            studies_for_child[child_id].add(study_name)
+        return JsonResponse(
+            {
+                "summarized": False,
+                "responses": get_flattened_responses(responses, studies_for_child),
+            }
+        )
+
+
+class StudyParticipantAnalyticsDataView(ParticipantAnalyticsMixin, View):
+    """Binned response and registration counts for participant analytics, as JSON.
+
+    Counts come from the daily summaries, so this is cheap however many responses
+    match. All query parameters are optional:
+
+        study (repeatable): IDs of studies to include, out of those the user can see.
+        start, end: Inclusive range of dates, as YYYY-MM-DD.
+        ruling (repeatable): Current consent rulings to include.
+        child_gender, country (repeatable): Demographic facets to include.
+        min_age_months, max_age_months: Inclusive range of child ages when responding.
+        interval: Bin size - day (default), week or month.
+    """
+
+    def parse_filters(self, query_dict):
+        """Parse and validate query parameters.
+
+        Raises:
+            ValueError: if any parameter is invalid.
+        """
+        study_ids = set(self.get_studies_for_user().values_list("id", flat=True))
+        requested_study_ids = query_dict.getlist("study")
+        if requested_study_ids:
+            try:
+                study_ids &= {int(study_id) for study_id in requested_study_ids}
+            except ValueError:
+                raise ValueError("Invalid study ID.")
+
+        try:
+            start, end = [
+                datetime.date.fromisoformat(query_dict[bound])
+                if query_dict.get(bound)
+                else None
+                for bound in ("start", "end")
+            ]
+        except ValueError:
+            raise ValueError("Invalid date range.")
+
+        rulings = set(query_dict.getlist("ruling"))
+        if not rulings <= {ACCEPTED, REJECTED, PENDING}:
+            raise ValueError("Invalid consent ruling.")
+
+        try:
+            min_age_months, max_age_months = [
+                int(query_dict[bound]) if query_dict.get(bound) else None
+                for bound in ("min_age_months", "max_age_months")
+            ]
+        except ValueError:
+            raise ValueError("Invalid age range.")
+
+        interval = query_dict.get("interval", "day")
+        if interval not in BIN_PERIODS:
+            raise ValueError("Invalid interval.")
+
+        return {
+            "study_ids": study_ids,
+            "start": start,
+            "end": end,
+            "rulings": rulings,
+            "child_genders": set(query_dict.getlist("child_gender")),
+            "countries": set(query_dict.getlist("country")),
+            "min_age_months": min_age_months,
+            "max_age_months": max_age_months,
+            "interval": interval,
+        }
+
+    def get(self, request, *args, **kwargs):
+        try:
+            filters = self.parse_filters(request.GET)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        start, end = filters["start"], filters["end"]
+
+        def in_date_range(summary):
+            return (start is None or start <= summary["date"]) and (
+                end is None or summary["date"] <= end
+            )
+
+        def matches_filters(summary):
+            age_in_months = summary["child_age_in_months"]
+            return (
+                in_date_range(summary)
+                and (
+                    not filters["rulings"]
+                    or summary["current_ruling"] in filters["rulings"]
+                )
+                and (
+                    not filters["child_genders"]
+                    or summary["child_gender"] in filters["child_genders"]
+                )
+                and (
+                    not filters["countries"]
+                    or summary["country"] in filters["countries"]
+                )
+                and (
+                    filters["min_age_months"] is None
+                    or (
+                        age_in_months is not None
+                        and filters["min_age_months"] <= age_in_months
+                    )
+                )
+                and (
+                    filters["max_age_months"] is None
+                    or (
+                        age_in_months is not None
+                        and age_in_months <= filters["max_age_months"]
+                    )
+                )
+            )
+
+        response_summaries = filter(
+            matches_filters, get_response_summaries(filters["study_ids"])
+        )
+        registration_summaries = filter(in_date_range, get_registration_summaries())
+
+        return JsonResponse(
+            {
+                "interval": filters["interval"],
+                "responses": get_binned_response_series(
+                    response_summaries, filters["interval"]
+                ),
+                "registrations": get_binned_registration_series(
+                    registration_summaries, filters["interval"]
+                ),
+            }
+        )
+
+
+# Response fields passed through to the timeseries records unchanged, by label.
+RESPONSE_RECORD_FIELDS = {
+    "Response (unique identifier)": "uuid",
+    "Child (unique identifier)": "child__uuid",
+    "Child Gender": "child__gender",
+    "Study": "study__name",
+    "Study ID": "study_id",  # TODO: change this to use UUID
+    "Family (unique identifier)": "child__user__uuid",
+    "Family # of Children": "demographic_snapshot__number_of_children",
+    "Family Race/Ethnicity": "demographic_snapshot__race_identification",
+    "Family # of Guardians": "demographic_snapshot__number_of_guardians",
+    "Family Annual Income": "demographic_snapshot__annual_income",
+    "Parent/Guardian Age": "demographic_snapshot__age",
+    "Parent/Guardian Education Level": "demographic_snapshot__education_level",
+    "Parent/Guardian Gender": "demographic_snapshot__gender",
+    "Parent/Guardian Spouse Educational Level": "demographic_snapshot__spouse_education_level",
+    "Living Density": "demographic_snapshot__density",
+    "Number of Books": "demographic_snapshot__number_of_books",
+    "Country": "demographic_snapshot__country",
+    "State": "demographic_snapshot__state",
+    "Consent Ruling": "current_ruling",
+    "Lookit Referrer": "demographic_snapshot__lookit_referrer",
+    "Additional Comments": "demographic_snapshot__additional_comments",
+}
+
+# Lookup table from gestational age enum (offset by one, so that None can land on
+# index 0) to display label.
+GESTATIONAL_AGE_LABELS = numpy.array(
+    [GESTATIONAL_AGE_ENUM_MAP.get(None, "Unknown")]
+    + [
+        GESTATIONAL_AGE_ENUM_MAP.get(enum_value, "Unknown")
+        for enum_value in range(len(GESTATIONAL_AGE_ENUM_MAP))
+    ],
+    dtype=object,
+)
+
+
+def _with_nulls(values, is_null):
+    """Convert a numpy array to a list of python scalars, with None where is_null."""
+    values = values.astype(object)
+    values[is_null] = None
+    return values.tolist()
+
+
+def get_flattened_responses(response_qs, studies_for_child):
+    """Get derived attributes for children.
+
+    Columns are read from the cursor in a single pass, and derived attributes are
+    computed over whole columns at once rather than response by response.
+    """
+    source_fields = [
+        "date_created",
+        "child_id",
+        "child__birthday",
+        "child__gestational_age_at_birth",
+        "child__languages_spoken",
+        *RESPONSE_RECORD_FIELDS.values(),
+    ]
+    rows = list(response_qs.values_list(*source_fields).iterator())
+    if not rows:
+        return []
+    columns = dict(zip(source_fields, zip(*rows)))
+
+    # Ages are in whole days between the (UTC) date of the response and birthday.
+    response_dates = (
+        pandas.DatetimeIndex(columns["date_created"], tz="UTC")
+        .tz_convert(None)
+        .values.astype("datetime64[D]")
+    )
+    birthdays = numpy.array(columns["child__birthday"], dtype="datetime64[D]")
+    no_birthday = numpy.isnat(birthdays)
+    child_age_in_days = numpy.where(
+        no_birthday, 0, (response_dates - birthdays).astype(numpy.int64)
+    )
+
+    gestational_ages = columns["child__gestational_age_at_birth"]
+    gestational_age_labels = GESTATIONAL_AGE_LABELS[
+        numpy.array(
+            [-1 if age is None else age for age in gestational_ages], dtype=numpy.intp
+        )
+        + 1
+    ]
+
+    language_counts = popcount_array(
+        numpy.fromiter(
+            map(int, columns["child__languages_spoken"]),
+            dtype=numpy.int64,
+            count=len(rows),
+        )
+    )
+
+    child_ids, child_positions = numpy.unique(
+        numpy.array(columns["child_id"]), return_inverse=True
+    )
+    study_counts = numpy.array(
+        [len(studies_for_child.get(child_id, ())) for child_id in child_ids.tolist()]
+    )[child_positions]
+
+    derived_columns = {
+        "Child Age in Days": _with_nulls(child_age_in_days, no_birthday),
+        "Child Age in Months": _with_nulls(child_age_in_days // 30, no_birthday),
+        "Child Age in Years": _with_nulls(child_age_in_days // 365, no_birthday),
+        "Child Gestational Age at Birth": gestational_age_labels.tolist(),
+        "Child # Languages Spoken": language_counts.tolist(),
+        "Child # Studies Participated": study_counts.tolist(),
+        "Time of Response": [
+            date_created.isoformat() for date_created in columns["date_created"]
+        ],
+        "Number of Responses": [1] * len(rows),
+    }
+    labels = [*RESPONSE_RECORD_FIELDS, *derived_columns]
+    record_columns = [
+        *(columns[field] for field in RESPONSE_RECORD_FIELDS.values()),
+        *derived_columns.values(),
+    ]
+    return [dict(zip(labels, record)) for record in zip(*record_columns)]
+
+
+def get_summarized_responses(response_summaries, study_names):
+    """Get records in the same shape as get_flattened_responses, from daily summaries.
+
+    Each record stands for "Number of Responses" responses. Fields that identify or
+    describe individual responses, children or families aren't available.
+    """
+    response_data = []
+    for summary_id, summary in enumerate(response_summaries):
+        child_age_in_months = summary["child_age_in_months"]
+        response_data.append(
+            {
+                "Response (unique identifier)": f"summary-{summary_id}",
+                "Child Age in Months": child_age_in_months,
+                "Child Age in Years": None
+                if child_age_in_months is None
+                else child_age_in_months * 30 // 365,
+                "Child Gender": summary["child_gender"],
+                "Child Gestational Age at Birth": GESTATIONAL_AGE_ENUM_MAP.get(
+                    summary["child_gestational_age_at_birth"], "Unknown"
+                ),
+                "Study": study_names.get(summary["study_id"]),
+                "Study ID": summary["study_id"],
+                "Country": summary["country"],
+                # Local midnight, so the browser bins it on the right day.
+                "Time of Response": f"{summary['date'].isoformat()}T00:00:00",
+                "Consent Ruling": summary["current_ruling"],
+                "Number of Responses": summary["num_responses"],
+            }
+        )
+
     return response_data
 
 
-def unstack_children(children_queryset, studies_for_child_map):
-    """Unstack spoken languages, characteristics/conditions, and parent races/ethnicities"""
+def _bit_count_columns(field, flags):
+    return [
+        f"SUM((({field} & {1 << bit_index}) <> 0)::int)"
+        for bit_index in range(len(flags))
+    ]
+
+
+# Per age bucket counts of children, and of children with each language and
+# condition flag set. Buckets match the ages shown to researchers: floor division
+# is spelled out, as Postgres integer division truncates towards zero.
+CHILD_AGE_AND_BITFIELD_COUNTS_QUERY = """
+SELECT CASE
+           WHEN age_in_days IS NULL OR age_in_days = 0 THEN NULL
+           WHEN floor(age_in_days / 30.0) = 1 THEN '1 month'
+           WHEN floor(age_in_days / 30.0) < 24 THEN floor(age_in_days / 30.0)::int || ' months'
+           WHEN floor(age_in_days / 30.0) = 24 THEN '2 years'
+           ELSE floor(age_in_days / 365.0)::int || ' years'
+           END AS age,
+       COUNT(*),
+       {bit_count_columns}
+FROM (
+         SELECT %s::date - children.birthday AS age_in_days,
+                children.languages_spoken,
+                children.existing_conditions
+         FROM ({children_query}) children
+     ) child_ages
+GROUP BY 1
+"""
+
+
+def unstack_children(children_queryset, responses_queryset):
+    """Unstack spoken languages, characteristics/conditions, ages and studies.
+
+    All counting happens in the database, so children are never loaded.
+
+    Args:
+        children_queryset: The children to count.
+        responses_queryset: Responses to count children's studies from.
+
+    Returns:
+        A tuple of Counters: children per study name, per language, per
+        characteristic/condition, and per age bucket.
+    """
+    children_query, children_params = (
+        children_queryset.order_by()
+        .values("birthday", "languages_spoken", "existing_conditions")
+        .query.sql_with_params()
+    )
+    query = CHILD_AGE_AND_BITFIELD_COUNTS_QUERY.format(
+        bit_count_columns=",\n       ".join(
+            _bit_count_columns("languages_spoken", LANGUAGES)
+            + _bit_count_columns("existing_conditions", CONDITIONS)
+        ),
+        children_query=children_query,
+    )
+
     languages = Counter()
     characteristics = Counter()
-    studies = Counter()
     ages = Counter()
-    for child in children_queryset:
-        for study_name in studies_for_child_map[child.id]:
-            studies[study_name] += 1
-        for lang in child.languages_spoken:
-            if lang[1]:
-                languages[LANGUAGES_MAP[lang[0]]] += 1
-        for cond in child.existing_conditions:
-            if cond[1]:
-                characteristics[CONDITIONS_MAP[cond[0]]] += 1
-
-        child_age_days = (
-            (datetime.date.today() - child.birthday).days if child.birthday else None
-        )
+    with connection.cursor() as cursor:
+        cursor.execute(query, [datetime.date.today(), *children_params])
+        for child_age, num_children, *bit_counts in cursor.fetchall():
+            ages[child_age] += num_children
+            for (_, language), count in zip(LANGUAGES, bit_counts):
+                languages[language] += count
+            for (_, condition), count in zip(CONDITIONS, bit_counts[len(LANGUAGES) :]):
+                characteristics[condition] += count
 
-        if child_age_days:  # In the rare case that we don't have a child age
-            child_age_months = child_age_days // 30
-            if child_age_months == 1:
-                child_age = "1 month"
-            elif child_age_months < 24:
-                child_age = str(child_age_months) + " months"
-            elif child_age_months == 24:
-                child_age = "2 years"
-            else:
-                child_age = str(child_age_days // 365) + " years"
-        else:
-            child_age = None
-
-        ages[child_age] += 1
+    studies = Counter(
+        dict(
+            responses_queryset.filter(child__in=children_queryset)
+            .order_by()
+            .values_list("study__name")
+            .annotate(Count("child_id", distinct=True))
+        )
+    )
 
-    return studies, languages, characteristics, ages
+    # Only keep flags that some child actually has.
+    return studies, +languages, +characteristics, ages
@@ -2,17 +2,19 @@ import io
 import json
 import zipfile
 from functools import cached_property
-from typing import Callable, Dict, KeysView, List, NamedTuple, Set, Union
+from itertools import groupby
+from operator import attrgetter
+from typing import Callable, Dict, Iterator, KeysView, List, NamedTuple, Set, Union
 
-import requests
+from botocore.exceptions import ClientError
 from django.contrib import messages
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.core.exceptions import ObjectDoesNotExist, SuspiciousOperation
-from django.core.files import File
 from django.core.paginator import Paginator
 from django.db.models import Prefetch
 from django.http import (
     FileResponse,
+    Http404,
     HttpResponse,
     HttpResponseRedirect,
     JsonResponse,
@@ -30,8 +32,10 @@ from accounts.utils import (
     hash_id,
     hash_participant_id,
 )
+from attachment_helpers import get_video_object, iter_video_chunks
 from exp.utils import (
     RESPONSE_PAGE_SIZE,
+    DictFlattener,
     csv_dict_output_and_writer,
     csv_namedtuple_writer,
     flatten_dict,
@@ -45,13 +49,20 @@ from exp.views.mixins import (
     SingleObjectFetchProtocol,
     StudyLookupMixin,
 )
+from project.fields.datetime_aware_jsonfield import (
+    dumps_with_raw_json,
+    get_value_for_output,
+)
 from studies.models import Feedback, Response, Study, Video
 from studies.permissions import StudyPermission
 from studies.queries import (
+    delete_preview_responses,
     get_consent_statistics,
     get_responses_with_current_rulings_and_videos,
+    stream_frame_data,
 )
 from studies.tasks import build_framedata_dict, build_zipfile_of_videos
+from studies.video_archive import VideoArchiveProgress
 
 
 class ResponseDataColumn(NamedTuple):
@@ -702,7 +713,8 @@ def construct_response_dictionary(
                 resp_dict[col.id] = col.extractor(resp)
     # Include exp_data field in dictionary?
     if include_exp_data:
-        resp_dict["exp_data"] = resp.exp_data
+        # Left undecoded where it can be, for dumps_with_raw_json to output as it is.
+        resp_dict["exp_data"] = get_value_for_output(resp, "exp_data")
     return resp_dict
 
 
@@ -735,13 +747,17 @@ FRAME_DATA_HEADER_DESCRIPTIONS = {
 }
 
 
-def get_frame_data(resp: Union[Response, Dict]) -> List[FrameDataRow]:
+def get_frame_data(
+    resp: Union[Response, Dict], flattener: DictFlattener = None
+) -> List[FrameDataRow]:
     """Get list of data stored in response's exp_data and global_event_timings fields.
 
     Args:
         resp(Response or dict): response data to process. If dict, must contain fields
             child__uuid, study__uuid, study__salt, study__hash_digits, uuid, exp_data, and
             global_event_timings.
+        flattener(DictFlattener): to flatten frame data with, shared between responses
+            where there are many to process.
 
     Returns:
         List of FrameDataRows each representing a single piece of data from global_event_timings or
@@ -759,7 +775,6 @@ def get_frame_data(resp: Union[Response, Dict]) -> List[FrameDataRow]:
             "global_event_timings": resp.global_event_timings,
         }
 
-    frame_data_tuples = []
     child_hashed_id = hash_id(
         resp["child__uuid"],
         resp["study__uuid"],
@@ -768,92 +783,143 @@ def get_frame_data(resp: Union[Response, Dict]) -> List[FrameDataRow]:
     )
 
     # First add all of the global event timings as events with frame_id "global"
-    for (iEvent, event) in enumerate(resp["global_event_timings"]):
-        for (key, value) in event.items():
+    frame_data_tuples = get_global_event_rows(
+        child_hashed_id, str(resp["uuid"]), resp["global_event_timings"]
+    )
+
+    # Next add all data in exp_data
+    flattener = flattener or DictFlattener()
+    for frame_id, frame_data in resp["exp_data"].items():
+        frame_data_tuples.extend(
+            get_frame_rows(
+                child_hashed_id,
+                str(resp["uuid"]),
+                frame_id,
+                flatten_dict(frame_data, flattener),
+                frame_data.get("frameType", None),
+            )
+        )
+
+    return frame_data_tuples
+
+
+def get_global_event_rows(
+    child_hashed_id: str, response_uuid: str, global_event_timings: List[Dict]
+) -> List[FrameDataRow]:
+    """Get FrameDataRows for a response's global event timings, with frame_id "global"."""
+    return [
+        FrameDataRow(
+            child_hashed_id=child_hashed_id,
+            response_uuid=response_uuid,
+            frame_id="global",
+            key=key,
+            event_number=str(iEvent),
+            value=value,
+        )
+        for (iEvent, event) in enumerate(global_event_timings)
+        for (key, value) in event.items()
+    ]
+
+
+def get_frame_rows(
+    child_hashed_id: str,
+    response_uuid: str,
+    frame_id: str,
+    flat_frame_data: Dict,
+    frame_type=None,
+) -> List[FrameDataRow]:
+    """Get FrameDataRows for one frame of a response's exp_data, flattened by flatten_dict."""
+    frame_data_tuples = []
+    event_prefix = "eventTimings."
+    for (key, value) in flat_frame_data.items():
+        # Process event data separately and include event_number within frame
+        if key.startswith(event_prefix):
+            key_pieces = key.split(".")
             frame_data_tuples.append(
                 FrameDataRow(
                     child_hashed_id=child_hashed_id,
-                    response_uuid=str(resp["uuid"]),
-                    frame_id="global",
+                    response_uuid=response_uuid,
+                    frame_id=frame_id,
+                    key=".".join(key_pieces[2:]),
+                    event_number=str(key_pieces[1]),
+                    value=value,
+                )
+            )
+            # omit frameType values from CSV
+        elif key == "frameType":
+            continue
+            # Omit the DOB from any exit survey
+        elif key == "birthDate" and frame_type == "EXIT":
+            continue
+            # Omit empty generatedProperties values from CSV
+        elif key == "generatedProperties" and not value:
+            continue
+            # For all other data, create a regular entry with frame_id and no event #
+        else:
+            frame_data_tuples.append(
+                FrameDataRow(
+                    child_hashed_id=child_hashed_id,
+                    response_uuid=response_uuid,
+                    frame_id=frame_id,
                     key=key,
-                    event_number=str(iEvent),
+                    event_number="",
                     value=value,
                 )
             )
+    return frame_data_tuples
 
-    # Next add all data in exp_data
-    event_prefix = "eventTimings."
-    for frame_id, frame_data in resp["exp_data"].items():
-        for (key, value) in flatten_dict(frame_data).items():
-            # Process event data separately and include event_number within frame
-            if key.startswith(event_prefix):
-                key_pieces = key.split(".")
-                frame_data_tuples.append(
-                    FrameDataRow(
-                        child_hashed_id=child_hashed_id,
-                        response_uuid=str(resp["uuid"]),
-                        frame_id=frame_id,
-                        key=".".join(key_pieces[2:]),
-                        event_number=str(key_pieces[1]),
-                        value=value,
-                    )
-                )
-                # omit frameType values from CSV
-            elif key == "frameType":
-                continue
-                # Omit the DOB from any exit survey
-            elif key == "birthDate" and frame_data.get("frameType", None) == "EXIT":
-                continue
-                # Omit empty generatedProperties values from CSV
-            elif key == "generatedProperties" and not value:
-                continue
-                # For all other data, create a regular entry with frame_id and no event #
-            else:
-                frame_data_tuples.append(
-                    FrameDataRow(
-                        child_hashed_id=child_hashed_id,
-                        response_uuid=str(resp["uuid"]),
-                        frame_id=frame_id,
-                        key=key,
-                        event_number="",
-                        value=value,
-                    )
-                )
 
-    return frame_data_tuples
+def iter_frame_data(responses) -> Iterator[FrameDataRow]:
+    """Get the same FrameDataRows as get_frame_data, for each of a queryset of responses.
+
+    The session data is flattened by Postgres and streamed from the database (see
+    stream_frame_data), rather than each response being loaded, decoded and
+    flattened here, which takes most of the CPU time of frame data downloads.
+
+    Args:
+        responses: Queryset of Responses. Rows are in order of response id.
+
+    Returns:
+        Iterator of FrameDataRows, in the order get_frame_data would give them for
+        each response in turn.
+    """
+    last_response_uuid = child_hashed_id = None
+    for (response_uuid, *hash_id_args, frame_id, frame_data) in stream_frame_data(
+        responses
+    ):
+        if response_uuid != last_response_uuid:
+            last_response_uuid = response_uuid
+            child_hashed_id = hash_id(*hash_id_args)
+        if frame_id == "global":
+            yield from get_global_event_rows(
+                child_hashed_id, str(response_uuid), frame_data
+            )
+        else:
+            yield from get_frame_rows(
+                child_hashed_id,
+                str(response_uuid),
+                frame_id,
+                frame_data,
+                frame_data.get("frameType", None),
+            )
 
 
 def build_framedata_dict_csv(writer, responses):
-    response_paginator = Paginator(responses, RESPONSE_PAGE_SIZE)
+    """Write a template data dictionary for the frame data of a queryset of responses."""
     unique_frame_ids = set()
     event_keys = set()
     unique_frame_keys_dict = {}
 
-    for page_num in response_paginator.page_range:
-        page_of_responses = response_paginator.page(page_num)
-        for resp in page_of_responses:
-            this_resp_data = get_frame_data(resp)
-            these_ids = {
-                d.frame_id.partition("-")[2]
-                for d in this_resp_data
-                if not d.frame_id == "global"
-            }
-            event_keys = event_keys | {
-                d.key for d in this_resp_data if d.event_number != ""
-            }
-            unique_frame_ids = unique_frame_ids | these_ids
-            for frame_id in these_ids:
-                these_keys = {
-                    d.key
-                    for d in this_resp_data
-                    if d.frame_id.partition("-")[2] == frame_id and d.event_number == ""
-                }
-                if frame_id in unique_frame_keys_dict:
-                    unique_frame_keys_dict[frame_id] = (
-                        unique_frame_keys_dict[frame_id] | these_keys
-                    )
-                else:
-                    unique_frame_keys_dict[frame_id] = these_keys
+    for d in iter_frame_data(responses):
+        if d.event_number != "":
+            event_keys.add(d.key)
+        if d.frame_id == "global":
+            continue
+        frame_id = d.frame_id.partition("-")[2]
+        unique_frame_ids.add(frame_id)
+        frame_keys = unique_frame_keys_dict.setdefault(frame_id, set())
+        if d.event_number == "":
+            frame_keys.add(d.key)
 
     # Start with general descriptions of high-level headers (child_id, response_id, etc.)
     writer.writerows(
@@ -1151,7 +1217,7 @@ class StudySingleResponseDownload(ResponseDownloadMixin, View):
         )
 
         if data_type == "json":
-            cleaned_data = json.dumps(
+            cleaned_data = dumps_with_raw_json(
                 construct_response_dictionary(resp, RESPONSE_COLUMNS, header_options),
                 indent="\t",
                 default=str,
@@ -1209,18 +1275,42 @@ class StudyResponseVideoAttachment(
 
     def get(self, request, *args, **kwargs):
         video = self.video
-        download_url = video.download_url
 
         if self.request.GET.get("mode") == "download":
-            r = requests.get(download_url)
-            response = FileResponse(
-                File.open(io.BytesIO(r.content)),
-                filename=video.filename,
-                as_attachment=True,
-            )
-            return response
+            return self.stream_video(video)
 
-        return redirect(download_url)
+        return redirect(video.download_url)
+
+    def stream_video(self, video):
+        """Pass the video through from S3 as it downloads, or just the range of it
+        asked for, so players can seek without fetching the whole file."""
+        try:
+            s3_object = get_video_object(
+                video.full_name, self.request.META.get("HTTP_RANGE")
+            )
+        except ClientError as e:
+            error = e.response.get("Error", {})
+            if error.get("Code") == "InvalidRange":
+                response = HttpResponse(status=416)
+                if "ActualObjectSize" in error:
+                    response["Content-Range"] = f"bytes */{error['ActualObjectSize']}"
+                return response
+            if error.get("Code") in ("NoSuchKey", "404"):
+                raise Http404("Video not found in storage.")
+            raise
+
+        partial = "ContentRange" in s3_object
+        response = StreamingHttpResponse(
+            iter_video_chunks(s3_object["Body"]),
+            status=206 if partial else 200,
+            content_type=s3_object.get("ContentType") or "application/octet-stream",
+        )
+        response["Content-Length"] = s3_object["ContentLength"]
+        response["Accept-Ranges"] = "bytes"
+        if partial:
+            response["Content-Range"] = s3_object["ContentRange"]
+        response["Content-Disposition"] = f'attachment; filename="{video.filename}"'
+        return response
 
 
 class StudyResponseSubmitFeedback(StudyLookupMixin, UserPassesTestMixin, View):
@@ -1468,16 +1558,7 @@ class StudyDeletePreviewResponses(
         """
         study = self.get_object()
         # Note: delete all, not just consented!
-        preview_responses = study.responses.filter(is_preview=True).prefetch_related(
-            "videos", "responselog_set", "consent_rulings", "feedback"
-        )
-        paginator = Paginator(preview_responses, RESPONSE_PAGE_SIZE)
-        for page_num in paginator.page_range:
-            page_of_responses = paginator.page(page_num)
-            for resp in page_of_responses:
-                # response logs, consent rulings, feedback, videos will all be deleted
-                # via cascades - videos will be removed from S3 also on pre_delete hook
-                resp.delete()
+        delete_preview_responses(study)
         return HttpResponseRedirect(
             reverse("exp:study-responses-all", kwargs={"pk": study.id})
         )
@@ -1497,7 +1578,7 @@ class StudyResponsesJSON(ResponseDownloadMixin, generic.list.ListView):
         if page_num == 1:
             chunk = "[\n"
         chunk += ",\n".join(
-            json.dumps(
+            dumps_with_raw_json(
                 construct_response_dictionary(resp, RESPONSE_COLUMNS, header_options),
                 indent="\t",  # Use tab rather than spaces to make file smaller (ex. 60MB -> 25MB)
                 default=str,
@@ -1542,12 +1623,14 @@ class StudyResponsesCSV(ResponseDownloadMixin, generic.list.ListView):
 
         headers = set()
         session_list = []
+        flattener = DictFlattener()
 
         for page_num in paginator.page_range:
             page_of_responses = paginator.page(page_num)
             for resp in page_of_responses:
                 row_data = flatten_dict(
-                    {col.id: col.extractor(resp) for col in RESPONSE_COLUMNS}
+                    {col.id: col.extractor(resp) for col in RESPONSE_COLUMNS},
+                    flattener,
                 )
                 # Add any new headers from this session
                 headers = headers | row_data.keys()
@@ -1613,6 +1696,7 @@ class StudyChildrenCSV(ResponseDownloadMixin, generic.list.ListView):
 
         child_list = []
         session_list = []
+        flattener = DictFlattener()
 
         for page_num in paginator.page_range:
             page_of_responses = paginator.page(page_num)
@@ -1622,7 +1706,8 @@ class StudyChildrenCSV(ResponseDownloadMixin, generic.list.ListView):
                         col.id: col.extractor(resp)
                         for col in RESPONSE_COLUMNS
                         if col.id in CHILD_CSV_HEADERS
-                    }
+                    },
+                    flattener,
                 )
                 if row_data["child__global_id"] not in child_list:
                     child_list.append(row_data["child__global_id"])
@@ -1678,19 +1763,29 @@ class StudyResponsesFrameDataCSV(ResponseDownloadMixin, generic.list.ListView):
     # TODO: with large files / many responses generation can take a while. Should generate asynchronously along
     # with the data dict.
     def render_to_response(self, context, **response_kwargs):
-        paginator = context["paginator"]
+        responses = context["paginator"].object_list
         study = self.study
 
+        # Frame data for all responses comes from a single query, in order of id;
+        # responses without any still get a file, with just the header.
+        frame_data = groupby(
+            iter_frame_data(responses), key=attrgetter("response_uuid")
+        )
+        next_uuid, next_rows = next(frame_data, (None, ()))
+
         zipped_file = io.BytesIO()  # import io
         with zipfile.ZipFile(zipped_file, "w", zipfile.ZIP_DEFLATED) as zipped:
-            for page_num in paginator.page_range:
-                page_of_responses = paginator.page(page_num)
-                for resp in page_of_responses:
-                    data = build_single_response_framedata_csv(resp)
-                    filename = "{}_{}_{}.csv".format(
-                        study_name_for_files(study.name), resp.uuid, "frames"
-                    )
-                    zipped.writestr(filename, data)
+            for resp_uuid in responses.order_by("id").values_list("uuid", flat=True):
+                rows = ()
+                if str(resp_uuid) == next_uuid:
+                    rows = list(next_rows)
+                    next_uuid, next_rows = next(frame_data, (None, ()))
+                output, writer = csv_namedtuple_writer(FrameDataRow)
+                writer.writerows(rows)
+                filename = "{}_{}_{}.csv".format(
+                    study_name_for_files(study.name), resp_uuid, "frames"
+                )
+                zipped.writestr(filename, output.getvalue())
 
         zipped_file.seek(0)
         response = FileResponse(
@@ -1948,6 +2043,24 @@ class StudyAttachments(CanViewStudyResponsesMixin, generic.ListView):
         context = super().get_context_data(**kwargs)
         context["match"] = self.request.GET.get("match", "")
         context["study"] = self.study
+        context["archives_in_progress"] = []
+        for description, archive_name in (
+            ("all videos", f"{self.study.uuid}_videos"),
+            ("consent videos", f"{self.study.uuid}_consent_videos"),
+        ):
+            progress = VideoArchiveProgress.load(archive_name)
+            if progress is None:
+                continue
+            eta_seconds = progress["eta_seconds"]
+            context["archives_in_progress"].append(
+                {
+                    **progress,
+                    "description": description,
+                    "eta_minutes": None
+                    if eta_seconds is None
+                    else max(1, round(eta_seconds / 60)),
+                }
+            )
         return context
 
     def post(self, request, *args, **kwargs):
@@ -7,17 +7,21 @@ from django.contrib import messages
 from django.contrib.auth.mixins import UserPassesTestMixin
 from django.db.models import Q
 from django.db.models.functions import Lower
-from django.http import HttpResponseForbidden, HttpResponseRedirect
+from django.http import HttpResponseForbidden, HttpResponseRedirect, JsonResponse
 from django.shortcuts import get_object_or_404, reverse
 from django.views import generic
+from django.views.generic.base import View
 from django.views.generic.detail import SingleObjectMixin
+from lark.exceptions import LarkError
 from revproxy.views import ProxyView
 
+from accounts.child_index import ChildIndex
 from accounts.models import Child, User
 from exp.mixins.paginator_mixin import PaginatorMixin
 from exp.views.mixins import (
     ExperimenterLoginRequiredMixin,
     SingleObjectFetchProtocol,
+    StudyLookupMixin,
     StudyTypeMixin,
 )
 from project import settings
@@ -295,6 +299,72 @@ class StudyUpdateView(
         return reverse("exp:study-edit", kwargs={"pk": self.object.id})
 
 
+class StudyEligibleChildrenEstimate(
+    ExperimenterLoginRequiredMixin, UserPassesTestMixin, StudyLookupMixin, View
+):
+    """
+    Estimates how many registered children would be eligible for a study, using the
+    criteria expression and age range currently entered in the study edit form.
+    """
+
+    raise_exception = True
+
+    def user_can_edit_study(self):
+        user = self.request.user
+        return user.is_researcher and user.has_study_perms(
+            StudyPermission.WRITE_STUDY_DETAILS, self.study
+        )
+
+    test_func = user_can_edit_study
+
+    def age_in_days_from_query(self, bound):
+        """Same years * 365 + months * 30 + days shorthand as the study form."""
+        return sum(
+            multiplier
+            * int(
+                self.request.GET.get(
+                    f"{bound}_age_{unit}", getattr(self.study, f"{bound}_age_{unit}")
+                )
+            )
+            for unit, multiplier in (("years", 365), ("months", 30), ("days", 1))
+        )
+
+    def get(self, request, *args, **kwargs):
+        criteria_expression = request.GET.get(
+            "criteria_expression", self.study.criteria_expression
+        )
+        try:
+            min_age_in_days = self.age_in_days_from_query("min")
+            max_age_in_days = self.age_in_days_from_query("max")
+        except ValueError:
+            return JsonResponse({"error": "Invalid age range."}, status=400)
+
+        child_index = ChildIndex.load()
+        if child_index is None:
+            return JsonResponse(
+                {
+                    "error": "Eligible children estimate unavailable while the index of children is built. Try again in a few minutes."
+                },
+                status=503,
+            )
+        try:
+            eligible_children = child_index.count_eligible(
+                criteria_expression, min_age_in_days, max_age_in_days
+            )
+        except LarkError as e:
+            return JsonResponse(
+                {"error": f"Invalid criteria expression:\n{e.args[0]}"}, status=400
+            )
+
+        return JsonResponse(
+            {
+                "eligible_children": eligible_children,
+                "indexed_children": len(child_index),
+                "as_of": child_index.built_at,
+            }
+        )
+
+
 class StudyListView(
     ExperimenterLoginRequiredMixin, UserPassesTestMixin, generic.ListView
 ):
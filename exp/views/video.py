@@ -4,20 +4,22 @@ import hashlib
 import hmac
 import urllib.parse
 
-from botocore.exceptions import ClientError
 from django.conf import settings
-from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseForbidden
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 
-from studies.models import Video
+from studies.models import PipeWebhook
+from studies.tasks import ingest_pipe_video
 
 
 class RenameVideoView(View):
     """
     Webhook handler for Pipe webhook that fires upon uploading to S3, so we can rename
     video to the intended permanent name instead of the random string assigned by Pipe.
+    The renaming is done by a task, after the webhook has been answered.
     """
 
     @method_decorator(csrf_exempt)
@@ -63,15 +65,20 @@ class RenameVideoView(View):
             if not new_name:  # Make sure we don't have an empty payload string
                 return HttpResponseForbidden()
 
-            try:
-                video_obj = Video.from_pipe_payload(d)
-                return HttpResponse(
-                    (d["data"]["videoName"] + " --> " + video_obj.filename)
-                    if video_obj
-                    else "Preview video not saved"
+            # Rename the video and record it later, so that Pipe isn't kept waiting on
+            # S3. Repeats of a webhook already received are only queued again if it
+            # hasn't been processed (or failed) yet, e.g. because the task was lost.
+            webhook, created = PipeWebhook.objects.get_or_create(
+                pipe_numeric_id=int(d["data"]["id"]), defaults={"payload": d}
+            )
+            if created or not (webhook.processed_at or webhook.failed_at):
+                transaction.on_commit(
+                    lambda: ingest_pipe_video.delay(webhook.pipe_numeric_id)
                 )
-            except ClientError as e:
-                return HttpResponseNotFound(e)
+            return HttpResponse(
+                f"{d['data']['videoName']} --> {new_name} "
+                + ("queued" if created else "already received")
+            )
 
         else:  # Not authenticated
             return HttpResponseForbidden()
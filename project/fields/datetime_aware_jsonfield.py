@@ -3,6 +3,8 @@ from __future__ import unicode_literals
 import datetime as dt
 import json
 import logging
+import re
+import uuid
 from decimal import Decimal
 from functools import partial
 
@@ -13,6 +15,8 @@ from django.contrib.postgres.fields.jsonb import JSONField
 from django.contrib.postgres.forms.jsonb import JSONField as JSONFormField
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.expressions import Col
+from django.db.models.query_utils import DeferredAttribute
 from psycopg2.extras import Json
 
 
@@ -53,6 +57,8 @@ def coerce_nonnaive_datetimes(json_data):
 
 class DateTimeAwareJSONEncoder(DjangoJSONEncoder):
     def default(self, o):
+        if isinstance(o, LazyDecodedJSON):
+            return o.decode()
         if isinstance(o, dt.datetime):
             if o.tzinfo is None or o.tzinfo.utcoffset(o) is None:
                 raise NaiveDatetimeException("Tried to encode a naive datetime.")
@@ -90,7 +96,171 @@ def decode_datetime_objects(nested_value):
     return nested_value
 
 
+# Matches wherever DateTimeAwareJSONEncoder has encoded an object, in the JSON text
+# Postgres outputs for jsonb. Most values have none, so needn't be walked to decode
+# them.
+ENCODED_OBJECT_PATTERN = re.compile(r'"type": "encoded_(?:datetime|date|time|decimal)"')
+
+
+def decode_json_text(text):
+    """Parse JSON text, decoding any objects encoded by DateTimeAwareJSONEncoder."""
+    value = json.loads(text)
+    if ENCODED_OBJECT_PATTERN.search(text):
+        value = decode_datetime_objects(value)
+    return value
+
+
+class LazyDecodedJSON:
+    """JSON text loaded for a model instance's DateTimeAwareJSONField, not yet decoded.
+
+    LazyDecodedJSONAttribute replaces it with the decoded value the first time the
+    field is accessed.
+    """
+
+    __slots__ = ("text", "_value")
+
+    def __init__(self, text):
+        self.text = text
+
+    def __reduce__(self):
+        return LazyDecodedJSON, (self.text,)
+
+    def __eq__(self, other):
+        if isinstance(other, LazyDecodedJSON):
+            other = other.decode()
+        return self.decode() == other
+
+    __hash__ = None
+
+    @property
+    def can_pass_through(self):
+        """Whether the text can be output as it is, i.e. it has no encoded objects
+        that output would show as the datetimes etc. they decode to."""
+        return not ENCODED_OBJECT_PATTERN.search(self.text)
+
+    def decode(self):
+        try:
+            return self._value
+        except AttributeError:
+            self._value = decode_json_text(self.text)
+            return self._value
+
+
+def get_value_for_output(instance, attname):
+    """An instance's DateTimeAwareJSONField value, left as LazyDecodedJSON if it's not
+    been decoded yet, for RawJSONSplicer to output without decoding it."""
+    value = instance.__dict__.get(attname)
+    if isinstance(value, LazyDecodedJSON):
+        return value
+    return getattr(instance, attname)
+
+
+class RawJSONSplicer:
+    """Has json.dumps output the text of LazyDecodedJSON values as it is.
+
+    Rather than being decoded and encoded again, values that can pass through are
+    encoded as placeholder strings, which splice() then replaces with their text.
+    Others are decoded and encoded as usual.
+    """
+
+    def __init__(self):
+        # Unique to this splicer, so no string in the data can pass for a placeholder.
+        self.token = uuid.uuid4().hex
+        self.texts = []
+
+    def encoder_class(self, base_class=json.JSONEncoder, default=None):
+        """Subclass of `base_class` that encodes LazyDecodedJSON values for splice().
+
+        `default` is json.dumps's argument of that name, which would otherwise
+        replace the subclass's default method.
+        """
+        splicer = self
+
+        class RawJSONSplicingEncoder(base_class):
+            def default(self, o):
+                if isinstance(o, LazyDecodedJSON):
+                    if not o.can_pass_through:
+                        return o.decode()
+                    splicer.texts.append(o.text)
+                    return f"{splicer.token}-{len(splicer.texts) - 1}"
+                if default is not None:
+                    return default(o)
+                return super().default(o)
+
+        return RawJSONSplicingEncoder
+
+    def splice(self, document):
+        """Put values' JSON text in place of their placeholders in an encoded document.
+
+        A document as bytes is taken to be DRF's JSONRenderer's output, which also
+        escapes U+2028 and U+2029 for the sake of JavaScript.
+        """
+        if not self.texts:
+            return document
+        if isinstance(document, bytes):
+            texts = [
+                text.replace("\u2028", "\\u2028").replace("\u2029", "\\u2029").encode()
+                for text in self.texts
+            ]
+            pattern = re.compile(rb'"%s-(\d+)"' % self.token.encode())
+        else:
+            texts = self.texts
+            pattern = re.compile(r'"%s-(\d+)"' % self.token)
+        return pattern.sub(lambda match: texts[int(match.group(1))], document)
+
+
+def dumps_with_raw_json(obj, cls=json.JSONEncoder, default=None, **kwargs):
+    """json.dumps, outputting the JSON text of LazyDecodedJSON values as it is."""
+    splicer = RawJSONSplicer()
+    return splicer.splice(
+        json.dumps(obj, cls=splicer.encoder_class(cls, default), **kwargs)
+    )
+
+
+class LazyDecodedJSONAttribute(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, LazyDecodedJSON):
+            value = instance.__dict__[self.field.attname] = value.decode()
+        return value
+
+    def __set__(self, instance, value):
+        # Being a data descriptor is what has __get__ called even once the value is
+        # in the instance's __dict__.
+        instance.__dict__[self.field.attname] = value
+
+
+class JSONTextCol(Col):
+    """A DateTimeAwareJSONField's column, selected as text.
+
+    psycopg2 would otherwise parse jsonb as it fetches each row, whether or not it's
+    ever used. Columns loaded into model instances are left as text until first
+    accessed; everywhere else (values(), annotations) the text is decoded straight
+    away, as from_db_value doesn't otherwise know where its value is going.
+    """
+
+    selected_as_text = False
+    lazy = False
+
+    def select_format(self, compiler, sql, params):
+        query = compiler.query
+        self.selected_as_text = True
+        self.lazy = not query.values_select and not any(
+            annotation is self for annotation in query.annotation_select.values()
+        )
+        return f"({sql})::text", params
+
+
 class DateTimeAwareJSONField(JSONField):
+    descriptor_class = LazyDecodedJSONAttribute
+
+    def get_col(self, alias, output_field=None):
+        # Always a new column, so that what select_format works out about the
+        # query it's selected by isn't shared with others.
+        return JSONTextCol(alias, self, output_field or self)
+
     def formfield(self, **kwargs):
         defaults = {"form_class": DateTimeAwareJSONFormField}
         defaults.update(kwargs)
@@ -104,6 +274,10 @@ class DateTimeAwareJSONField(JSONField):
     def from_db_value(self, value, expression, connection):
         if value is None:
             return None
+        if getattr(expression, "selected_as_text", False):
+            if expression.lazy:
+                return LazyDecodedJSON(value)
+            return decode_json_text(value)
         return super(DateTimeAwareJSONField, self).to_python(
             decode_datetime_objects(value)
         )
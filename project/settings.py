@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 import os
 from pathlib import Path
 
+from corsheaders.defaults import default_headers
 from django.contrib.messages import constants as messages
 
 ENVIRONMENT = os.environ.get("ENVIRONMENT", "develop")
@@ -165,6 +166,44 @@ DATABASES = {
     }
 }
 
+# Shared between web and worker processes (e.g. for the child index that celery beat
+# rebuilds), so every deployed environment must set REDIS_URL. Without it, each
+# process gets its own in-memory cache, which is only good enough for tests and a
+# lone runserver.
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": os.environ["REDIS_URL"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "lookit",
+        }
+    }
+
+# Acknowledge frameplayer updates to responses once they're queued, and write them
+# in batches from celery; see studies/response_buffer.py.
+RESPONSE_WRITE_BEHIND = bool(os.environ.get("RESPONSE_WRITE_BEHIND", False))
+
+# Limit on how large a gzip- or br-encoded API request body may be once decompressed;
+# see api/parsers.py.
+MAX_DECOMPRESSED_REQUEST_BODY_SIZE = int(
+    os.environ.get("MAX_DECOMPRESSED_REQUEST_BODY_SIZE", 32 * 1024 * 1024)
+)
+
+# How many videos to download at once when building a video archive, and how many
+# downloaded bytes may wait to be written to it; see studies/video_archive.py.
+VIDEO_ARCHIVE_DOWNLOAD_WORKERS = int(
+    os.environ.get("VIDEO_ARCHIVE_DOWNLOAD_WORKERS", 8)
+)
+VIDEO_ARCHIVE_DOWNLOAD_BUFFER_SIZE = int(
+    os.environ.get("VIDEO_ARCHIVE_DOWNLOAD_BUFFER_SIZE", 256 * 1024 * 1024)
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
@@ -192,7 +231,7 @@ REST_FRAMEWORK = {
         "rest_framework.parsers.MultiPartParser",
     ),
     "DEFAULT_RENDERER_CLASSES": (
-        "api.renderers.JsonApiWithUuidRenderer",
+        "api.renderers.FastJsonApiWithUuidRenderer",
         "rest_framework.renderers.BrowsableAPIRenderer",
     ),
     "DEFAULT_METADATA_CLASS": "rest_framework_json_api.metadata.JSONAPIMetadata",
@@ -244,6 +283,8 @@ CORS_ORIGIN_ALLOW_ALL = bool(os.environ.get("CORS_ORIGIN_ALLOW_ALL", True))
 CORS_ORIGIN_WHITELIST = [
     h for h in os.environ.get("CORS_ORIGIN_WHITELIST", "").split(" ") if h
 ]
+# Let the frameplayer send compressed request bodies.
+CORS_ALLOW_HEADERS = list(default_headers) + ["content-encoding"]
 
 if os.getenv("GOOGLE_APPLICATION_CREDENTIALS"):
     # if we're trying to use cloud storage
@@ -328,6 +369,7 @@ CELERY_TASK_ROUTES = {
     "studies.tasks.build_zipfile_of_videos": {"queue": "builds"},
     "studies.tasks.build_framedata_dict": {"queue": "builds"},
     "studies.tasks.delete_video_from_cloud": {"queue": "cleanup"},
+    "studies.tasks.delete_videos_from_cloud": {"queue": "cleanup"},
     "studies.tasks.cleanup*": {"queue": "cleanup"},
     "studies.helpers.send_mail": {"queue": "email"},
     "studies.tasks.send_announcement_emails": {"queue": "email"},
@@ -1,4 +1,5 @@
 """Fields constants - at the moment, just used for BitFields."""
+import numpy
 from django.utils.translation import gettext_lazy as _
 from model_utils import Choices
 
@@ -175,3 +176,26 @@ def popcnt_bitfield(integer, field_type):
             selected.append(bitfield_items[bit_index])
 
     return selected
+
+
+def popcount_array(integers):
+    """Vectorized bit count over an array of bitfield values.
+
+    The bitfields are stored as signed 64-bit integers, so we reinterpret them as
+    unsigned before running the usual SWAR popcount.
+
+    Args:
+        integers: anything numpy can turn into an array of 64-bit integers.
+
+    Returns:
+        A numpy array with the number of set bits in each element.
+    """
+    bits = numpy.asarray(integers, dtype=numpy.int64).view(numpy.uint64)
+    bits = bits - ((bits >> numpy.uint64(1)) & numpy.uint64(0x5555555555555555))
+    bits = (bits & numpy.uint64(0x3333333333333333)) + (
+        (bits >> numpy.uint64(2)) & numpy.uint64(0x3333333333333333)
+    )
+    bits = (bits + (bits >> numpy.uint64(4))) & numpy.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bits * numpy.uint64(0x0101010101010101)) >> numpy.uint64(56)).astype(
+        numpy.int64
+    )
@@ -1,13 +1,161 @@
 """Graph facilities for the Analytics study view."""
+import functools
+import hashlib
+
+import numpy
 import pandas
-from django_pandas.io import read_frame
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db import models
+from django.db.models import Count, Max
 
 pandas.set_option("display.max_columns", None)
 pandas.set_option("display.max_rows", None)
 
+# Entries are keyed on a watermark of the data they were computed from, so never go
+# stale - this just bounds how long unused ones take up space.
+GRAPH_DATA_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+# Offset aliases for the periods we bin by. Weeks start on Sunday, like moment.js's.
+BIN_PERIODS = {"day": "D", "week": "W-SAT", "month": "M"}
+
+
+def _crosstab_by_ruling_and_study(index, rulings, study_ids, num_responses=None):
+    """Count responses per index value, ruling and study, in long format.
+
+    If num_responses is given, each row stands for that many responses, and
+    combinations without any responses are left out.
+    """
+    return (
+        pandas.crosstab(
+            index=index,
+            columns=[rulings, study_ids],
+            values=num_responses,
+            aggfunc=None if num_responses is None else "sum",
+        )
+        .stack()
+        .stack()
+        .reset_index()
+        .rename(columns={0: "num_responses"})
+    )
+
+
+def _bin_starts(dates, interval):
+    """The first day of the day/week/month each date falls in, as YYYY-MM-DD."""
+    return (
+        pandas.to_datetime(dates)
+        .dt.to_period(BIN_PERIODS[interval])
+        .dt.start_time.dt.strftime("%Y-%m-%d")
+    )
+
+
+def _model_field(model, path):
+    """The model field a values_list path refers to, or None for annotations."""
+    field = None
+    for name in path.split("__"):
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        model = field.related_model
+    return field
+
+
+def _typed_column(values, field):
+    """Turn a column of python values into the numpy/pandas type for its field.
+
+    Datetimes become datetime64, and integers int64 when there are no nulls.
+    Anything else stays an object column.
+    """
+    if isinstance(field, models.DateTimeField):
+        return pandas.DatetimeIndex(values, tz="UTC" if settings.USE_TZ else None)
+    if (
+        isinstance(field, (models.IntegerField, models.AutoField))
+        and None not in values
+    ):
+        return numpy.array(values, dtype=numpy.int64)
+    return numpy.array(values, dtype=object)
+
+
+def values_list_frame(queryset, fieldnames, index_col=None):
+    """Build a DataFrame straight from a values_list cursor.
+
+    Unlike django_pandas.read_frame, rows are never turned into dicts or model-like
+    objects: the cursor is read once and transposed into typed columns.
+    """
+    fieldnames = list(fieldnames)
+    if index_col is not None:
+        fieldnames.append(index_col)
+    rows = list(queryset.values_list(*fieldnames).iterator())
+    columns = zip(*rows) if rows else [()] * len(fieldnames)
+    dataframe = pandas.DataFrame(
+        {
+            fieldname: _typed_column(column, _model_field(queryset.model, fieldname))
+            for fieldname, column in zip(fieldnames, columns)
+        }
+    )
+    if index_col is not None:
+        dataframe.set_index(index_col, inplace=True)
+    return dataframe
+
+
+def _running_counts(*keys):
+    """For each row, the number of earlier rows with the same key(s)."""
+    if not len(keys[0]):
+        return numpy.zeros(0, dtype=numpy.int64)
+    group_codes = numpy.zeros(len(keys[0]), dtype=numpy.int64)
+    for key in keys:
+        codes, uniques = pandas.factorize(key)
+        group_codes = group_codes * len(uniques) + codes
+    order = numpy.argsort(group_codes, kind="stable")
+    sorted_codes = group_codes[order]
+    first_in_group = numpy.searchsorted(sorted_codes, sorted_codes, side="left")
+    running_counts = numpy.empty(len(order), dtype=numpy.int64)
+    running_counts[order] = numpy.arange(len(order)) - first_in_group
+    return running_counts
+
+
+def cached_by_watermark(*watermark_fields):
+    """Cache a graph function's output per queryset and data watermark.
+
+    The watermark is the number of rows plus the latest value of each of
+    watermark_fields, so any added, removed or updated row gives a new cache key and
+    entries never need to be invalidated explicitly.
+    """
+
+    def decorator(graph_function):
+        @functools.wraps(graph_function)
+        def wrapper(queryset):
+            try:
+                sql, params = queryset.query.sql_with_params()
+            except EmptyResultSet:
+                return graph_function(queryset)
+            watermark = queryset.order_by().aggregate(
+                watermark_count=Count("pk", distinct=True),
+                **{
+                    f"watermark_{index}": Max(field)
+                    for index, field in enumerate(watermark_fields)
+                },
+            )
+            signature = repr((sql, params, sorted(watermark.items())))
+            cache_key = "studies.graphs.{}.{}".format(
+                graph_function.__name__, hashlib.sha1(signature.encode()).hexdigest()
+            )
+            graph_data = cache.get(cache_key)
+            if graph_data is None:
+                graph_data = graph_function(queryset)
+                cache.set(cache_key, graph_data, GRAPH_DATA_CACHE_TIMEOUT)
+            return graph_data
+
+        return wrapper
+
+    return decorator
+
 
 def _get_base_responses_dataframe(responses_queryset):
-    response_dataframe = read_frame(
+    response_dataframe = values_list_frame(
         responses_queryset,
         fieldnames=("date_created", "current_ruling", "study__name", "study__id"),
         index_col="uuid",
@@ -16,6 +164,7 @@ def _get_base_responses_dataframe(responses_queryset):
     return response_dataframe
 
 
+@cached_by_watermark("date_modified", "consent_rulings__created_at")
 def get_response_timeseries_data(responses_queryset):
     """This method has one job, and that's to package data for MetricsGraphics.JS.
 
@@ -39,37 +188,31 @@ def get_response_timeseries_data(responses_queryset):
     Returns:
         A tuple of JSON-formatted strings.
     """
-    # Base dataframe must include data as datetime for proper sorting.
+    # Base dataframe includes data as datetime64 for proper sorting.
     base_dataframe = _get_base_responses_dataframe(responses_queryset)
-    base_dataframe["date_created"] = pandas.to_datetime(base_dataframe["date_created"])
 
     # Sort, date, and number, then add a date column for binning.
-    base_dataframe.sort_values(["date_created"], inplace=True)
+    base_dataframe.sort_values(["date_created"], inplace=True, kind="mergesort")
     base_dataframe["date_of_response"] = base_dataframe["date_created"].dt.date
 
     # TODO: Now create the daily binned DF
-    responses_per_date = (
-        pandas.crosstab(
-            index=base_dataframe["date_of_response"],
-            columns=[base_dataframe["current_ruling"], base_dataframe["study__id"]],
-        )
-        .stack()
-        .stack()
-        .reset_index()
-        .rename(columns={0: "num_responses"})
+    responses_per_date = _crosstab_by_ruling_and_study(
+        base_dataframe["date_of_response"],
+        base_dataframe["current_ruling"],
+        base_dataframe["study__id"],
     )
 
-    # Cumulative stats all broken down with groupby
-    base_dataframe["total_cumulative_responses"] = range(1, len(base_dataframe) + 1)
-    base_dataframe["cumulative_count_per_study"] = base_dataframe.groupby(
-        ["study__name"]
-    ).cumcount()
-    base_dataframe["cumulative_count_per_ruling"] = base_dataframe.groupby(
-        ["current_ruling"]
-    ).cumcount()
-    base_dataframe["cumulative_count_per_study_by_ruling"] = base_dataframe.groupby(
-        ["study__name", "current_ruling"]
-    ).cumcount()
+    # Cumulative stats all broken down by group, over the already sorted rows.
+    study_names = base_dataframe["study__name"].to_numpy()
+    rulings = base_dataframe["current_ruling"].to_numpy()
+    base_dataframe["total_cumulative_responses"] = numpy.arange(
+        1, len(base_dataframe) + 1
+    )
+    base_dataframe["cumulative_count_per_study"] = _running_counts(study_names)
+    base_dataframe["cumulative_count_per_ruling"] = _running_counts(rulings)
+    base_dataframe["cumulative_count_per_study_by_ruling"] = _running_counts(
+        study_names, rulings
+    )
 
     return (
         base_dataframe.to_json(orient="records"),
@@ -77,6 +220,7 @@ def get_response_timeseries_data(responses_queryset):
     )
 
 
+@cached_by_watermark("date_created")
 def get_registration_data(users_queryset):
     """Graphing the children and users?
 
@@ -104,10 +248,71 @@ def get_users_dataframe(users_queryset):
     Returns:
         A dataframe
     """
-    users_dataframe = read_frame(
+    users_dataframe = values_list_frame(
         users_queryset, fieldnames=("date_created",), index_col="uuid"
     )
 
     users_dataframe["cumulative_count"] = range(1, len(users_dataframe) + 1)
 
     return users_dataframe
+
+
+def get_binned_response_series(response_summaries, interval="day"):
+    """Bin daily response summaries, for every ruling and study.
+
+    Args:
+        response_summaries: Daily counts as returned by
+            studies.queries.get_response_summaries, already filtered.
+        interval: One of BIN_PERIODS.
+
+    Returns:
+        A list of {"date", "current_ruling", "study_id", "num_responses"} dicts,
+        sorted by date. Bins without any responses are left out.
+    """
+    summaries_dataframe = pandas.DataFrame.from_records(
+        response_summaries,
+        columns=["date", "current_ruling", "study_id", "num_responses"],
+    )
+    if summaries_dataframe.empty:
+        return []
+
+    responses_per_bin = _crosstab_by_ruling_and_study(
+        _bin_starts(summaries_dataframe["date"], interval).rename("date"),
+        summaries_dataframe["current_ruling"],
+        summaries_dataframe["study_id"],
+        summaries_dataframe["num_responses"],
+    ).sort_values(["date", "current_ruling", "study_id"])
+
+    return [
+        {
+            "date": date,
+            "current_ruling": current_ruling,
+            "study_id": int(study_id),
+            "num_responses": int(num_responses),
+        }
+        for date, current_ruling, study_id, num_responses in responses_per_bin[
+            ["date", "current_ruling", "study_id", "num_responses"]
+        ].itertuples(index=False)
+    ]
+
+
+def get_binned_registration_series(registration_summaries, interval="day"):
+    """Bin daily registration summaries.
+
+    Returns:
+        A list of {"date", "num_registrations"} dicts, sorted by date.
+    """
+    registrations_dataframe = pandas.DataFrame.from_records(
+        registration_summaries, columns=["date", "num_registrations"]
+    )
+    if registrations_dataframe.empty:
+        return []
+
+    registrations_per_bin = registrations_dataframe.groupby(
+        _bin_starts(registrations_dataframe["date"], interval).rename("bin")
+    )["num_registrations"].sum()
+
+    return [
+        {"date": date, "num_registrations": int(num_registrations)}
+        for date, num_registrations in registrations_per_bin.items()
+    ]
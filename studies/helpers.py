@@ -106,11 +106,22 @@ class FrameActionDispatcher(object):
         """Dispatcher that delegates to inner methods."""
         if response.sequence:
             current_frame_id = response.sequence[-1]
-            frame_data = response.exp_data[current_frame_id]
-            frame_type = frame_data.get("frameType", None)
-            if frame_type is None:
-                return
-        else:
+            return self.dispatch(
+                response,
+                current_frame_id,
+                response.exp_data[current_frame_id],
+                *args,
+                **kwargs,
+            )
+
+    def dispatch(self, response, current_frame_id, frame_data: dict, *args, **kwargs):
+        """Delegate to the inner method for an already-extracted current frame.
+
+        Lets callers that only fetched the latest frame (rather than the whole of
+        exp_data) trigger the same frame-specific actions.
+        """
+        frame_type = frame_data.get("frameType", None)
+        if frame_type is None:
             return
 
         try:
@@ -120,6 +131,16 @@ class FrameActionDispatcher(object):
         except AttributeError as e:
             logger.warning(f"{e.args} is not registered for frame-specific action.")
 
+    def has_action(self, response):
+        """Whether saving the response would trigger a frame-specific action."""
+        if not response.sequence:
+            return False
+        frame_data = response.exp_data.get(response.sequence[-1]) or {}
+        frame_type = frame_data.get("frameType", None)
+        if frame_type is None or frame_type.lower() == "default":
+            return False
+        return callable(getattr(self, frame_type.lower(), None))
+
     def default(self, response, frame_data: dict, current_frame_id, *args, **kwargs):
         """Default frame hook.
 
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Q
+
+hourly_crontab_schedule_dict = dict(
+    minute="45", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+build_child_index_periodic_task_dict = dict(
+    name="Hourly child index build", task="studies.tasks.build_child_index"
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    hourly_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **hourly_crontab_schedule_dict
+    )
+    build_child_index_periodic_task_dict.update(dict(crontab=hourly_crontab_schedule))
+    build_child_index_periodic_task, created = PeriodicTask.objects.get_or_create(
+        **build_child_index_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(Q(**build_child_index_periodic_task_dict)).delete()
+    CrontabSchedule.objects.filter(**hourly_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0068_add_scheduled_docker_cleanup"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
@@ -0,0 +1,76 @@
+# Generated by Django 3.0.14 on 2026-10-19 10:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0069_add_scheduled_child_index_build"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RegistrationSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(unique=True)),
+                ("num_registrations", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField()),
+            ],
+            options={"ordering": ["date"],},
+        ),
+        migrations.CreateModel(
+            name="ResponseSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("date", models.DateField(db_index=True)),
+                (
+                    "current_ruling",
+                    models.CharField(
+                        choices=[
+                            ("accepted", "accepted"),
+                            ("rejected", "rejected"),
+                            ("pending", "pending"),
+                        ],
+                        max_length=100,
+                    ),
+                ),
+                ("child_gender", models.CharField(blank=True, max_length=2)),
+                (
+                    "child_gestational_age_at_birth",
+                    models.PositiveSmallIntegerField(null=True),
+                ),
+                ("child_age_in_months", models.IntegerField(null=True)),
+                ("country", models.CharField(blank=True, max_length=2)),
+                ("num_responses", models.PositiveIntegerField()),
+                ("updated_at", models.DateTimeField()),
+                (
+                    "study",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="response_summaries",
+                        to="studies.Study",
+                    ),
+                ),
+            ],
+            options={"ordering": ["date"], "index_together": {("study", "date")},},
+        ),
+    ]
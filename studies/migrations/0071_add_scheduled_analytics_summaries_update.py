@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Q
+
+two_fifteen_am_crontab_schedule_dict = dict(
+    minute="15", hour="2", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+update_analytics_summaries_periodic_task_dict = dict(
+    name="Nightly analytics summaries update",
+    task="studies.tasks.update_analytics_summaries",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    two_fifteen_am_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **two_fifteen_am_crontab_schedule_dict
+    )
+    update_analytics_summaries_periodic_task_dict.update(
+        dict(crontab=two_fifteen_am_crontab_schedule)
+    )
+    (
+        update_analytics_summaries_periodic_task,
+        created,
+    ) = PeriodicTask.objects.get_or_create(
+        **update_analytics_summaries_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(
+        Q(**update_analytics_summaries_periodic_task_dict)
+    ).delete()
+    CrontabSchedule.objects.filter(**two_fifteen_am_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0070_analytics_summaries"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-19 10:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0071_add_scheduled_analytics_summaries_update"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="response",
+            name="version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
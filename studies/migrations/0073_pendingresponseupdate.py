@@ -0,0 +1,39 @@
+# Generated by Django 3.0.14 on 2026-10-19 10:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+import project.fields.datetime_aware_jsonfield
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0072_response_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingResponseUpdate",
+            fields=[
+                (
+                    "response",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="pending_update",
+                        serialize=False,
+                        to="studies.Response",
+                    ),
+                ),
+                (
+                    "data",
+                    project.fields.datetime_aware_jsonfield.DateTimeAwareJSONField(
+                        default=dict
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.models import Q
+
+every_minute_crontab_schedule_dict = dict(
+    minute="*", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+flush_response_updates_periodic_task_dict = dict(
+    name="Buffered response updates flush", task="studies.tasks.flush_response_updates",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    every_minute_crontab_schedule, created = CrontabSchedule.objects.get_or_create(
+        **every_minute_crontab_schedule_dict
+    )
+    flush_response_updates_periodic_task_dict.update(
+        dict(crontab=every_minute_crontab_schedule)
+    )
+    (
+        flush_response_updates_periodic_task,
+        created,
+    ) = PeriodicTask.objects.get_or_create(**flush_response_updates_periodic_task_dict)
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(Q(**flush_response_updates_periodic_task_dict)).delete()
+    CrontabSchedule.objects.filter(**every_minute_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0073_pendingresponseupdate"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.14 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+import project.fields.datetime_aware_jsonfield
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0074_add_scheduled_response_updates_flush"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PipeWebhook",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("pipe_numeric_id", models.IntegerField(unique=True)),
+                (
+                    "payload",
+                    project.fields.datetime_aware_jsonfield.DateTimeAwareJSONField(),
+                ),
+                ("received_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
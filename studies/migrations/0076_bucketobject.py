@@ -0,0 +1,33 @@
+# Generated by Django 3.0.14 on 2026-10-19 12:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0075_pipewebhook"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BucketObject",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=1024, unique=True)),
+                ("size", models.BigIntegerField()),
+                ("etag", models.CharField(max_length=255)),
+                ("last_modified", models.DateTimeField()),
+                ("seen_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
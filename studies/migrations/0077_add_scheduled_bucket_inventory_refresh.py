@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.db.models import Q
+
+three_forty_five_am_crontab_schedule_dict = dict(
+    minute="45", hour="3", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+refresh_bucket_inventory_periodic_task_dict = dict(
+    name="Nightly video bucket inventory refresh",
+    task="studies.tasks.refresh_bucket_inventory",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    (
+        three_forty_five_am_crontab_schedule,
+        created,
+    ) = CrontabSchedule.objects.get_or_create(
+        **three_forty_five_am_crontab_schedule_dict
+    )
+    refresh_bucket_inventory_periodic_task_dict.update(
+        dict(crontab=three_forty_five_am_crontab_schedule)
+    )
+    (
+        refresh_bucket_inventory_periodic_task,
+        created,
+    ) = PeriodicTask.objects.get_or_create(
+        **refresh_bucket_inventory_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(
+        Q(**refresh_bucket_inventory_periodic_task_dict)
+    ).delete()
+    CrontabSchedule.objects.filter(**three_forty_five_am_crontab_schedule_dict).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0076_bucketobject"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
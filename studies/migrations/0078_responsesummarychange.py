@@ -0,0 +1,93 @@
+from django.db import migrations, models
+
+# Summarized responses are the non-preview ones past the consent frame. Row-level
+# triggers, as statement-level ones can't see the affected rows before Postgres 10.
+CREATE_TRIGGERS = """
+CREATE FUNCTION studies_note_deleted_response() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO studies_responsesummarychange (response_created_at)
+    VALUES (OLD.date_created);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER studies_response_summary_change
+    AFTER DELETE ON studies_response
+    FOR EACH ROW
+    WHEN (OLD.completed_consent_frame AND NOT OLD.is_preview)
+EXECUTE PROCEDURE studies_note_deleted_response();
+
+CREATE FUNCTION studies_note_edited_child() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO studies_responsesummarychange (response_created_at)
+    SELECT sr.date_created
+    FROM studies_response sr
+    WHERE sr.child_id = NEW.id
+      AND sr.completed_consent_frame
+      AND NOT sr.is_preview;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER studies_response_summary_change
+    AFTER UPDATE OF gender, gestational_age_at_birth, birthday ON accounts_child
+    FOR EACH ROW
+    WHEN (OLD.gender IS DISTINCT FROM NEW.gender
+        OR OLD.gestational_age_at_birth IS DISTINCT FROM NEW.gestational_age_at_birth
+        OR OLD.birthday IS DISTINCT FROM NEW.birthday)
+EXECUTE PROCEDURE studies_note_edited_child();
+
+CREATE FUNCTION studies_note_edited_demographics() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO studies_responsesummarychange (response_created_at)
+    SELECT sr.date_created
+    FROM studies_response sr
+    WHERE sr.demographic_snapshot_id = NEW.id
+      AND sr.completed_consent_frame
+      AND NOT sr.is_preview;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER studies_response_summary_change
+    AFTER UPDATE OF country ON accounts_demographicdata
+    FOR EACH ROW
+    WHEN (OLD.country IS DISTINCT FROM NEW.country)
+EXECUTE PROCEDURE studies_note_edited_demographics();
+"""
+
+DROP_TRIGGERS = """
+DROP TRIGGER studies_response_summary_change ON accounts_demographicdata;
+DROP FUNCTION studies_note_edited_demographics();
+DROP TRIGGER studies_response_summary_change ON accounts_child;
+DROP FUNCTION studies_note_edited_child();
+DROP TRIGGER studies_response_summary_change ON studies_response;
+DROP FUNCTION studies_note_deleted_response();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0051_daily_announcement_email_task"),
+        ("studies", "0077_add_scheduled_bucket_inventory_refresh"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResponseSummaryChange",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("response_created_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.RunSQL(CREATE_TRIGGERS, DROP_TRIGGERS),
+    ]
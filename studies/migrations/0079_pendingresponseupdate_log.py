@@ -0,0 +1,58 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+import project.fields.datetime_aware_jsonfield
+
+
+def write_pending_updates(apps, schema_editor):
+    """Write out what's still coalesced in the old table, which holds the latest
+    value of each attribute that was updated."""
+    PendingResponseUpdate = apps.get_model("studies", "PendingResponseUpdate")
+    Response = apps.get_model("studies", "Response")
+    for pending in PendingResponseUpdate.objects.iterator():
+        Response.objects.filter(id=pending.response_id).update(
+            **pending.data, version=F("version") + 1, date_modified=timezone.now()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0078_responsesummarychange"),
+    ]
+
+    operations = [
+        migrations.RunPython(write_pending_updates, migrations.RunPython.noop),
+        migrations.DeleteModel(name="PendingResponseUpdate"),
+        migrations.CreateModel(
+            name="PendingResponseUpdate",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "changes",
+                    project.fields.datetime_aware_jsonfield.DateTimeAwareJSONField(
+                        default=dict
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "response",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="pending_updates",
+                        to="studies.Response",
+                    ),
+                ),
+            ],
+        ),
+    ]
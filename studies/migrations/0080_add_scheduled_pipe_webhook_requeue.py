@@ -0,0 +1,53 @@
+from django.db import migrations
+from django.db.models import Q
+
+every_fifteen_minutes_crontab_schedule_dict = dict(
+    minute="*/15", hour="*", day_of_week="*", day_of_month="*", month_of_year="*"
+)
+requeue_unprocessed_pipe_webhooks_periodic_task_dict = dict(
+    name="Unprocessed Pipe webhooks requeue",
+    task="studies.tasks.requeue_unprocessed_pipe_webhooks",
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    (
+        every_fifteen_minutes_crontab_schedule,
+        created,
+    ) = CrontabSchedule.objects.get_or_create(
+        **every_fifteen_minutes_crontab_schedule_dict
+    )
+    requeue_unprocessed_pipe_webhooks_periodic_task_dict.update(
+        dict(crontab=every_fifteen_minutes_crontab_schedule)
+    )
+    (
+        requeue_unprocessed_pipe_webhooks_periodic_task,
+        created,
+    ) = PeriodicTask.objects.get_or_create(
+        **requeue_unprocessed_pipe_webhooks_periodic_task_dict
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    CrontabSchedule = apps.get_model("django_celery_beat", "CrontabSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    PeriodicTask.objects.filter(
+        Q(**requeue_unprocessed_pipe_webhooks_periodic_task_dict)
+    ).delete()
+    CrontabSchedule.objects.filter(
+        **every_fifteen_minutes_crontab_schedule_dict
+    ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0079_pendingresponseupdate_log"),
+        ("django_celery_beat", "0001_initial"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
@@ -0,0 +1,51 @@
+from django.db import migrations
+from django.utils import timezone
+
+# The bucket inventory starts out empty, so have beat take it once straight away
+# rather than leave it empty until the first nightly refresh.
+initial_refresh_bucket_inventory_periodic_task_dict = dict(
+    name="Initial video bucket inventory refresh",
+    task="studies.tasks.refresh_bucket_inventory",
+    one_off=True,
+)
+
+
+def create_scheduled_jobs(apps, schema_editor):
+    ClockedSchedule = apps.get_model("django_celery_beat", "ClockedSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    if PeriodicTask.objects.filter(
+        name=initial_refresh_bucket_inventory_periodic_task_dict["name"]
+    ).exists():
+        return
+    now_clocked_schedule = ClockedSchedule.objects.create(clocked_time=timezone.now())
+    PeriodicTask.objects.create(
+        clocked=now_clocked_schedule,
+        **initial_refresh_bucket_inventory_periodic_task_dict,
+    )
+
+
+def remove_scheduled_jobs(apps, schema_editor):
+    ClockedSchedule = apps.get_model("django_celery_beat", "ClockedSchedule")
+    PeriodicTask = apps.get_model("django_celery_beat", "PeriodicTask")
+
+    initial_refresh_bucket_inventory_periodic_tasks = PeriodicTask.objects.filter(
+        **initial_refresh_bucket_inventory_periodic_task_dict
+    )
+    clocked_schedule_ids = list(
+        initial_refresh_bucket_inventory_periodic_tasks.values_list(
+            "clocked_id", flat=True
+        )
+    )
+    initial_refresh_bucket_inventory_periodic_tasks.delete()
+    ClockedSchedule.objects.filter(id__in=clocked_schedule_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0080_add_scheduled_pipe_webhook_requeue"),
+        ("django_celery_beat", "0011_auto_20190508_0153"),
+    ]
+
+    operations = [migrations.RunPython(create_scheduled_jobs, remove_scheduled_jobs)]
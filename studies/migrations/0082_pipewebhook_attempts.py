@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0081_add_initial_bucket_inventory_refresh"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="pipewebhook",
+            name="attempts",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="pipewebhook",
+            name="failed_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="pipewebhook",
+            name="last_error",
+            field=models.TextField(blank=True),
+        ),
+    ]
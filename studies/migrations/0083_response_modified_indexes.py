@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-19 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("studies", "0082_pipewebhook_attempts"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="response",
+            index=models.Index(
+                fields=["-date_modified", "-id"], name="response_modified_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="response",
+            index=models.Index(
+                fields=["study", "-date_modified", "-id"],
+                name="response_study_modified_idx",
+            ),
+        ),
+    ]
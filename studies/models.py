@@ -4,15 +4,15 @@ from datetime import datetime
 
 import boto3
 import dateutil
-import fleep
 import pytz
 from botocore.exceptions import ClientError
 from django.conf import settings
 from django.contrib.auth.models import Group, Permission
 from django.contrib.postgres.fields import ArrayField
-from django.db import models
-from django.db.models.signals import post_save, pre_delete, pre_save
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from guardian.models import GroupObjectPermissionBase, UserObjectPermissionBase
 from guardian.shortcuts import get_users_with_perms
@@ -35,7 +35,7 @@ from studies.permissions import (
     StudyPermission,
     create_groups_for_instance,
 )
-from studies.tasks import delete_video_from_cloud
+from studies.tasks import delete_video_from_cloud, invalidate_video_archive_segments
 
 logger = logging.getLogger(__name__)
 date_parser = dateutil.parser
@@ -696,6 +696,20 @@ class StudyGroupObjectPermission(GroupObjectPermissionBase):
     content_object = models.ForeignKey(Study, on_delete=models.CASCADE)
 
 
+@receiver(post_save, sender=Study)
+@receiver(post_delete, sender=Study)
+@receiver(post_save, sender=Lab)
+@receiver(post_delete, sender=Lab)
+def invalidate_public_study_catalog(sender, **kwargs):
+    """
+    Any save or delete of a study, including when it changes state, or of a lab may
+    change what participants see in the cached catalog of active public studies.
+    """
+    from studies.study_catalog import PublicStudyCatalog
+
+    PublicStudyCatalog.invalidate()
+
+
 @receiver(post_save, sender=Study)
 def add_study_created_log(sender, instance, created, **kwargs):
     if created:
@@ -824,6 +838,9 @@ class Response(models.Model):
     demographic_snapshot = models.ForeignKey(
         DemographicData, on_delete=models.SET_NULL, null=True
     )  # Allow deleting a demographic snapshot even though a response points to it
+    # Bumped on every update of the session data through the API, so that partial
+    # updates can check they were based on the latest state.
+    version = models.PositiveIntegerField(default=0)
     objects = models.Manager()
     related_manager = ResponseApiManager()
 
@@ -839,6 +856,17 @@ class Response(models.Model):
         )
         ordering = ["-demographic_snapshot__created_at"]
         base_manager_name = "related_manager"
+        # For paging through responses (all of them, or a study's) by cursor, newest
+        # first; see DateModifiedCursorPagination.
+        indexes = [
+            models.Index(
+                fields=["-date_modified", "-id"], name="response_modified_idx"
+            ),
+            models.Index(
+                fields=["study", "-date_modified", "-id"],
+                name="response_study_modified_idx",
+            ),
+        ]
 
     class JSONAPIMeta:
         resource_name = "responses"
@@ -958,11 +986,9 @@ class Response(models.Model):
         but it's quite possible we'll have the need for dynamic upsertion later.
         """
 
+        video_events = []
         seen_ids = set()
-        video_objects = []
 
-        # Using a constructive approach here, but with an ancillary seen_ids list b/c Django models without
-        # primary keys are unhashable.
         for frame_id, event_data in self.exp_data.items():
             if event_data.get("videoList", None) and event_data.get("videoId", None):
                 # We've officially captured video here!
@@ -975,45 +1001,48 @@ class Response(models.Model):
                         and pipe_name
                         and event["streamTime"] > 0
                     ):
-                        # Try looking for the regular ID first.
-                        file_obj = S3_RESOURCE.Object(
-                            settings.BUCKET_NAME, f"{video_id}.mp4"
-                        )
-                        try:
-                            response = file_obj.get()
-                        except ClientError:
-                            try:  # If that doesn't work, use the pipe name.
-                                file_obj = S3_RESOURCE.Object(
-                                    settings.BUCKET_NAME, f"{pipe_name}.mp4"
-                                )
-                                response = file_obj.get()
-                            except ClientError:
-                                logger.warning(
-                                    f"could not find {video_id} or {pipe_name} in S3!"
-                                )
-                                continue
-                        # Read first 32 bytes from streaming body (file header) to get actual filetype.
-                        streaming_body = response["Body"]
-                        file_header_buffer: bytes = streaming_body.read(32)
-                        file_info = fleep.get(file_header_buffer)
-                        streaming_body.close()
-
-                        video_objects.append(
-                            Video(
-                                pipe_name=pipe_name,
-                                created_at=date_parser.parse(event["timestamp"]),
-                                date_modified=response["LastModified"],
-                                #  Can't get the *actual* pipe id property, it's in the webhook payload...
-                                frame_id=frame_id,
-                                full_name=f"{video_id}.{file_info.extension[0]}",
-                                study=self.study,
-                                response=self,
-                                is_consent_footage=event_data.get("frameType", None)
-                                == "CONSENT",
-                            )
-                        )
+                        video_events.append((frame_id, event_data, event))
                         seen_ids.add(video_id)
 
+        # Look the videos up in the bucket inventory all at once, rather than asking S3
+        # about each.
+        stored_objects = BucketObject.objects.in_bulk(
+            [
+                f"{name}.mp4"
+                for _, _, event in video_events
+                for name in (event["videoId"], event["pipeId"])
+            ],
+            field_name="key",
+        )
+
+        video_objects = []
+        for frame_id, event_data, event in video_events:
+            video_id = event["videoId"]
+            pipe_name = event["pipeId"]
+            # Try looking for the regular ID first. If that doesn't work, use the pipe
+            # name.
+            stored_object = stored_objects.get(f"{video_id}.mp4") or stored_objects.get(
+                f"{pipe_name}.mp4"
+            )
+            if not stored_object:
+                logger.warning(f"could not find {video_id} or {pipe_name} in S3!")
+                continue
+
+            video_objects.append(
+                Video(
+                    pipe_name=pipe_name,
+                    created_at=date_parser.parse(event["timestamp"]),
+                    s3_timestamp=stored_object.last_modified,
+                    #  Can't get the *actual* pipe id property, it's in the webhook payload...
+                    frame_id=frame_id,
+                    size=stored_object.size,
+                    full_name=f"{video_id}.mp4",
+                    study=self.study,
+                    response=self,
+                    is_consent_footage=event_data.get("frameType", None) == "CONSENT",
+                )
+            )
+
         return Video.objects.bulk_create(video_objects)
 
 
@@ -1031,6 +1060,23 @@ def take_action_on_exp_data(sender, instance, created, **kwargs):
         dispatch_frame_action(response)
 
 
+class PendingResponseUpdate(models.Model):
+    """Change to a response's session data accepted through the API but not yet written.
+
+    An append-only log: each update adds a row holding just what it changed, and a
+    response's rows are deleted once flushed. See `studies.response_buffer`.
+    """
+
+    response = models.ForeignKey(
+        Response, on_delete=models.CASCADE, related_name="pending_updates"
+    )
+    changes = DateTimeAwareJSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"<PendingResponseUpdate: {self.response_id} @ {self.created_at:%c}>"
+
+
 class FeedbackApiManager(models.Manager):
     """Prefetch all the things."""
 
@@ -1176,7 +1222,9 @@ class Video(models.Model):
 
     @classmethod
     def from_pipe_payload(cls, pipe_response_dict: dict):
-        """Factory method for use in the Pipe webhook.
+        """Factory method for use in the Pipe webhook, by way of PipeWebhook.
+
+        Can be run again for a payload after failing partway through.
 
         Note that this is taking over previous attachment_helpers functionality, which means that it's doing the
         file renaming as well. Keeping this logic inline makes more sense because it's the only place where we do it.
@@ -1199,22 +1247,43 @@ class Video(models.Model):
         throwaway_jpg_name = f"{data['videoName']}.jpg"
 
         # No way to directly rename in boto3, so copy and delete original (this is dumb, but let's get it working)
+        new_video = S3_RESOURCE.Object(settings.BUCKET_NAME, new_full_name)
         try:  # Create a copy with the correct new name, if the original exists. Could also
             # wait until old_name_full exists using orig_video.wait_until_exists()
-            S3_RESOURCE.Object(settings.BUCKET_NAME, new_full_name).copy_from(
+            copy_result = new_video.copy_from(
                 CopySource=(settings.BUCKET_NAME + "/" + old_pipe_name)
-            )
+            )["CopyObjectResult"]
         except ClientError:  # old_name_full not found!
-            logger.error(
-                f"Amazon S3 couldn't find the video for Pipe ID {old_pipe_name} in bucket {settings.BUCKET_NAME}"
-            )
-            raise
+            # Unless an earlier attempt at ingesting this video got as far as copying
+            # it, then failed.
+            try:
+                new_video.load()
+            except ClientError:
+                logger.error(
+                    f"Amazon S3 couldn't find the video for Pipe ID {old_pipe_name} in bucket {settings.BUCKET_NAME}"
+                )
+                raise
+            etag, last_modified = new_video.e_tag, new_video.last_modified
         else:  # Go on to remove the originals
+            etag, last_modified = copy_result["ETag"], copy_result["LastModified"]
             orig_video = S3_RESOURCE.Object(settings.BUCKET_NAME, old_pipe_name)
             orig_video.delete()
             # remove the .jpg thumbnail.
             S3_RESOURCE.Object(settings.BUCKET_NAME, throwaway_jpg_name).delete()
 
+        BucketObject.objects.filter(
+            key__in=[old_pipe_name, throwaway_jpg_name]
+        ).delete()
+        BucketObject.objects.update_or_create(
+            key=new_full_name,
+            defaults=dict(
+                size=data["size"],
+                etag=etag,
+                last_modified=last_modified,
+                seen_at=timezone.now(),
+            ),
+        )
+
         # Determine whether this is consent footage based on payload and/or response data.
         # TODO: move to only using payload info about whether this is consent footage. We only have frame data in
         # exp_data once that's saved to the db after completing the frame, whereas the video may be uploaded sooner
@@ -1260,6 +1329,91 @@ class Video(models.Model):
         return get_download_url(self.full_name)
 
 
+class BucketObject(models.Model):
+    """An object in the video bucket, as last seen in S3.
+
+    A local inventory of the bucket, so that what's stored there can be looked up
+    without a request to S3 for each key. Objects are recorded as Pipe webhooks are
+    ingested, and the whole bucket is listed nightly to catch anything else (see
+    `refresh_from_bucket`).
+    """
+
+    key = models.CharField(max_length=1024, unique=True)
+    size = models.BigIntegerField()
+    etag = models.CharField(max_length=255)
+    last_modified = models.DateTimeField()
+    # When the object was last recorded or seen in a listing of the bucket.
+    seen_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"<BucketObject: {self.key}>"
+
+    @classmethod
+    def refresh_from_bucket(cls, page_size=1000):
+        """Bring the inventory up to date with a listing of the bucket.
+
+        Objects not in the listing are removed, unless recorded since it began.
+
+        Returns:
+            Number of objects listed.
+        """
+        listed_at = timezone.now()
+        count = 0
+        for page in S3_BUCKET.objects.page_size(page_size).pages():
+            listed = {
+                summary.key: cls(
+                    key=summary.key,
+                    size=summary.size,
+                    etag=summary.e_tag,
+                    last_modified=summary.last_modified,
+                    seen_at=listed_at,
+                )
+                for summary in page
+            }
+            count += len(listed)
+            known = cls.objects.in_bulk(list(listed), field_name="key")
+            changed = []
+            for key, known_object in known.items():
+                listed_object = listed[key]
+                if (known_object.etag, known_object.size) != (
+                    listed_object.etag,
+                    listed_object.size,
+                ):
+                    listed_object.pk = known_object.pk
+                    changed.append(listed_object)
+            cls.objects.filter(key__in=known).update(seen_at=listed_at)
+            cls.objects.bulk_update(changed, ["size", "etag", "last_modified"])
+            cls.objects.bulk_create(
+                [listed[key] for key in listed.keys() - known.keys()],
+                ignore_conflicts=True,
+            )
+        cls.objects.filter(seen_at__lt=listed_at).delete()
+        return count
+
+
+class PipeWebhook(models.Model):
+    """A Pipe webhook for an uploaded video, as received.
+
+    The webhook view saves each authenticated payload and answers straight away;
+    `studies.tasks.ingest_pipe_video` then renames the video and creates its Video.
+    Pipe may send the same webhook more than once, so they're unique on Pipe's id for
+    the video, and kept once processed so that repeats can be told apart. Webhooks
+    that can't be ingested, e.g. because the payload doesn't name a real response or
+    the video never turns up on S3, are marked failed rather than tried forever.
+    """
+
+    pipe_numeric_id = models.IntegerField(unique=True)
+    payload = DateTimeAwareJSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    failed_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"<PipeWebhook: {self.pipe_numeric_id} @ {self.received_at:%c}>"
+
+
 @receiver(pre_delete, sender=Video)
 def delete_video_on_s3(sender, instance, using, **kwargs):
     """Delete video from S3 when deleting Video object.
@@ -1293,3 +1447,78 @@ class ConsentRuling(models.Model):
 
     def __str__(self):
         return f"<{self.arbiter.get_short_name()}: {self.action} {self.response} @ {self.created_at:%c}>"
+
+
+@receiver(post_save, sender=ConsentRuling)
+def invalidate_video_archives_on_withdrawal(sender, instance, created, **kwargs):
+    """Delete stored video archive segments holding videos of a response whose
+    consent was accepted until this ruling.
+
+    Archives built after are without the videos anyway; this makes sure no copy of
+    them is left behind to be downloaded.
+    """
+    if not created or instance.action == ACCEPTED:
+        return
+    response = instance.response
+    previous_ruling = response.consent_rulings.exclude(pk=instance.pk).first()
+    if not previous_ruling or previous_ruling.action != ACCEPTED:
+        return
+    video_names = list(response.videos.values_list("full_name", flat=True))
+    if video_names:
+        study_uuid = str(response.study.uuid)
+        transaction.on_commit(
+            lambda: invalidate_video_archive_segments.delay(study_uuid, video_names)
+        )
+
+
+class ResponseSummary(models.Model):
+    """Daily count of (non-preview) responses, materialized for participant analytics.
+
+    One row per day, study, current consent ruling and demographic bucket. Rebuilt
+    incrementally every night by `studies.tasks.update_analytics_summaries`.
+    """
+
+    date = models.DateField(db_index=True)
+    study = models.ForeignKey(
+        Study, on_delete=models.CASCADE, related_name="response_summaries"
+    )
+    current_ruling = models.CharField(max_length=100, choices=ConsentRuling.RULINGS)
+    child_gender = models.CharField(max_length=2, blank=True)
+    child_gestational_age_at_birth = models.PositiveSmallIntegerField(null=True)
+    child_age_in_months = models.IntegerField(null=True)
+    country = models.CharField(max_length=2, blank=True)
+    num_responses = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["date"]
+        index_together = (("study", "date"),)
+
+    def __str__(self):
+        return f"<ResponseSummary: {self.study_id} {self.current_ruling} @ {self.date}: {self.num_responses}>"
+
+
+class RegistrationSummary(models.Model):
+    """Daily count of new (non-researcher) accounts, materialized for participant analytics."""
+
+    date = models.DateField(unique=True)
+    num_registrations = models.PositiveIntegerField()
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ["date"]
+
+    def __str__(self):
+        return f"<RegistrationSummary: {self.date}: {self.num_registrations}>"
+
+
+class ResponseSummaryChange(models.Model):
+    """When a response whose day of ResponseSummary rows has changed was created.
+
+    Deleting a response, or editing the child or demographic snapshot its summary
+    row is bucketed by, leaves no trace on the responses that are left, so database
+    triggers (see migration 0078) note each of these here instead. Rows are
+    consumed by the next incremental refresh of the summaries.
+    """
+
+    response_created_at = models.DateTimeField()
@@ -1,27 +1,214 @@
+import json
 import operator
 from collections import defaultdict
 from datetime import timedelta
-from functools import reduce
+from functools import partial, reduce
 
-from django.db import models
-from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, F, IntegerField, Max, OuterRef, Q, Subquery, Value
 from django.db.models.functions import Coalesce, Concat, Lower
 from django.utils import timezone
 from django.utils.timezone import now
 from guardian.shortcuts import get_objects_for_user
+from more_itertools import chunked
+from psycopg2.extras import Json
 
 from attachment_helpers import get_download_url
+from project.fields.datetime_aware_jsonfield import (
+    ENCODED_OBJECT_PATTERN,
+    DateTimeAwareJSONEncoder,
+    decode_datetime_objects,
+    decode_json_text,
+)
 from studies.models import (
     ACCEPTED,
     PENDING,
     REJECTED,
     ConsentRuling,
+    RegistrationSummary,
     Response,
+    ResponseSummary,
     Study,
     StudyLog,
     Video,
+    dispatch_frame_action,
 )
 from studies.permissions import UMBRELLA_LAB_PERMISSION_MAP, StudyPermission
+from studies.tasks import S3_DELETE_OBJECTS_MAX_KEYS, delete_videos_from_cloud
+
+# Days are local to settings.TIME_ZONE, matching how the analytics page bins them.
+RESPONSE_SUMMARY_QUERY = """
+SELECT (sr.date_created AT TIME ZONE %(time_zone)s)::date AS date,
+       sr.study_id,
+       COALESCE(latest_ruling.action, 'pending') AS current_ruling,
+       ac.gender AS child_gender,
+       ac.gestational_age_at_birth AS child_gestational_age_at_birth,
+       ((sr.date_created AT TIME ZONE %(time_zone)s)::date - ac.birthday) / 30 AS child_age_in_months,
+       COALESCE(ad.country, '') AS country,
+       COUNT(*) AS num_responses
+FROM studies_response sr
+         INNER JOIN accounts_child ac ON ac.id = sr.child_id
+         LEFT OUTER JOIN accounts_demographicdata ad ON ad.id = sr.demographic_snapshot_id
+         LEFT JOIN LATERAL (
+    SELECT scr.action
+    FROM studies_consentruling scr
+    WHERE scr.response_id = sr.id
+    ORDER BY scr.created_at DESC
+    LIMIT 1
+    ) latest_ruling ON true
+WHERE sr.completed_consent_frame = true
+  AND sr.is_preview = false
+  AND (%(dates)s::date[] IS NULL OR (sr.date_created AT TIME ZONE %(time_zone)s)::date = ANY (%(dates)s::date[]))
+GROUP BY 1, 2, 3, 4, 5, 6, 7
+"""
+
+REGISTRATION_SUMMARY_QUERY = """
+SELECT (au.date_created AT TIME ZONE %(time_zone)s)::date AS date,
+       COUNT(*) AS num_registrations
+FROM accounts_user au
+WHERE au.is_researcher = false
+  AND (%(dates)s::date[] IS NULL OR (au.date_created AT TIME ZONE %(time_zone)s)::date = ANY (%(dates)s::date[]))
+GROUP BY 1
+"""
+
+# Days whose response summaries may have changed: a response was created or
+# modified, or one of its responses was given a new consent ruling - or a response
+# was deleted or its child or demographics were edited, as noted (and here consumed)
+# in studies_responsesummarychange.
+STALE_RESPONSE_SUMMARY_DATES_QUERY = """
+WITH change AS (
+    DELETE FROM studies_responsesummarychange RETURNING response_created_at
+)
+SELECT (sr.date_created AT TIME ZONE %(time_zone)s)::date
+FROM studies_response sr
+WHERE sr.date_modified > %(since)s
+   OR sr.id IN (SELECT scr.response_id FROM studies_consentruling scr WHERE scr.created_at > %(since)s)
+UNION
+SELECT (change.response_created_at AT TIME ZONE %(time_zone)s)::date
+FROM change
+"""
+
+STALE_REGISTRATION_SUMMARY_DATES_QUERY = """
+SELECT DISTINCT (au.date_created AT TIME ZONE %(time_zone)s)::date
+FROM accounts_user au
+WHERE au.date_created > %(since)s
+"""
+
+# Columns left NULL are untouched (CASE hands back the stored value as-is, so its
+# TOASTed data isn't rewritten); the rest are merged into what's already stored.
+# An array of global event timings is appended to, anything else replaces it.
+RESPONSE_MERGE_PATCH_QUERY = """
+UPDATE studies_response
+SET exp_data                = CASE WHEN %(exp_data)s::jsonb IS NULL THEN exp_data
+                                   ELSE exp_data || %(exp_data)s::jsonb END,
+    conditions              = CASE WHEN %(conditions)s::jsonb IS NULL THEN conditions
+                                   ELSE conditions || %(conditions)s::jsonb END,
+    sequence                = CASE WHEN %(sequence)s::varchar[] IS NULL THEN sequence
+                                   ELSE sequence || %(sequence)s::varchar[] END,
+    global_event_timings    = CASE
+                                  WHEN %(global_event_timings)s::jsonb IS NULL THEN global_event_timings
+                                  WHEN jsonb_typeof(global_event_timings) = 'array'
+                                      AND jsonb_typeof(%(global_event_timings)s::jsonb) = 'array'
+                                      THEN global_event_timings || %(global_event_timings)s::jsonb
+                                  ELSE %(global_event_timings)s::jsonb END,
+    completed               = COALESCE(%(completed)s, completed),
+    completed_consent_frame = COALESCE(%(completed_consent_frame)s, completed_consent_frame),
+    version                 = version + 1,
+    date_modified           = %(date_modified)s
+WHERE id = %(id)s
+  AND (%(version)s::integer IS NULL OR version = %(version)s::integer)
+RETURNING version,
+    sequence[array_length(sequence, 1)],
+    exp_data -> sequence[array_length(sequence, 1)]
+"""
+
+RESPONSE_MERGE_PATCH_JSON_FIELDS = ("exp_data", "conditions", "global_event_timings")
+
+RESPONSE_MERGE_PATCH_FIELDS = RESPONSE_MERGE_PATCH_JSON_FIELDS + (
+    "sequence",
+    "completed",
+    "completed_consent_frame",
+)
+
+# Each exp_data frame of a set of responses, flattened as flatten_dict would into
+# arrays of keys and of values, after each response's global event timings as they
+# are. Frames are flattened one at a time, so that sorting their values back into
+# document order is cheap. `decoded` follows which nested objects
+# decode_datetime_objects looks inside, so that encoded objects are kept whole (to be
+# decoded as values) exactly where it would decode them.
+FRAME_DATA_QUERY = """
+SELECT response.uuid, child.uuid, study.uuid, study.salt, study.hash_digits,
+    frame.key, frame.keys, frame.values
+FROM studies_response response
+JOIN accounts_child child ON child.id = response.child_id
+JOIN studies_study study ON study.id = response.study_id
+CROSS JOIN LATERAL (
+    SELECT 0 AS number, 'global' AS key, NULL::text[] AS keys,
+        response.global_event_timings::text AS values
+    WHERE jsonb_typeof(response.global_event_timings) = 'array'
+  UNION ALL
+    SELECT frame.number, frame.key, flat.keys, flat.values
+    FROM jsonb_each(CASE jsonb_typeof(response.exp_data)
+                        WHEN 'object' THEN response.exp_data ELSE '{{}}' END)
+            WITH ORDINALITY frame (key, value, number),
+        LATERAL (
+            WITH RECURSIVE node (key, sort_path, value, decoded, encoded) AS (
+                SELECT NULL::text, ARRAY[]::bigint[], frame.value,
+                    NOT frame.value ? 'type', false
+              UNION ALL
+                SELECT COALESCE(node.key || '.', '') || child.key,
+                    node.sort_path || child.number, child.value,
+                    node.decoded AND NOT (child.in_object
+                                          AND jsonb_typeof(child.value) = 'object'
+                                          AND child.value ? 'type'),
+                    node.decoded AND child.in_object
+                        AND jsonb_typeof(child.value) = 'object'
+                        AND COALESCE(child.value ->> 'type' IN ('encoded_datetime',
+                                                                'encoded_date',
+                                                                'encoded_time',
+                                                                'encoded_decimal'),
+                                     false)
+                FROM node,
+                    LATERAL (
+                        SELECT member.key, member.value, member.number, true
+                        FROM jsonb_each(CASE jsonb_typeof(node.value)
+                                            WHEN 'object' THEN node.value
+                                            ELSE '{{}}' END)
+                            WITH ORDINALITY member (key, value, number)
+                        UNION ALL
+                        SELECT (element.number - 1)::text, element.value,
+                            element.number, false
+                        FROM jsonb_array_elements(CASE jsonb_typeof(node.value)
+                                                      WHEN 'array' THEN node.value
+                                                      ELSE '[]' END)
+                            WITH ORDINALITY element (value, number)
+                    ) child (key, value, number, in_object)
+                WHERE NOT node.encoded AND jsonb_typeof(node.value) IN ('object', 'array')
+            )
+            SELECT array_agg(key ORDER BY sort_path) AS keys,
+                jsonb_agg(value ORDER BY sort_path)::text AS values
+            FROM node
+            WHERE encoded OR jsonb_typeof(value) NOT IN ('object', 'array')
+        ) flat
+    WHERE jsonb_typeof(frame.value) = 'object' AND flat.keys IS NOT NULL
+) frame
+WHERE response.id IN ({response_ids})
+ORDER BY response.id, frame.number
+"""
+
+RESPONSE_SUMMARY_FIELDS = (
+    "date",
+    "study_id",
+    "current_ruling",
+    "child_gender",
+    "child_gestational_age_at_birth",
+    "child_age_in_months",
+    "country",
+    "num_responses",
+)
+
+REGISTRATION_SUMMARY_FIELDS = ("date", "num_registrations")
 
 
 class SubqueryCount(Subquery):
@@ -365,3 +552,244 @@ def get_study_list_qs(user, query_dict):
         queryset = queryset.order_by("ending_date")
 
     return queryset
+
+
+def merge_patch_response(response, patch, version=None):
+    """Merge a partial update into a response's session data with a single UPDATE.
+
+    New frames in exp_data (and keys of conditions) are added to the stored
+    documents, and sequence entries appended, without reading back or re-encoding
+    what's already there - so the cost of a frame transition doesn't grow with the
+    length of the session. As the UPDATE bypasses post_save, the frame action for
+    the resulting current frame is dispatched here instead.
+
+    Args:
+        response: The Response to update. Its session data columns may be deferred.
+        patch: Dict of validated values, keyed by a subset of RESPONSE_MERGE_PATCH_FIELDS.
+        version: If given, only apply the patch if the response is still at this version.
+
+    Returns:
+        The new version of the response, or None if it was no longer at `version`.
+    """
+    dumps = partial(json.dumps, cls=DateTimeAwareJSONEncoder)
+    params = {field: patch.get(field) for field in RESPONSE_MERGE_PATCH_FIELDS}
+    for field in RESPONSE_MERGE_PATCH_JSON_FIELDS:
+        if params[field] is not None:
+            params[field] = Json(params[field], dumps=dumps)
+    params.update(id=response.id, version=version, date_modified=timezone.now())
+
+    with connection.cursor() as cursor:
+        cursor.execute(RESPONSE_MERGE_PATCH_QUERY, params)
+        row = cursor.fetchone()
+
+    if row is None:
+        return None
+
+    response.version, current_frame_id, frame_data = row
+    if frame_data is not None:
+        dispatch_frame_action.dispatch(
+            response, current_frame_id, decode_datetime_objects(frame_data)
+        )
+    return response.version
+
+
+def _summary_watermark(summary_model):
+    """When the given summary table was last brought up to date, or None if never."""
+    return summary_model.objects.aggregate(Max("updated_at"))["updated_at__max"]
+
+
+def _refresh_summary(summary_model, summary_query, stale_dates_query, fields, rebuild):
+    """Recompute the rows of a daily summary table for every day that has changed.
+
+    Days are deleted and re-inserted wholesale, so summaries never drift from the
+    source tables. Running this twice in a row is cheap, because the second run
+    only finds the days touched in between.
+
+    Returns:
+        The number of days recomputed, or None if the whole table was rebuilt.
+    """
+    refreshed_at = timezone.now()
+    since = None if rebuild else _summary_watermark(summary_model)
+    table = summary_model._meta.db_table
+    columns = ", ".join(fields)
+    insert_query = (
+        f"INSERT INTO {table} ({columns}, updated_at) "
+        f"SELECT summary.*, %(updated_at)s FROM ({summary_query}) summary"
+    )
+    params = {"time_zone": settings.TIME_ZONE, "updated_at": refreshed_at}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if since is None:
+            summary_model.objects.all().delete()
+            cursor.execute(insert_query, {**params, "dates": None})
+            return None
+
+        cursor.execute(stale_dates_query, {**params, "since": since})
+        stale_dates = [row[0] for row in cursor.fetchall()]
+        # Bump the watermark even when nothing changed, so the live tail used by
+        # get_*_summaries starts from this run.
+        summary_model.objects.filter(date__in=stale_dates).delete()
+        summary_model.objects.filter(updated_at=since).update(updated_at=refreshed_at)
+        if stale_dates:
+            cursor.execute(insert_query, {**params, "dates": stale_dates})
+        return len(stale_dates)
+
+
+def refresh_response_summaries(rebuild=False):
+    return _refresh_summary(
+        ResponseSummary,
+        RESPONSE_SUMMARY_QUERY,
+        STALE_RESPONSE_SUMMARY_DATES_QUERY,
+        RESPONSE_SUMMARY_FIELDS,
+        rebuild,
+    )
+
+
+def refresh_registration_summaries(rebuild=False):
+    return _refresh_summary(
+        RegistrationSummary,
+        REGISTRATION_SUMMARY_QUERY,
+        STALE_REGISTRATION_SUMMARY_DATES_QUERY,
+        REGISTRATION_SUMMARY_FIELDS,
+        rebuild,
+    )
+
+
+def _live_summary_rows(summary_query, fields, dates):
+    with connection.cursor() as cursor:
+        cursor.execute(summary_query, {"time_zone": settings.TIME_ZONE, "dates": dates})
+        return [dict(zip(fields, row)) for row in cursor.fetchall()]
+
+
+def _summary_rows(summary_model, summary_query, fields, keep_row=None, **filters):
+    """Materialized summary rows, topped up with live rows for days since the last refresh.
+
+    The day of the last refresh is itself recomputed live, as it may have been only
+    partially over when the refresh ran.
+
+    Args:
+        keep_row: Predicate applied to live rows, equivalent to `filters`.
+        filters: Lookups applied to the materialized rows.
+    """
+    watermark = _summary_watermark(summary_model)
+    if watermark is None:
+        return list(filter(keep_row, _live_summary_rows(summary_query, fields, None)))
+
+    first_live_date = timezone.localdate(watermark)
+    live_dates = [
+        first_live_date + timedelta(days=offset)
+        for offset in range((timezone.localdate() - first_live_date).days + 1)
+    ]
+    materialized = summary_model.objects.filter(
+        date__lt=first_live_date, **filters
+    ).values(*fields)
+    live = _live_summary_rows(summary_query, fields, live_dates)
+    return list(materialized) + list(filter(keep_row, live))
+
+
+def get_response_summaries(study_ids=None):
+    """Daily response counts by study, consent ruling and demographic bucket.
+
+    Args:
+        study_ids: Optional iterable of study IDs to restrict to.
+
+    Returns:
+        A list of dicts with keys RESPONSE_SUMMARY_FIELDS.
+    """
+    if study_ids is None:
+        return _summary_rows(
+            ResponseSummary, RESPONSE_SUMMARY_QUERY, RESPONSE_SUMMARY_FIELDS
+        )
+    study_ids = set(study_ids)
+    return _summary_rows(
+        ResponseSummary,
+        RESPONSE_SUMMARY_QUERY,
+        RESPONSE_SUMMARY_FIELDS,
+        keep_row=lambda row: row["study_id"] in study_ids,
+        study_id__in=study_ids,
+    )
+
+
+def get_registration_summaries():
+    """Daily counts of new non-researcher accounts, as dicts with keys REGISTRATION_SUMMARY_FIELDS."""
+    return _summary_rows(
+        RegistrationSummary, REGISTRATION_SUMMARY_QUERY, REGISTRATION_SUMMARY_FIELDS
+    )
+
+
+def stream_frame_data(responses, chunk_size=200):
+    """Flatten the session data of a queryset of responses in the database.
+
+    Postgres unnests each frame of exp_data into the flattened keys and values
+    flatten_dict would give, which are fetched from a server-side cursor a chunk at
+    a time, so neither the responses nor their frames are ever all held in memory.
+
+    Args:
+        responses: Queryset of Responses. Frames come out in order of response id,
+            whatever the queryset's ordering.
+        chunk_size: Number of frames to fetch from the cursor at a time.
+
+    Yields:
+        Tuples of (response uuid, child uuid, study uuid, study salt, study hash
+        digits, frame id, frame data). The frame data is a dict of flattened keys to
+        values, apart from the frame "global", whose data is the response's global
+        event timings.
+    """
+    response_ids, params = responses.order_by().values("id").query.sql_with_params()
+    query = FRAME_DATA_QUERY.format(response_ids=response_ids)
+
+    # Outside a transaction the cursor is declared WITH HOLD, which has Postgres
+    # compute all of its rows up front.
+    with transaction.atomic(), connection.chunked_cursor() as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(query, params)
+        for *row, keys, values in cursor:
+            if keys is None:
+                yield (*row, decode_json_text(values))
+                continue
+            decoded_values = json.loads(values)
+            if ENCODED_OBJECT_PATTERN.search(values):
+                # The only objects among the values are encoded ones.
+                decoded_values = [
+                    decode_datetime_objects({"value": value})["value"]
+                    if isinstance(value, dict)
+                    else value
+                    for value in decoded_values
+                ]
+            yield (*row, dict(zip(keys, decoded_values)))
+
+
+DELETE_PREVIEW_VIDEOS_QUERY = """
+DELETE FROM studies_video
+WHERE response_id IN (SELECT id FROM studies_response WHERE study_id = %(study_id)s AND is_preview)
+RETURNING full_name
+"""
+
+
+def delete_preview_responses(study):
+    """Delete all of a study's preview responses, and their videos, a set at a time.
+
+    Videos are deleted in one statement rather than one by one, which would have
+    their pre_delete hook queue a task to delete each from S3. Instead, once the
+    deletion commits, they're deleted from S3 in batches as large as a single
+    DeleteObjects request allows - after the same week's delay.
+
+    Returns:
+        Number of responses and number of videos deleted.
+    """
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(DELETE_PREVIEW_VIDEOS_QUERY, {"study_id": study.id})
+            video_names = [full_name for (full_name,) in cursor.fetchall()]
+        # Logs, consent rulings and feedback go by cascades, a batch of responses at
+        # a time.
+        _, deleted = (
+            Response.objects.filter(study=study, is_preview=True).only("id").delete()
+        )
+        for batch in chunked(video_names, S3_DELETE_OBJECTS_MAX_KEYS):
+            transaction.on_commit(
+                lambda batch=batch: delete_videos_from_cloud.apply_async(
+                    args=(batch,), countdown=60 * 60 * 24 * 7
+                )
+            )
+    return deleted.get(Response._meta.label, 0), len(video_names)
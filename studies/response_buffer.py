@@ -0,0 +1,194 @@
+"""Write-behind buffer for the session data the frameplayer PATCHes into responses.
+
+With settings.RESPONSE_WRITE_BEHIND on, a PATCH of a response's session data is
+acknowledged once what it changes has been appended to the response's log of
+PendingResponseUpdates, instead of after rewriting the response (and its indexes)
+and running its post_save frame action. The frameplayer sends all of exp_data with
+every PATCH, but only the frames that are new or changed are logged, as are only the
+new entries of `sequence` and `global_event_timings` - so each PATCH is a small
+insert rather than another copy of the whole session. Successive PATCHes of the
+same response are coalesced when `studies.tasks.flush_response_updates` replays
+each response's log in order, writing the latest state of responses in batches.
+
+Reads through the API overlay pending updates, so they see the buffered state. An
+update that leaves the response on a frame with a frame-specific action (consent,
+exit) is flushed straight away, so FrameActionDispatcher runs when it always has.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from studies.models import PendingResponseUpdate, Response, dispatch_frame_action
+
+BUFFERED_FIELDS = (
+    "exp_data",
+    "conditions",
+    "sequence",
+    "global_event_timings",
+    "completed",
+    "completed_consent_frame",
+)
+
+# Objects that new members are usually just added to, and arrays that are usually
+# just appended to, so are logged as such when they can be.
+MERGED_FIELDS = ("exp_data", "conditions")
+APPENDED_FIELDS = ("sequence", "global_event_timings")
+
+
+def is_enabled():
+    return settings.RESPONSE_WRITE_BEHIND
+
+
+def can_buffer(validated_data) -> bool:
+    """Whether an update only touches session data, so may be buffered."""
+    return bool(validated_data) and set(validated_data) <= set(BUFFERED_FIELDS)
+
+
+def get_changes(response, validated_data):
+    """What an update changes about a response, to be logged in place of the update.
+
+    Returns:
+        A dict with any of the keys "set" (attributes to replace), "merge" (members
+        to add to or replace in object attributes) and "append" (entries to add to
+        array attributes), each keyed by field name. Empty if nothing changes.
+    """
+    changes = {}
+    for field, new_value in validated_data.items():
+        old_value = getattr(response, field)
+        if new_value == old_value:
+            continue
+        if (
+            field in MERGED_FIELDS
+            and isinstance(old_value, dict)
+            and isinstance(new_value, dict)
+            and old_value.keys() <= new_value.keys()
+        ):
+            changes.setdefault("merge", {})[field] = {
+                key: value
+                for key, value in new_value.items()
+                if key not in old_value or old_value[key] != value
+            }
+        elif (
+            field in APPENDED_FIELDS
+            and isinstance(old_value, list)
+            and isinstance(new_value, list)
+            and new_value[: len(old_value)] == old_value
+        ):
+            changes.setdefault("append", {})[field] = new_value[len(old_value) :]
+        else:
+            changes.setdefault("set", {})[field] = new_value
+    return changes
+
+
+def _apply(response, changes):
+    """Apply logged changes to a response in place, skipping any deferred fields."""
+    deferred = response.get_deferred_fields()
+    for field, value in changes.get("set", {}).items():
+        if field not in deferred:
+            setattr(response, field, value)
+    for field, members in changes.get("merge", {}).items():
+        if field not in deferred:
+            setattr(response, field, {**getattr(response, field), **members})
+    for field, entries in changes.get("append", {}).items():
+        if field not in deferred:
+            setattr(response, field, [*getattr(response, field), *entries])
+
+
+def apply_pending_updates(responses):
+    """Overlay any pending updates onto each of the given responses, in place.
+
+    Versions are bumped as they will be when the updates are flushed, and the ID of
+    the latest pending update of each is kept as `latest_pending_update_id`.
+    """
+    responses_by_id = {response.id: response for response in responses}
+    if not responses_by_id:
+        return
+    for pending in PendingResponseUpdate.objects.filter(
+        response_id__in=responses_by_id
+    ).order_by("id"):
+        response = responses_by_id[pending.response_id]
+        if getattr(response, "latest_pending_update_id", None) is None:
+            response.version += 1
+        _apply(response, pending.changes)
+        response.latest_pending_update_id = pending.id
+
+
+def buffer_update(response, validated_data):
+    """Log an update of a response's session data, and apply it to `response`.
+
+    Args:
+        response: The Response being updated, with any pending updates already
+            applied.
+        validated_data: Dict of new values, keyed by a subset of BUFFERED_FIELDS.
+    """
+    changes = get_changes(response, validated_data)
+    if changes:
+        pending = PendingResponseUpdate.objects.create(
+            response_id=response.id, changes=changes
+        )
+        _apply(response, changes)
+        if getattr(response, "latest_pending_update_id", None) is None:
+            response.version += 1
+        response.latest_pending_update_id = pending.id
+
+    if dispatch_frame_action.has_action(response):
+        flush_response_updates(response_ids=[response.id])
+
+
+def flush_response_updates(response_ids=None, batch_size=500):
+    """Replay pending updates onto their responses, a batch of responses at a time.
+
+    Responses are locked while their updates are written, so each response's log is
+    only ever replayed by one flush at a time, and in order.
+
+    Args:
+        response_ids: Only flush the updates of these responses, waiting for rather
+            than skipping any that are being flushed concurrently.
+        batch_size: How many responses to update per transaction.
+
+    Returns:
+        The number of responses updated.
+    """
+    flushed = 0
+    while True:
+        with transaction.atomic():
+            pending_responses = Response.objects.filter(
+                id__in=PendingResponseUpdate.objects.values("response_id")
+            ).order_by("id")
+            if response_ids is None:
+                pending_responses = pending_responses.select_for_update(
+                    skip_locked=True
+                )
+            else:
+                pending_responses = pending_responses.select_for_update().filter(
+                    id__in=response_ids
+                )
+            responses = {
+                response.id: response for response in pending_responses[:batch_size]
+            }
+            if not responses:
+                return flushed
+
+            updates = list(
+                PendingResponseUpdate.objects.filter(
+                    response_id__in=responses
+                ).order_by("id")
+            )
+            for update in updates:
+                _apply(responses[update.response_id], update.changes)
+            date_modified = timezone.now()
+            for response in responses.values():
+                response.version += 1
+                response.date_modified = date_modified
+            Response.objects.bulk_update(
+                responses.values(), BUFFERED_FIELDS + ("version", "date_modified"),
+            )
+            PendingResponseUpdate.objects.filter(
+                pk__in=[update.pk for update in updates]
+            ).delete()
+
+        # bulk_update doesn't send post_save, so do what take_action_on_exp_data would.
+        for response in responses.values():
+            if response.sequence:
+                dispatch_frame_action(response)
+        flushed += len(responses)
@@ -1,12 +1,19 @@
 from rest_framework_json_api import serializers
 
 from accounts.models import Child, DemographicData, User
+from accounts.serializers import (
+    BasicUserSerializer,
+    ChildSerializer,
+    DemographicDataSerializer,
+)
 from api.serializers import (
+    PassthroughJSONField,
     PatchedHyperlinkedRelatedField,
     PatchedResourceRelatedField,
     UuidHyperlinkedModelSerializer,
     UuidResourceModelSerializer,
 )
+from project.fields.datetime_aware_jsonfield import DateTimeAwareJSONField
 from studies.models import Feedback, Response, Study
 
 
@@ -78,6 +85,11 @@ class ResponseSerializer(UuidHyperlinkedModelSerializer):
     get_attribute from ResourceRelatedField
     """
 
+    serializer_field_mapping = {
+        **UuidHyperlinkedModelSerializer.serializer_field_mapping,
+        DateTimeAwareJSONField: PassthroughJSONField,
+    }
+
     created_on = serializers.DateTimeField(read_only=True, source="date_created")
     url = serializers.HyperlinkedIdentityField(
         view_name="api:response-detail", lookup_field="uuid"
@@ -111,6 +123,14 @@ class ResponseSerializer(UuidHyperlinkedModelSerializer):
         required=False,
     )
 
+    # What `include` may ask for. ResponseViewSet.get_included works out which
+    # related resources are actually included, and with what serializer.
+    included_serializers = {
+        "child": ChildSerializer,
+        "user": BasicUserSerializer,
+        "demographic_snapshot": DemographicDataSerializer,
+    }
+
     class Meta:
         model = Response
         fields = (
@@ -129,7 +149,9 @@ class ResponseSerializer(UuidHyperlinkedModelSerializer):
             "is_preview",
             "pk",
             "withdrawn",
+            "version",
         )
+        read_only_fields = ("version",)
 
 
 class ResponseWriteableSerializer(UuidResourceModelSerializer):
@@ -160,6 +182,11 @@ class ResponseWriteableSerializer(UuidResourceModelSerializer):
         ).user.latest_demographics.id
         return super().create(validated_data)
 
+    def update(self, instance, validated_data):
+        """Invalidate merge-patches based on the previous state."""
+        validated_data["version"] = instance.version + 1
+        return super().update(instance, validated_data)
+
     class Meta:
         model = Response
         fields = (
@@ -175,4 +202,23 @@ class ResponseWriteableSerializer(UuidResourceModelSerializer):
             "is_preview",
             "pk",
             "withdrawn",
+            "version",
         )
+        read_only_fields = ("version",)
+
+
+class ResponseMergePatchSerializer(serializers.Serializer):
+    """Validates a partial update of a response's session data.
+
+    New exp_data frames and conditions are merged into what's stored, sequence
+    entries are appended, and global event timings are appended to (if a list).
+    """
+
+    exp_data = serializers.DictField(required=False)
+    conditions = serializers.DictField(required=False)
+    sequence = serializers.ListField(
+        child=serializers.CharField(max_length=128), required=False
+    )
+    global_event_timings = serializers.JSONField(required=False)
+    completed = serializers.BooleanField(required=False)
+    completed_consent_frame = serializers.BooleanField(required=False)
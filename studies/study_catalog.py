@@ -0,0 +1,187 @@
+"""Shared, cached snapshot of the active public studies participants browse.
+
+The studies list page, the participant API list of studies and the study detail page
+would otherwise each query the studies table on every hit, for data that only
+changes when a study or lab is saved. Instead the public columns of every active
+public study, and of its lab, are kept in the Django cache (each study's structure
+and generator separately, as they're only sometimes needed); any save or delete of a
+Study (including the save in `Study._finalize_state_change` on every state
+transition) or Lab invalidates them, and the next reader rebuilds the catalog with
+two queries.
+
+Callers get Study instances back, just as from a queryset, so templates and
+serializers use them unchanged.
+"""
+import random
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from studies.models import Lab, Study
+
+PUBLIC_STUDY_CATALOG_CACHE_KEY = "studies.public_study_catalog"
+# Saves invalidate the catalog, so this only bounds how stale it can get if one of
+# those invalidations is somehow missed.
+PUBLIC_STUDY_CATALOG_CACHE_TIMEOUT = 60 * 60
+
+
+class PublicStudyCatalog:
+    """Active public studies, most recently modified first, with their labs."""
+
+    # Only what the participant pages and API show. The rest is left deferred on the
+    # instances, apart from the (often large) DETAIL_FIELDS, which are cached per study
+    # and only loaded when asked for.
+    STUDY_FIELDS = (
+        "id",
+        "uuid",
+        "name",
+        "date_modified",
+        "short_description",
+        "long_description",
+        "criteria",
+        "criteria_expression",
+        "duration",
+        "contact_info",
+        "compensation_description",
+        "min_age_days",
+        "min_age_months",
+        "min_age_years",
+        "max_age_days",
+        "max_age_months",
+        "max_age_years",
+        "image",
+        "lab_id",
+        "use_generator",
+        "display_full_screen",
+        "exit_url",
+        "state",
+        "public",
+        "built",
+    )
+    DETAIL_FIELDS = ("structure", "generator")
+    LAB_FIELDS = (
+        "id",
+        "uuid",
+        "name",
+        "institution",
+        "principal_investigator_name",
+        "contact_email",
+        "contact_phone",
+        "lab_website",
+        "description",
+        "irb_contact_info",
+        "approved_to_test",
+    )
+
+    def __init__(self, study_rows, lab_rows, built_at):
+        self.study_rows = study_rows
+        self.lab_rows = lab_rows
+        self.built_at = built_at
+        self._studies = None
+
+    def __len__(self):
+        return len(self.study_rows)
+
+    @classmethod
+    def build(cls):
+        studies = Study.objects.filter(state="active", public=True).order_by(
+            "-date_modified", "-id"
+        )
+        study_rows = list(studies.values_list(*cls.STUDY_FIELDS))
+        lab_rows = list(
+            Lab.objects.filter(study__in=studies)
+            .distinct()
+            .values_list(*cls.LAB_FIELDS)
+        )
+        return cls(study_rows, lab_rows, time.time())
+
+    def store(self):
+        cache.set(
+            PUBLIC_STUDY_CATALOG_CACHE_KEY,
+            (self.study_rows, self.lab_rows, self.built_at),
+            PUBLIC_STUDY_CATALOG_CACHE_TIMEOUT,
+        )
+
+    @classmethod
+    def load(cls):
+        """Get the cached catalog, building it now if there isn't one."""
+        data = cache.get(PUBLIC_STUDY_CATALOG_CACHE_KEY)
+        if data is not None:
+            return cls(*data)
+        catalog = cls.build()
+        catalog.store()
+        return catalog
+
+    @staticmethod
+    def invalidate():
+        """Drop the cached catalog, now and again once the current transaction commits.
+
+        The second delete stops a reader that rebuilt the catalog in between from
+        caching the state from before the transaction.
+        """
+        cache.delete(PUBLIC_STUDY_CATALOG_CACHE_KEY)
+        transaction.on_commit(lambda: cache.delete(PUBLIC_STUDY_CATALOG_CACHE_KEY))
+
+    @property
+    def studies(self):
+        """List of the catalog's Study instances, with their labs already attached."""
+        if self._studies is None:
+            labs = {
+                row[self.LAB_FIELDS.index("id")]: Lab.from_db(
+                    DEFAULT_DB_ALIAS, self.LAB_FIELDS, row
+                )
+                for row in self.lab_rows
+            }
+            self._studies = []
+            for row in self.study_rows:
+                study = Study.from_db(DEFAULT_DB_ALIAS, self.STUDY_FIELDS, row)
+                if study.lab_id is not None:
+                    study.lab = labs[study.lab_id]
+                self._studies.append(study)
+        return self._studies
+
+    def detail_fields_cache_key(self, study_id):
+        # Keyed by when the catalog was built, so the same invalidation that replaces
+        # the catalog leaves these behind, to expire.
+        return f"{PUBLIC_STUDY_CATALOG_CACHE_KEY}.{self.built_at!r}.{study_id}"
+
+    def load_detail_fields(self, studies):
+        """Attach DETAIL_FIELDS to some of the catalog's studies.
+
+        They come from the cache, and any that aren't there yet are fetched in one
+        query and cached alongside the catalog.
+
+        Args:
+            studies: Study instances from this catalog.
+        """
+        keys = {study.id: self.detail_fields_cache_key(study.id) for study in studies}
+        cached = cache.get_many(keys.values())
+        values_by_id = {
+            study_id: cached[key] for study_id, key in keys.items() if key in cached
+        }
+        missing = [study_id for study_id in keys if study_id not in values_by_id]
+        if missing:
+            fetched = {
+                study_id: tuple(values)
+                for study_id, *values in Study.objects.filter(
+                    id__in=missing
+                ).values_list("id", *self.DETAIL_FIELDS)
+            }
+            cache.set_many(
+                {keys[study_id]: values for study_id, values in fetched.items()},
+                PUBLIC_STUDY_CATALOG_CACHE_TIMEOUT,
+            )
+            values_by_id.update(fetched)
+        for study in studies:
+            for field, value in zip(self.DETAIL_FIELDS, values_by_id[study.id]):
+                setattr(study, field, value)
+
+    def get(self, uuid):
+        """The catalog's study with this uuid, or None."""
+        return next(
+            (study for study in self.studies if str(study.uuid) == str(uuid)), None
+        )
+
+    def shuffled(self):
+        return random.sample(self.studies, len(self.studies))
@@ -1,13 +1,11 @@
 import csv
 import datetime
-import hashlib
 import logging
 import os
 import random
 import shutil
 import tempfile
 import time
-import zipfile
 from collections import Counter
 from io import StringIO
 from itertools import starmap
@@ -17,24 +15,36 @@ from typing import Generator, NamedTuple
 import boto3
 import docker
 import requests
+from botocore.exceptions import ClientError
 from celery.utils.log import get_task_logger
 from django.conf import settings
-from django.db import connection
+from django.db import connection, transaction
 from django.utils import timezone
 from google.cloud import storage as gc_storage
 from more_itertools import chunked, first, flatten, groupby_transform, map_reduce
 
+from accounts.child_index import ChildIndex
 from accounts.models import Child, Message, User
 from accounts.queries import get_child_eligibility_for_study
 from project.celery import app
 from studies.experiment_builder import EmberFrameplayerBuilder
 from studies.helpers import send_mail
 from studies.permissions import StudyPermission
+from studies.video_archive import build_video_archive, invalidate_video_archives
 
 logger = get_task_logger(__name__)
 logger.setLevel(logging.DEBUG)
 
 S3_RESOURCE = boto3.resource("s3")
+# Most keys S3 will delete in one DeleteObjects request.
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+# How long a Pipe webhook may go unprocessed before it's queued again; well past
+# the last of ingest_pipe_video's own retries.
+PIPE_WEBHOOK_REQUEUE_AFTER_MINUTES = 30
+# How many times ingesting a Pipe webhook may fail on S3 (counting retries), and how
+# long after it was received it may still be requeued, before it's given up on.
+PIPE_WEBHOOK_MAX_ATTEMPTS = 18
+PIPE_WEBHOOK_REQUEUE_UNTIL_HOURS = 24
 
 DOCKER_CLIENT = docker.from_env()
 
@@ -254,6 +264,97 @@ def send_announcement_emails():
         Message.send_announcement_email(user, study, child_list)
 
 
+@app.task
+def build_child_index():
+    """Rebuild the columnar child index used for live audience-size estimates."""
+    ChildIndex.build().store()
+
+
+@app.task
+def update_analytics_summaries(rebuild=False):
+    """Bring the daily summaries behind participant analytics up to date."""
+    from studies.queries import (
+        refresh_registration_summaries,
+        refresh_response_summaries,
+    )
+
+    refresh_response_summaries(rebuild=rebuild)
+    refresh_registration_summaries(rebuild=rebuild)
+
+
+@app.task
+def flush_response_updates():
+    """Write the frameplayer updates held in the response write-behind buffer."""
+    from studies import response_buffer
+
+    response_buffer.flush_response_updates()
+
+
+@app.task(autoretry_for=(ClientError,), max_retries=5, retry_backoff=10)
+def ingest_pipe_video(pipe_numeric_id):
+    """Rename a video Pipe has uploaded and record it, from its saved webhook.
+
+    Does nothing if the webhook has been processed, or has failed, already. S3
+    errors, such as the upload not being found yet, are retried until the webhook
+    has had PIPE_WEBHOOK_MAX_ATTEMPTS; any other error fails it straight away, as
+    trying again won't help.
+    """
+    from studies.models import PipeWebhook, Video
+
+    retry_error = None
+    with transaction.atomic():
+        webhook = PipeWebhook.objects.select_for_update().get(
+            pipe_numeric_id=pipe_numeric_id
+        )
+        if webhook.processed_at or webhook.failed_at:
+            return
+        webhook.attempts += 1
+        try:
+            with transaction.atomic():
+                Video.from_pipe_payload(webhook.payload)
+        except ClientError as error:
+            webhook.last_error = repr(error)
+            if webhook.attempts >= PIPE_WEBHOOK_MAX_ATTEMPTS:
+                webhook.failed_at = timezone.now()
+            else:
+                retry_error = error
+        except Exception as error:
+            logger.exception(f"Could not ingest Pipe video {pipe_numeric_id}")
+            webhook.last_error = repr(error)
+            webhook.failed_at = timezone.now()
+        else:
+            webhook.processed_at = timezone.now()
+        webhook.save(
+            update_fields=["attempts", "processed_at", "failed_at", "last_error"]
+        )
+
+    # Only once the attempt has been recorded.
+    if retry_error:
+        raise retry_error
+
+
+@app.task
+def requeue_unprocessed_pipe_webhooks():
+    """Queue ingest_pipe_video again for webhooks that should have been processed.
+
+    Catches those whose task was lost, or ran out of retries before S3 caught up.
+    Failed webhooks, and any received too long ago to still be worth trying, are
+    left alone.
+    """
+    from studies.models import PipeWebhook
+
+    now = timezone.now()
+    for pipe_numeric_id in PipeWebhook.objects.filter(
+        processed_at__isnull=True,
+        failed_at__isnull=True,
+        received_at__lt=now
+        - datetime.timedelta(minutes=PIPE_WEBHOOK_REQUEUE_AFTER_MINUTES),
+        received_at__gte=now
+        - datetime.timedelta(hours=PIPE_WEBHOOK_REQUEUE_UNTIL_HOURS),
+    ).values_list("pipe_numeric_id", flat=True):
+        ingest_pipe_video.delay(pipe_numeric_id)
+
+
 @app.task(bind=True, max_retries=10, retry_backoff=10)
 def ember_build_and_gcp_deploy(self, study_uuid, researcher_uuid):
     """Celery task to build experiments.
@@ -319,7 +420,12 @@ def cleanup_docker_containers():
     DOCKER_CLIENT.containers.prune()
 
 
-@app.task(bind=True, max_retries=10, retry_backoff=10)
+@app.task(
+    bind=True,
+    autoretry_for=(requests.RequestException,),
+    max_retries=10,
+    retry_backoff=10,
+)
 def build_zipfile_of_videos(
     self, filename, study_uuid, match, requesting_user_uuid, consent_only=False
 ):
@@ -345,51 +451,41 @@ def build_zipfile_of_videos(
     if match:
         video_qs = video_qs.filter(full_name__contains=match)
 
-    m = hashlib.sha256()
-
-    for video in video_qs:
-        m.update(video.full_name.encode("utf-8"))
-    # create a sha256 of the included filenames
-    sha = m.hexdigest()
-    # use that sha in the filename
-    zip_filename = f"{filename}_{sha}.zip"
+    # Oldest first, so that new videos only change the archive's last segments.
+    videos = list(video_qs.order_by("created_at", "full_name"))
     # get the gc client
     gs_client = gc_storage.client.Client(project=settings.GS_PROJECT_ID)
     # get the bucket
     gs_private_bucket = gs_client.get_bucket(settings.GS_PRIVATE_BUCKET_NAME)
-    # instantiate a blob for the file
-    gs_blob = gc_storage.blob.Blob(
-        zip_filename, gs_private_bucket, chunk_size=256 * 1024 * 1024
-    )  # 256mb
 
-    # if the file exists short circuit and send the email with a 30m link
-    if not gs_blob.exists():
-        # if it doesn't exist build the zipfile
-        with tempfile.TemporaryDirectory() as temp_directory:
-            zip_file_path = os.path.join(temp_directory, zip_filename)
-            with zipfile.ZipFile(zip_file_path, "w") as zf:
-                for video in video_qs:
-                    temporary_file_path = os.path.join(temp_directory, video.full_name)
-                    file_response = requests.get(video.download_url, stream=True)
-                    with open(temporary_file_path, mode="w+b") as local_file:
-                        for chunk in file_response.iter_content(8192):
-                            local_file.write(chunk)
-                    zf.write(temporary_file_path, video.full_name)
-                    os.remove(temporary_file_path)
-
-            # upload the zip to GoogleCloudStorage
-            gs_blob.upload_from_filename(zip_file_path)
-
-    # then send the email with a 30m link
-    signed_url = gs_blob.generate_signed_url(
-        int(time.time() + datetime.timedelta(minutes=30).seconds)
+    # build whichever segments of the archive haven't been built before
+    manifest_blob, manifest = build_video_archive(
+        gs_private_bucket, study_uuid, filename, videos
     )
-    # send an email with the signed url and return
+
+    # then send the email with 24h links to each segment, and the manifest; a big
+    # study's archive has too many segments to download them all in less.
+    expiration = datetime.timedelta(hours=24)
+    archive_segments = [
+        dict(
+            segment,
+            signed_url=gs_private_bucket.blob(segment["name"]).generate_signed_url(
+                expiration,
+                response_disposition=f'attachment; filename="{segment["filename"]}"',
+            ),
+        )
+        for segment in manifest["segments"]
+    ]
+    manifest_url = manifest_blob.generate_signed_url(
+        expiration,
+        response_disposition=f'attachment; filename="{filename}_manifest.json"',
+    )
+    # send an email with the signed urls and return
     email_context = dict(
-        signed_url=signed_url,
+        archive_segments=archive_segments,
+        manifest_url=manifest_url,
         user=requesting_user,
         videos=video_qs,
-        zip_filename=zip_filename,
     )
     send_mail(
         "download_zip",
@@ -400,6 +496,19 @@ def build_zipfile_of_videos(
     )
 
 
+@app.task
+def invalidate_video_archive_segments(study_uuid, video_names):
+    """Delete stored archive segments holding videos whose consent was withdrawn."""
+    gs_client = gc_storage.client.Client(project=settings.GS_PROJECT_ID)
+    gs_private_bucket = gs_client.get_bucket(settings.GS_PRIVATE_BUCKET_NAME)
+    stale_segments = invalidate_video_archives(
+        gs_private_bucket, study_uuid, video_names
+    )
+    logger.info(
+        f"Deleted {len(stale_segments)} video archive segments of study {study_uuid}"
+    )
+
+
 @app.task
 def build_framedata_dict(filename, study_uuid, requesting_user_uuid):
     from studies.models import Study
@@ -408,16 +517,7 @@ def build_framedata_dict(filename, study_uuid, requesting_user_uuid):
 
     requesting_user = User.objects.get(uuid=requesting_user_uuid)
     study = Study.objects.get(uuid=study_uuid)
-    response_qs = study.responses_for_researcher(requesting_user).order_by("id")
-    responses = response_qs.select_related("child", "study").values(
-        "uuid",
-        "exp_data",
-        "child__uuid",
-        "study__uuid",
-        "study__salt",
-        "study__hash_digits",
-        "global_event_timings",
-    )
+    responses = study.responses_for_researcher(requesting_user)
 
     # make filename for this request unique by adding timestamp
     timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
@@ -481,4 +581,34 @@ def delete_video_from_cloud(task, s3_video_name):
 
     Meant to have a delay of about 7 days.
     """
+    from studies.models import BucketObject
+
     S3_RESOURCE.Object(settings.BUCKET_NAME, s3_video_name).delete()
+    BucketObject.objects.filter(key=s3_video_name).delete()
+
+
+@app.task
+def delete_videos_from_cloud(s3_video_names):
+    """Delete a batch of videos in S3 with a single request.
+
+    Takes at most S3_DELETE_OBJECTS_MAX_KEYS names.
+    """
+    from studies.models import BucketObject
+
+    result = S3_RESOURCE.Bucket(settings.BUCKET_NAME).delete_objects(
+        Delete={"Objects": [{"Key": name} for name in s3_video_names], "Quiet": True,}
+    )
+    failed = set()
+    for error in result.get("Errors", []):
+        logger.error(f"Could not delete {error['Key']} from S3: {error['Message']}")
+        failed.add(error["Key"])
+    BucketObject.objects.filter(key__in=set(s3_video_names) - failed).delete()
+
+
+@app.task
+def refresh_bucket_inventory():
+    """Update the local inventory of the video bucket from a listing of it."""
+    from studies.models import BucketObject
+
+    count = BucketObject.refresh_from_bucket()
+    logger.info(f"Listed {count} objects in bucket {settings.BUCKET_NAME}")
@@ -1,21 +1,60 @@
+import io
+import json
+import pickle
+import random
+import time
+import zipfile
+from collections import Counter
 from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
+import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django_dynamic_fixture import G
 from more_itertools import quantify
 
 from accounts.models import Child, Message, User
+from project.fields.datetime_aware_jsonfield import LazyDecodedJSON
+from studies.graphs import get_registration_data, get_response_timeseries_data
 from studies.helpers import send_mail
-from studies.models import Lab, Response, Study
+from studies.models import (
+    BucketObject,
+    ConsentRuling,
+    Lab,
+    RegistrationSummary,
+    Response,
+    ResponseSummary,
+    ResponseSummaryChange,
+    Study,
+    Video,
+)
+from studies.queries import (
+    get_annotated_responses_qs,
+    get_registration_summaries,
+    get_response_summaries,
+    refresh_registration_summaries,
+    refresh_response_summaries,
+)
 from studies.tasks import (
     MessageTarget,
     acquire_potential_announcement_email_targets,
+    delete_videos_from_cloud,
     limit_email_targets,
     potential_message_targets,
 )
+from studies.video_archive import (
+    VideoArchiveProgress,
+    build_video_archive,
+    invalidate_video_archives,
+    segment_videos,
+    write_videos_to_zip,
+)
 
 TARGET_EMAIL_TEMPLATE = """Dear Charlie,
 
@@ -590,3 +629,545 @@ class TestSendMail(TestCase):
             reply_to=reply_to,
         )
         self.assertEquals(email.reply_to, reply_to)
+
+
+class TestAnalyticsSummaries(TestCase):
+    def setUp(self):
+        self.study = G(
+            Study,
+            name="A summarized study",
+            image=SimpleUploadedFile(
+                "fake_image.png", b"fake-stuff", content_type="image/png"
+            ),
+        )
+        self.participant = G(User, is_active=True, is_researcher=False)
+        self.researcher = G(User, is_active=True, is_researcher=True)
+        self.child = G(
+            Child,
+            user=self.participant,
+            birthday=date.today() - timedelta(days=400),
+            gender="f",
+        )
+        self.responses = [
+            G(
+                Response,
+                child=self.child,
+                study=self.study,
+                completed_consent_frame=True,
+                demographic_snapshot=None,
+            )
+            for _ in range(3)
+        ]
+        # Neither of these should ever be counted.
+        G(
+            Response,
+            child=self.child,
+            study=self.study,
+            completed_consent_frame=True,
+            is_preview=True,
+        )
+        G(Response, child=self.child, study=self.study, completed_consent_frame=False)
+
+        self.ten_days_ago = timezone.now() - timedelta(days=10)
+        Response.objects.filter(id=self.responses[0].id).update(
+            date_created=self.ten_days_ago
+        )
+        G(ConsentRuling, response=self.responses[1], action="accepted")
+
+    def responses_by_ruling(self, summaries):
+        counts = Counter()
+        for summary in summaries:
+            counts[summary["current_ruling"]] += summary["num_responses"]
+        return counts
+
+    def test_rebuild_response_summaries(self):
+        refresh_response_summaries(rebuild=True)
+        summaries = ResponseSummary.objects.values()
+        self.assertEqual(
+            self.responses_by_ruling(summaries), {"accepted": 1, "pending": 2}
+        )
+        self.assertEqual(
+            {summary["date"] for summary in summaries},
+            {timezone.localdate(self.ten_days_ago), timezone.localdate()},
+        )
+        self.assertTrue(
+            all(summary["child_age_in_months"] >= 13 for summary in summaries)
+        )
+
+    def test_incremental_refresh_only_recomputes_changed_days(self):
+        refresh_response_summaries(rebuild=True)
+        G(ConsentRuling, response=self.responses[2], action="rejected")
+        self.assertEqual(refresh_response_summaries(), 1)
+        self.assertEqual(
+            self.responses_by_ruling(ResponseSummary.objects.values()),
+            {"accepted": 1, "pending": 1, "rejected": 1},
+        )
+        self.assertEqual(refresh_response_summaries(), 0)
+
+    def test_incremental_refresh_notices_deleted_responses(self):
+        refresh_response_summaries(rebuild=True)
+        self.responses[0].delete()
+        self.assertEqual(refresh_response_summaries(), 1)
+        self.assertEqual(
+            self.responses_by_ruling(ResponseSummary.objects.values()),
+            {"accepted": 1, "pending": 1},
+        )
+        self.assertFalse(ResponseSummaryChange.objects.exists())
+
+    def test_incremental_refresh_notices_edited_children(self):
+        refresh_response_summaries(rebuild=True)
+        Child.objects.filter(id=self.child.id).update(gender="m")
+        self.assertEqual(refresh_response_summaries(), 2)
+        self.assertEqual(
+            set(ResponseSummary.objects.values_list("child_gender", flat=True)), {"m"},
+        )
+        # Edits to anything summaries aren't bucketed by go unnoticed.
+        Child.objects.filter(id=self.child.id).update(given_name="Renamed")
+        self.assertEqual(refresh_response_summaries(), 0)
+
+    def test_response_summaries_include_days_since_last_refresh(self):
+        refresh_response_summaries(rebuild=True)
+        G(
+            Response,
+            child=self.child,
+            study=self.study,
+            completed_consent_frame=True,
+            demographic_snapshot=None,
+        )
+        self.assertEqual(
+            self.responses_by_ruling(get_response_summaries()),
+            {"accepted": 1, "pending": 3},
+        )
+        self.assertEqual(get_response_summaries(study_ids=[self.study.id + 1]), [])
+
+    def test_response_summaries_before_first_refresh(self):
+        self.assertEqual(
+            self.responses_by_ruling(get_response_summaries([self.study.id])),
+            {"accepted": 1, "pending": 2},
+        )
+
+    def test_registration_summaries_exclude_researchers(self):
+        participant_count = User.objects.filter(is_researcher=False).count()
+        self.assertEqual(
+            sum(day["num_registrations"] for day in get_registration_summaries()),
+            participant_count,
+        )
+        refresh_registration_summaries(rebuild=True)
+        self.assertEqual(
+            sum(
+                RegistrationSummary.objects.values_list("num_registrations", flat=True)
+            ),
+            participant_count,
+        )
+        G(User, is_researcher=False)
+        self.assertEqual(
+            sum(day["num_registrations"] for day in get_registration_summaries()),
+            participant_count + 1,
+        )
+
+
+class TestGraphData(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.study_one = G(Study, name="Study one")
+        self.study_two = G(Study, name="Study two")
+        self.child = G(Child, birthday=None)
+        self.responses = [
+            G(
+                Response,
+                child=self.child,
+                study=study,
+                completed_consent_frame=True,
+                demographic_snapshot=None,
+            )
+            for study in [self.study_one, self.study_two, self.study_one]
+        ]
+        G(ConsentRuling, response=self.responses[2], action="accepted")
+        self.responses_qs = get_annotated_responses_qs().filter(
+            study__in=[self.study_one, self.study_two]
+        )
+
+    def test_response_timeseries_data(self):
+        records, responses_per_date = get_response_timeseries_data(self.responses_qs)
+        records = json.loads(records)
+        self.assertEqual(
+            [
+                (
+                    record["study__name"],
+                    record["current_ruling"],
+                    record["total_cumulative_responses"],
+                    record["cumulative_count_per_study"],
+                    record["cumulative_count_per_ruling"],
+                    record["cumulative_count_per_study_by_ruling"],
+                )
+                for record in records
+            ],
+            [
+                ("Study one", "pending", 1, 0, 0, 0),
+                ("Study two", "pending", 2, 0, 1, 0),
+                ("Study one", "accepted", 3, 1, 0, 0),
+            ],
+        )
+        self.assertEqual(
+            sum(day["num_responses"] for day in json.loads(responses_per_date)), 3
+        )
+
+    def test_response_timeseries_data_is_cached_until_data_changes(self):
+        first = get_response_timeseries_data(self.responses_qs)
+        with self.assertNumQueries(1):  # Just the watermark
+            self.assertEqual(get_response_timeseries_data(self.responses_qs), first)
+
+        G(ConsentRuling, response=self.responses[0], action="rejected")
+        records, _ = get_response_timeseries_data(self.responses_qs)
+        self.assertEqual(json.loads(records)[0]["current_ruling"], "rejected")
+
+    def test_registration_data(self):
+        users = User.objects.filter(is_researcher=False)
+        records = json.loads(get_registration_data(users))
+        self.assertEqual(
+            sorted(record["cumulative_count"] for record in records),
+            list(range(1, users.count() + 1)),
+        )
+
+    def test_empty_querysets(self):
+        records, responses_per_date = get_response_timeseries_data(
+            self.responses_qs.none()
+        )
+        self.assertEqual(json.loads(records), [])
+
+
+class TestDateTimeAwareJSONField(TestCase):
+    def setUp(self):
+        self.timestamp = timezone.now()
+        self.response = G(
+            Response,
+            child=G(Child),
+            study=G(Study),
+            exp_data={"0-frame": {"startedAt": self.timestamp, "choices": [1, "a"]}},
+            global_event_timings=[{"eventType": "nextFrame"}],
+        )
+
+    def test_instance_decodes_on_first_access(self):
+        response = Response.objects.get(pk=self.response.pk)
+        self.assertIsInstance(response.__dict__["exp_data"], LazyDecodedJSON)
+        self.assertEqual(
+            response.exp_data,
+            {"0-frame": {"startedAt": self.timestamp, "choices": [1, "a"]}},
+        )
+        self.assertIs(response.__dict__["exp_data"], response.exp_data)
+        self.assertEqual(response.global_event_timings, [{"eventType": "nextFrame"}])
+
+    def test_values_are_decoded(self):
+        values = Response.objects.filter(pk=self.response.pk).values(
+            "exp_data", "study__structure"
+        )[0]
+        self.assertEqual(values["exp_data"]["0-frame"]["startedAt"], self.timestamp)
+        self.assertEqual(values["study__structure"], self.response.study.structure)
+        self.assertEqual(
+            Response.objects.filter(pk=self.response.pk)
+            .values_list("exp_data__0-frame", flat=True)
+            .get(),
+            {"startedAt": self.timestamp, "choices": [1, "a"]},
+        )
+
+    def test_undecoded_instance_pickles_and_saves(self):
+        response = pickle.loads(pickle.dumps(Response.objects.get(pk=self.response.pk)))
+        response.completed = True
+        response.save()
+        response = Response.objects.get(pk=self.response.pk)
+        self.assertTrue(response.completed)
+        self.assertEqual(response.exp_data["0-frame"]["startedAt"], self.timestamp)
+
+
+class FakeS3Response:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {"Content-Length": str(len(body))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), 3):
+            time.sleep(random.random() / 1000)
+            yield self.body[start : start + 3]
+
+
+@override_settings(VIDEO_ARCHIVE_DOWNLOAD_WORKERS=4)
+class TestVideoArchive(TestCase):
+    def setUp(self):
+        self.videos = [
+            SimpleNamespace(
+                full_name=f"videoStream_{n}.mp4", download_url=f"https://s3/video{n}"
+            )
+            for n in range(20)
+        ]
+        self.bodies = {
+            video.download_url: f"video {n} ".encode() * (20 - n)
+            for n, video in enumerate(self.videos)
+        }
+
+    def fake_get(self, url, **kwargs):
+        if url not in self.bodies:
+            return FakeS3Response(b"<Error>NoSuchKey</Error>", status_code=404)
+        return FakeS3Response(self.bodies[url])
+
+    def build_zip(self, videos, progress=None):
+        archive = io.BytesIO()
+        with patch.object(requests.Session, "get", autospec=True) as get:
+            get.side_effect = lambda session, url, **kwargs: self.fake_get(url)
+            with zipfile.ZipFile(archive, "w") as zf:
+                write_videos_to_zip(zf, videos, progress)
+        return zipfile.ZipFile(archive)
+
+    def test_videos_written_in_order(self):
+        zf = self.build_zip(self.videos)
+        self.assertEqual(
+            zf.namelist(), [video.full_name for video in self.videos],
+        )
+        for video in self.videos:
+            self.assertEqual(zf.read(video.full_name), self.bodies[video.download_url])
+
+    @override_settings(VIDEO_ARCHIVE_DOWNLOAD_BUFFER_SIZE=4)
+    def test_downloads_wait_for_writer_within_budget(self):
+        zf = self.build_zip(self.videos)
+        self.assertEqual(len(zf.namelist()), 20)
+
+    def test_failed_download_fails_archive(self):
+        videos = self.videos[:5] + [
+            SimpleNamespace(full_name="missing.mp4", download_url="https://s3/missing")
+        ]
+        with self.assertRaises(requests.HTTPError):
+            self.build_zip(videos + self.videos[5:])
+
+    def test_progress(self):
+        progress = VideoArchiveProgress("study_videos", len(self.videos))
+        progress.store()
+        self.assertEqual(VideoArchiveProgress.load("study_videos")["done"], 0)
+        self.assertIsNone(VideoArchiveProgress.load("study_videos")["eta_seconds"])
+        self.build_zip(self.videos, progress)
+        stored = VideoArchiveProgress.load("study_videos")
+        self.assertEqual(stored["done"], 20)
+        self.assertEqual(stored["bytes_written"], sum(map(len, self.bodies.values())))
+        self.assertEqual(stored["eta_seconds"], 0)
+        progress.clear()
+        self.assertIsNone(VideoArchiveProgress.load("study_videos"))
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def exists(self):
+        return self.name in self.bucket.contents
+
+    def upload_from_filename(self, filename):
+        with open(filename, "rb") as f:
+            self.bucket.contents[self.name] = f.read()
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.contents[self.name] = data.encode()
+
+    def download_as_string(self):
+        return self.bucket.contents[self.name]
+
+    def delete(self):
+        del self.bucket.contents[self.name]
+
+
+class FakeBucket:
+    def __init__(self):
+        self.contents = {}
+
+    def blob(self, name, chunk_size=None):
+        return FakeBlob(self, name)
+
+    def list_blobs(self, prefix=""):
+        return [
+            FakeBlob(self, name) for name in self.contents if name.startswith(prefix)
+        ]
+
+
+@override_settings(VIDEO_ARCHIVE_DOWNLOAD_WORKERS=4)
+class TestSegmentedVideoArchive(TestCase):
+    def setUp(self):
+        self.videos = [
+            SimpleNamespace(
+                full_name=f"videoStream_{n}.mp4", download_url=f"https://s3/video{n}"
+            )
+            for n in range(300)
+        ]
+        self.bucket = FakeBucket()
+        self.downloaded = []
+
+    def fake_get(self, session, url, **kwargs):
+        self.downloaded.append(url)
+        return FakeS3Response(url.encode())
+
+    def build(self, videos, archive_name="study_videos"):
+        with patch.object(requests.Session, "get", autospec=True) as get:
+            get.side_effect = self.fake_get
+            return build_video_archive(self.bucket, "study", archive_name, videos)
+
+    def test_new_videos_leave_earlier_segments_alone(self):
+        segments = segment_videos(self.videos[:250])
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(
+            [video for segment in segments for video in segment], self.videos[:250]
+        )
+        self.assertEqual(
+            segment_videos(self.videos)[: len(segments) - 1], segments[:-1]
+        )
+
+    def test_segments_reused(self):
+        _, manifest = self.build(self.videos[:250])
+        self.assertEqual(len(self.downloaded), 250)
+        segments = manifest["segments"]
+        segment_zip = zipfile.ZipFile(
+            io.BytesIO(self.bucket.contents[segments[0]["name"]])
+        )
+        self.assertEqual(segment_zip.namelist(), segments[0]["videos"])
+
+        self.downloaded = []
+        manifest_blob, manifest = self.build(self.videos)
+        built = [
+            segment
+            for segment in manifest["segments"]
+            if segment["name"] not in {segment["name"] for segment in segments}
+        ]
+        self.assertEqual(
+            sorted(self.downloaded),
+            sorted(
+                f"https://s3/video{name[len('videoStream_'):-len('.mp4')]}"
+                for segment in built
+                for name in segment["videos"]
+            ),
+        )
+        self.assertLess(len(self.downloaded), 250)
+        self.assertEqual(
+            [segment["name"] for segment in manifest["segments"]][: len(segments) - 1],
+            [segment["name"] for segment in segments[:-1]],
+        )
+        self.assertEqual(
+            json.loads(manifest_blob.download_as_string()), manifest,
+        )
+        self.assertIsNone(VideoArchiveProgress.load("study_videos"))
+
+    def test_withdrawn_videos_invalidate_segments(self):
+        _, manifest = self.build(self.videos[:250])
+        withdrawn = manifest["segments"][1]["videos"][0]
+        stale = invalidate_video_archives(self.bucket, "study", [withdrawn])
+        self.assertEqual(stale, {manifest["segments"][1]["name"]})
+        self.assertNotIn(manifest["segments"][1]["name"], self.bucket.contents)
+        self.assertIn(manifest["segments"][0]["name"], self.bucket.contents)
+        self.assertFalse(any(name.endswith(".json") for name in self.bucket.contents))
+
+    def test_consent_withdrawal_invalidates_archives(self):
+        study = G(Study)
+        response = G(Response, study=study, completed_consent_frame=True)
+        G(ConsentRuling, response=response, action="accepted")
+        G(Video, response=response, study=study, full_name="videoStream_x.mp4")
+        with patch("studies.models.transaction.on_commit") as on_commit, patch(
+            "studies.models.invalidate_video_archive_segments"
+        ) as invalidate:
+            on_commit.side_effect = lambda callback: callback()
+            G(ConsentRuling, response=response, action="pending")
+            G(ConsentRuling, response=response, action="rejected")
+        invalidate.delay.assert_called_once_with(str(study.uuid), ["videoStream_x.mp4"])
+
+
+class TestBucketInventory(TestCase):
+    def listing(self, *pages):
+        bucket = MagicMock()
+        bucket.objects.page_size.return_value.pages.return_value = [
+            [
+                SimpleNamespace(
+                    key=key,
+                    size=size,
+                    e_tag=f'"{key}-{size}"',
+                    last_modified=timezone.now(),
+                )
+                for key, size in page
+            ]
+            for page in pages
+        ]
+        return patch("studies.models.S3_BUCKET", bucket)
+
+    def test_refresh_from_bucket(self):
+        G(BucketObject, key="gone.mp4")
+        G(BucketObject, key="changed.mp4", size=1, etag='"changed.mp4-1"')
+        G(BucketObject, key="same.mp4", size=5, etag='"same.mp4-5"')
+        with self.listing([("changed.mp4", 2), ("new.mp4", 3)], [("same.mp4", 5)]):
+            self.assertEqual(BucketObject.refresh_from_bucket(), 3)
+        self.assertEqual(
+            dict(BucketObject.objects.values_list("key", "size")),
+            {"changed.mp4": 2, "new.mp4": 3, "same.mp4": 5},
+        )
+        self.assertEqual(
+            BucketObject.objects.get(key="changed.mp4").etag, '"changed.mp4-2"'
+        )
+
+    @patch("studies.tasks.S3_RESOURCE")
+    def test_delete_videos_from_cloud(self, s3_resource):
+        for key in ["a.mp4", "b.mp4", "c.mp4"]:
+            G(BucketObject, key=key)
+        delete_objects = s3_resource.Bucket.return_value.delete_objects
+        delete_objects.return_value = {
+            "Errors": [{"Key": "b.mp4", "Code": "AccessDenied", "Message": "No"}]
+        }
+        delete_videos_from_cloud(["a.mp4", "b.mp4"])
+        delete_objects.assert_called_once_with(
+            Delete={"Objects": [{"Key": "a.mp4"}, {"Key": "b.mp4"}], "Quiet": True}
+        )
+        self.assertCountEqual(
+            BucketObject.objects.values_list("key", flat=True), ["b.mp4", "c.mp4"]
+        )
+
+    def test_generate_videos_from_events(self):
+        study = G(Study)
+        event = {
+            "videoId": "videoStream_1",
+            "pipeId": "pipe1",
+            "streamTime": 1.5,
+            "timestamp": "2020-07-15T14:37:36.933Z",
+        }
+        response = G(
+            Response,
+            study=study,
+            exp_data={
+                "1-trial": {
+                    "videoList": ["videoStream_1"],
+                    "videoId": "videoStream_1",
+                    "eventTimings": [event, event],
+                },
+                "2-trial": {
+                    "videoList": ["videoStream_2"],
+                    "videoId": "videoStream_2",
+                    "frameType": "CONSENT",
+                    "eventTimings": [
+                        dict(event, videoId="videoStream_2", pipeId="pipe2"),
+                        dict(event, videoId="videoStream_3", pipeId="pipe3"),
+                    ],
+                },
+            },
+        )
+        G(BucketObject, key="videoStream_1.mp4", size=10)
+        G(BucketObject, key="pipe2.mp4", size=20)
+        with self.assertNumQueries(2):
+            videos = response.generate_videos_from_events()
+        self.assertEqual(
+            [
+                (video.full_name, video.size, video.is_consent_footage)
+                for video in videos
+            ],
+            [("videoStream_1.mp4", 10, False), ("videoStream_2.mp4", 20, True)],
+        )
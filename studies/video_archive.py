@@ -0,0 +1,403 @@
+"""Zip archives of study videos, for researchers to download.
+
+Videos are downloaded from S3 several at a time by a pool of threads, but written to
+the archive one after another, in order, each streamed straight into its entry as
+its chunks arrive rather than copied to a temporary file first. How far downloads
+can run ahead of the writer is bounded by a byte budget, so memory use stays flat
+however many videos there are.
+
+Progress is kept in the Django cache while an archive is built, for the study's
+videos page to show.
+
+An archive is stored as segments of a few dozen videos each, named by a hash of the
+videos in them, plus a manifest listing the segments. Where a segment ends depends
+only on the videos in it, never on what came before, so as new videos come in the
+earlier segments stay the same and only the newest are built again. A consent ruling
+withdrawing a response's videos deletes any segments that hold them.
+"""
+import hashlib
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Seconds to wait to connect to S3, and between bytes of a download.
+DOWNLOAD_TIMEOUT = 60
+VIDEO_ARCHIVE_PROGRESS_CACHE_TIMEOUT = 60 * 60 * 24
+# A segment ends after any video whose name hashes to a multiple of this, so holds
+# this many videos on average - but never more than the maximum.
+SEGMENT_TARGET_VIDEOS = 50
+SEGMENT_MAX_VIDEOS = 200
+SEGMENT_UPLOAD_CHUNK_SIZE = 256 * 1024 * 1024
+
+
+class DownloadsCancelled(Exception):
+    pass
+
+
+class ByteBudget:
+    """Limits how many downloaded bytes can wait to be written to the archive.
+
+    Downloads take from the budget a chunk at a time, and the writer gives back
+    what it's written. The download of the video being written (the head) may go
+    over the budget, so that later videos, having used it all up, can't hold up the
+    one they're all waiting on.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.head = 0
+        self.cancelled = False
+        self._condition = threading.Condition()
+
+    def acquire(self, size, index):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self.cancelled
+                or index <= self.head
+                or self.used + size <= self.limit
+            )
+            if self.cancelled:
+                raise DownloadsCancelled
+            self.used += size
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+    def advance(self, index):
+        with self._condition:
+            self.head = index
+            self._condition.notify_all()
+
+    def cancel(self):
+        with self._condition:
+            self.cancelled = True
+            self._condition.notify_all()
+
+
+class Download:
+    """Chunks of one file as its download comes in, in the order they arrive."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self._items = queue.Queue()
+        self._size = None
+        self._started = False
+
+    def _start(self):
+        if not self._started:
+            self._size = self._get()
+            self._started = True
+
+    def _get(self):
+        item = self._items.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    @property
+    def size(self):
+        """The file's Content-Length, or None if it didn't have one."""
+        self._start()
+        return self._size
+
+    def __iter__(self):
+        self._start()
+        while True:
+            chunk = self._get()
+            if chunk is None:
+                return
+            yield chunk
+            self.budget.release(len(chunk))
+
+
+def _download(session_local, get_url, download, index):
+    budget = download.budget
+    if budget.cancelled:
+        return
+    try:
+        session = getattr(session_local, "session", None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        with session.get(get_url(), stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            response.raise_for_status()
+            content_length = response.headers.get("Content-Length")
+            download._items.put(int(content_length) if content_length else None)
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                budget.acquire(len(chunk), index)
+                download._items.put(chunk)
+    except DownloadsCancelled:
+        return
+    except Exception as exc:
+        download._items.put(exc)
+    else:
+        download._items.put(None)
+
+
+def iter_downloads(url_getters, workers=None, buffer_size=None):
+    """Download files concurrently, giving back each one's Download in order.
+
+    Each Download must be read to the end before the next is taken; if reading one
+    raises, or the iterator is closed early, the remaining downloads are abandoned.
+
+    Args:
+        url_getters: Callables returning the URL of each file. URLs are only got
+            when their download starts, so presigned URLs don't expire waiting.
+        workers: Number of files to download at once.
+        buffer_size: Byte budget for chunks downloaded but not yet read.
+    """
+    workers = workers or settings.VIDEO_ARCHIVE_DOWNLOAD_WORKERS
+    budget = ByteBudget(buffer_size or settings.VIDEO_ARCHIVE_DOWNLOAD_BUFFER_SIZE)
+    session_local = threading.local()
+
+    with ThreadPoolExecutor(workers) as executor:
+        try:
+            downloads = []
+            for index, get_url in enumerate(url_getters):
+                download = Download(budget)
+                executor.submit(_download, session_local, get_url, download, index)
+                downloads.append(download)
+            for index, download in enumerate(downloads):
+                budget.advance(index)
+                yield download
+        finally:
+            budget.cancel()
+
+
+class VideoArchiveProgress:
+    """How far along the building of a video archive is, kept in the cache.
+
+    Archives are named after the study and kind of archive (see
+    StudyAttachments.post), so progress is keyed by that name.
+    """
+
+    def __init__(self, archive_name, total, started_at=None):
+        self.archive_name = archive_name
+        self.total = total
+        self.done = 0
+        self.bytes_written = 0
+        self.started_at = started_at or time.time()
+
+    @staticmethod
+    def cache_key(archive_name):
+        return f"studies.video_archive_progress.{archive_name}"
+
+    @property
+    def eta_seconds(self):
+        """Estimated seconds left, from the average time per video so far."""
+        if not self.done:
+            return None
+        elapsed = time.time() - self.started_at
+        return elapsed / self.done * (self.total - self.done)
+
+    def as_dict(self):
+        return {
+            "done": self.done,
+            "total": self.total,
+            "bytes_written": self.bytes_written,
+            "started_at": self.started_at,
+            "eta_seconds": self.eta_seconds,
+        }
+
+    def store(self):
+        cache.set(
+            self.cache_key(self.archive_name),
+            self.as_dict(),
+            VIDEO_ARCHIVE_PROGRESS_CACHE_TIMEOUT,
+        )
+
+    def clear(self):
+        cache.delete(self.cache_key(self.archive_name))
+
+    @classmethod
+    def load(cls, archive_name):
+        """Progress of the archive being built under this name, as a dict, or None."""
+        return cache.get(cls.cache_key(archive_name))
+
+
+def write_videos_to_zip(zf, videos, progress=None, downloads=None):
+    """Download videos into a zip file, each named by its full_name.
+
+    Args:
+        zf: ZipFile open for writing.
+        videos: List of Videos, in the order they're to be written.
+        progress: Optional VideoArchiveProgress to update as each video is written.
+        downloads: Optional iterator of the videos' Downloads, already started,
+            which is left open; by default the videos are downloaded here.
+    """
+    if downloads is not None:
+        for video, download in zip(videos, downloads):
+            _write_video(zf, video, download, progress)
+        return
+
+    downloads = iter_downloads(
+        [(lambda video=video: video.download_url) for video in videos]
+    )
+    try:
+        for video, download in zip(videos, downloads):
+            _write_video(zf, video, download, progress)
+    finally:
+        downloads.close()
+
+
+def _write_video(zf, video, download, progress):
+    size = download.size
+    force_zip64 = size is None or size > zipfile.ZIP64_LIMIT
+    with zf.open(video.full_name, "w", force_zip64=force_zip64) as entry:
+        for chunk in download:
+            entry.write(chunk)
+            if progress:
+                progress.bytes_written += len(chunk)
+    if progress:
+        progress.done += 1
+        progress.store()
+
+
+def _name_hash(*names):
+    return hashlib.sha256("\n".join(names).encode("utf-8")).hexdigest()
+
+
+def _ends_segment(video):
+    return int(_name_hash(video.full_name), 16) % SEGMENT_TARGET_VIDEOS == 0
+
+
+def segment_videos(videos):
+    """Split videos into the segments of their archive.
+
+    Args:
+        videos: Videos, oldest first, so new ones only change the last segments.
+
+    Returns:
+        List of lists of Videos.
+    """
+    segments = [[]]
+    for video in videos:
+        segment = segments[-1]
+        segment.append(video)
+        if _ends_segment(video) or len(segment) >= SEGMENT_MAX_VIDEOS:
+            segments.append([])
+    return [segment for segment in segments if segment]
+
+
+def archive_prefix(study_uuid):
+    return f"video_archives/{study_uuid}/"
+
+
+def segment_blob_name(study_uuid, videos):
+    return f"{archive_prefix(study_uuid)}segments/{_name_hash(*(video.full_name for video in videos))}.zip"
+
+
+def manifest_blob_name(study_uuid, archive_name, videos):
+    return f"{archive_prefix(study_uuid)}manifests/{archive_name}_{_name_hash(*(video.full_name for video in videos))}.json"
+
+
+def build_video_archive(bucket, study_uuid, archive_name, videos):
+    """Store the segments of an archive of videos, and its manifest, in a bucket.
+
+    Only segments not already in the bucket are built, with progress kept in the
+    cache under `archive_name` meanwhile.
+
+    Args:
+        bucket: Google Cloud Storage bucket to keep archives in.
+        study_uuid: UUID of the study the videos are from.
+        archive_name: Name of the kind of archive, as in StudyAttachments.post.
+        videos: Videos to archive, oldest first.
+
+    Returns:
+        The manifest's blob, and the manifest: a dict of the name of the archive
+        and a list of its segments, each a dict of the segment blob's name, the
+        filename to download it as and the names of its videos.
+    """
+    segments = [
+        (
+            segment,
+            bucket.blob(
+                segment_blob_name(study_uuid, segment),
+                chunk_size=SEGMENT_UPLOAD_CHUNK_SIZE,
+            ),
+        )
+        for segment in segment_videos(videos)
+    ]
+    missing = [(segment, blob) for segment, blob in segments if not blob.exists()]
+
+    if missing:
+        progress = VideoArchiveProgress(
+            archive_name, sum(len(segment) for segment, _ in missing)
+        )
+        progress.store()
+        # One lot of downloads for all of the missing segments, so the pool of
+        # workers doesn't drain at the end of each.
+        downloads = iter_downloads(
+            [
+                (lambda video=video: video.download_url)
+                for segment, _ in missing
+                for video in segment
+            ]
+        )
+        try:
+            with tempfile.TemporaryDirectory() as temp_directory:
+                for segment, blob in missing:
+                    zip_file_path = os.path.join(temp_directory, "segment.zip")
+                    with zipfile.ZipFile(zip_file_path, "w") as zf:
+                        write_videos_to_zip(zf, segment, progress, downloads)
+                    blob.upload_from_filename(zip_file_path)
+        finally:
+            downloads.close()
+            progress.clear()
+
+    manifest = {
+        "archive": archive_name,
+        "segments": [
+            {
+                "name": blob.name,
+                "filename": f"{archive_name}_part{number}_of_{len(segments)}.zip",
+                "videos": [video.full_name for video in segment],
+            }
+            for number, (segment, blob) in enumerate(segments, 1)
+        ],
+    }
+    manifest_blob = bucket.blob(manifest_blob_name(study_uuid, archive_name, videos))
+    manifest_blob.upload_from_string(
+        json.dumps(manifest, indent=2), content_type="application/json"
+    )
+    return manifest_blob, manifest
+
+
+def invalidate_video_archives(bucket, study_uuid, video_names):
+    """Delete the archive segments of a study holding any of these videos, and the
+    manifests listing them, so they're never served again.
+
+    Returns:
+        Names of the segments deleted.
+    """
+    video_names = set(video_names)
+    stale_segments = set()
+    for manifest_blob in bucket.list_blobs(
+        prefix=f"{archive_prefix(study_uuid)}manifests/"
+    ):
+        manifest = json.loads(manifest_blob.download_as_string())
+        stale = {
+            segment["name"]
+            for segment in manifest["segments"]
+            if not video_names.isdisjoint(segment["videos"])
+        }
+        if stale:
+            stale_segments |= stale
+            manifest_blob.delete()
+    for name in stale_segments:
+        blob = bucket.blob(name)
+        if blob.exists():
+            blob.delete()
+    return stale_segments
@@ -3,7 +3,9 @@ import datetime
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django_dynamic_fixture import G
 
@@ -387,27 +389,67 @@ class ParticipantStudyViewsTestCase(TestCase):
         self.assertIn("PublicActiveStudy2", content)
         self.assertNotIn("PrivateActiveStudy", content)
         self.assertNotIn("PublicInactiveStudy", content)
-        self.assertTrue(
-            response.context["study_list"]
-            .filter(uuid=self.public_active_study_1.uuid)
-            .exists()
+        self.assertIn(
+            self.public_active_study_1.uuid,
+            [study.uuid for study in response.context["study_list"]],
+        )
+        self.assertIn(
+            self.public_active_study_2.uuid,
+            [study.uuid for study in response.context["study_list"]],
         )
-        self.assertTrue(
-            response.context["study_list"]
-            .filter(uuid=self.public_active_study_2.uuid)
-            .exists()
+        self.assertNotIn(
+            self.private_active_study.uuid,
+            [study.uuid for study in response.context["study_list"]],
         )
-        self.assertFalse(
-            response.context["study_list"]
-            .filter(uuid=self.private_active_study.uuid)
-            .exists()
+        self.assertNotIn(
+            self.public_inactive_study.uuid,
+            [study.uuid for study in response.context["study_list"]],
         )
+
+    def test_study_list_view_served_from_catalog(self):
+        self.client.get(reverse("web:studies-list"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("web:studies-list"))
+        self.assertEqual(response.status_code, 200)
         self.assertFalse(
-            response.context["study_list"]
-            .filter(uuid=self.public_inactive_study.uuid)
-            .exists()
+            [query for query in queries if "studies_study" in query["sql"]]
         )
 
+    def test_study_list_view_after_study_paused(self):
+        self.client.get(reverse("web:studies-list"))
+        self.public_active_study_1.state = "paused"
+        self.public_active_study_1.save()
+        response = self.client.get(reverse("web:studies-list"))
+        self.assertNotIn(
+            self.public_active_study_1.uuid,
+            [study.uuid for study in response.context["study_list"]],
+        )
+        self.assertNotIn("PublicActiveStudy1", response.content.decode("utf-8"))
+
+    def test_study_list_view_after_lab_deleted(self):
+        other_lab = G(Lab, name="Other lab")
+        self.client.get(reverse("web:studies-list"))
+        other_lab.delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("web:studies-list"))
+        # Rebuilt, as the deleted lab may have been in the catalog.
+        self.assertTrue([query for query in queries if "studies_lab" in query["sql"]])
+
+    def test_study_detail_view_from_catalog(self):
+        self.client.get(reverse("web:studies-list"))
+        response = self.client.get(
+            reverse(
+                "web:study-detail", kwargs={"uuid": self.public_active_study_1.uuid}
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["study"].pk, self.public_active_study_1.pk)
+        response = self.client.get(
+            reverse("web:study-detail", kwargs={"uuid": self.private_active_study.uuid})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["study"].pk, self.private_active_study.pk)
+
 
 # TODO: StudyDetailView
 # - check can see for public or private active study, unauthenticated or authenticated
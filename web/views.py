@@ -16,6 +16,7 @@ from accounts import forms
 from accounts.models import Child, DemographicData, User
 from project import settings
 from studies.models import Response, Study, Video
+from studies.study_catalog import PublicStudyCatalog
 
 
 @receiver(signals.user_logged_out)
@@ -207,11 +208,12 @@ class StudiesListView(generic.ListView):
 
     template_name = "web/studies-list.html"
     model = Study
+    context_object_name = "study_list"
 
     def get_queryset(self):
         # TODO if we need to filter by study demographics vs user demographics
         # or by if they've taken the study before this is the spot
-        return super().get_queryset().filter(state="active", public=True).order_by("?")
+        return PublicStudyCatalog.load().shuffled()
 
 
 class StudiesHistoryView(LoginRequiredMixin, generic.ListView):
@@ -266,8 +268,12 @@ class StudyDetailView(generic.DetailView):
         Needed because view expecting pk or slug, but url has UUID. Looks up
         study by uuid.
         """
-        uuid = self.kwargs.get("uuid")
-        return get_object_or_404(Study, uuid=uuid)
+        if not hasattr(self, "object"):
+            uuid = self.kwargs.get("uuid")
+            study = PublicStudyCatalog.load().get(uuid)
+            # Private and inactive studies aren't in the catalog.
+            self.object = study or get_object_or_404(Study, uuid=uuid)
+        return self.object
 
     def get_context_data(self, **kwargs):
         """